@@ -131,6 +131,23 @@ CITY_ALIASES = {
 ALL_CITIES = MAJOR_CITIES + MEDIUM_CITIES + SMALL_CITIES
 
 
+def fold_city_name(city_name):
+    """Приводит название к ключу индекса: без учета регистра и различия ё/е"""
+    return city_name.strip().casefold().replace('ё', 'е')
+
+
+def _build_city_index():
+    """Строит индекс: свернутое название города или псевдонима -> каноническое название"""
+    city_index = {fold_city_name(city): city for city in ALL_CITIES}
+    # Псевдонимы приоритетнее городов, как и в точном поиске
+    city_index.update((fold_city_name(alias), city) for alias, city in CITY_ALIASES.items())
+    return city_index
+
+
+# Индекс для поиска города за O(1) независимо от размера справочника
+CITY_INDEX = _build_city_index()
+
+
 def get_all_cities():
     """Возвращает полный список городов"""
     return ALL_CITIES
@@ -141,24 +158,20 @@ def get_city_aliases():
     return CITY_ALIASES
 
 
+def get_city_index():
+    """Возвращает индекс: свернутое название города или псевдонима -> каноническое название"""
+    return CITY_INDEX
+
+
 def normalize_city_name(city_name):
     """Нормализует название города"""
     if not city_name:
         return None
 
-    city_name = city_name.strip()
-
-    # Проверяем альтернативные названия
-    if city_name in CITY_ALIASES:
-        return CITY_ALIASES[city_name]
-
-    # Проверяем точное совпадение
-    if city_name in ALL_CITIES:
-        return city_name
+    return CITY_INDEX.get(fold_city_name(city_name))
 
-    # Проверяем совпадение без учета регистра
-    for city in ALL_CITIES:
-        if city.lower() == city_name.lower():
-            return city
 
-    return None
+def normalize_many(tokens):
+    """Нормализует список слов; для слов, не являющихся городами, возвращает None"""
+    city_index = CITY_INDEX
+    return [city_index.get(fold_city_name(token)) if token else None for token in tokens]
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+def get_analysis_version(text_analyzer, event_detector):
+    """Версия результатов анализа постов: меняется вместе с логикой и словарями анализаторов"""
+    return f"{text_analyzer.get_version()}-{event_detector.get_version()}"
+
+
+class AnalysisCache:
+    """Кэш результатов анализа постов (города, адреса, признак события) по хэшу текста.
+
+    Одни и те же тексты повторяются в репостах и при повторной миграции, поэтому результат
+    анализа запоминается по хэшу текста и версии анализаторов. Перед SQLite файлом, который
+    переживает перезапуски, стоит LRU кэш в памяти. Записи другой версии удаляются при открытии,
+    а как только записей становится больше max_rows, удаляются давно не использованные"""
+
+    # Сколько хэшей подставлять в один запрос IN (...)
+    LOOKUP_BATCH_SIZE = 500
+    # До какой доли max_rows сокращается файл при превышении, чтобы не вытеснять на каждой записи
+    TRIM_RATIO = 0.9
+
+    def __init__(self, path, version, memory_size=50000, max_rows=1000000, timeout=60):
+        self.path = path
+        self.version = version
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.memory = OrderedDict()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                text_hash BLOB PRIMARY KEY,
+                version TEXT NOT NULL,
+                cities TEXT NOT NULL,
+                addresses TEXT NOT NULL,
+                is_event INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache(last_used)")
+
+        # Результаты прежних версий анализаторов больше не нужны
+        self.removed_stale = self.conn.execute("DELETE FROM analysis_cache WHERE version != ?",
+                                               (version,)).rowcount
+        self.conn.commit()
+        # Оценка числа записей сверху (файл могут пополнять и другие процессы): уточняется при вытеснении
+        self.rows_count = self._count_rows()
+
+    @classmethod
+    def open(cls, config, logger, version):
+        """Открывает кэш по настройкам мигратора; при ошибке логирует ее и возвращает None"""
+        if not config.analysis_cache:
+            return None
+
+        try:
+            return cls(config.analysis_cache_path, version, config.analysis_cache_memory_size,
+                       config.analysis_cache_max_rows, config.parallel_read_timeout)
+        except (sqlite3.Error, OSError) as e:
+            logger.log(f"Кэш результатов анализа отключен: не удалось открыть {config.analysis_cache_path} ({e})")
+            return None
+
+    def analyze(self, contents, start_analysis):
+        """Возвращает функцию получения результатов анализа contents.
+
+        Найденные в кэше тексты не анализируются, остальные (без повторов) передаются в
+        start_analysis, которая возвращает функцию получения их результатов. Так кэш работает
+        и с отложенными результатами пула процессов. Новые результаты сохраняются в кэш"""
+        keys = [self._hash(content) for content in contents]
+        cached = self.get_many(keys)
+
+        missing = {}
+        for key, content in zip(keys, contents):
+            if key not in cached and key not in missing:
+                missing[key] = content
+        self.misses += len(missing)
+
+        pending = start_analysis(list(missing.values()))
+
+        def collect():
+            analyzed = dict(zip(missing, pending()))
+            self.put_many(analyzed)
+            return [self._copy(cached[key] if key in cached else analyzed[key]) for key in keys]
+
+        return collect
+
+    def analyze_now(self, contents, analyze):
+        """Как analyze, но для синхронного анализа: analyze(тексты) сразу возвращает результаты"""
+        def start_analysis(missing):
+            results = analyze(missing)
+            return lambda: results
+
+        return self.analyze(contents, start_analysis)()
+
+    def get_many(self, keys):
+        """Ищет результаты по хэшам сначала в памяти, затем в файле; возвращает найденные"""
+        found = {}
+        missing = {}
+
+        for key in keys:
+            if key in found:
+                continue
+            result = self.memory.get(key)
+            if result is not None:
+                self.memory.move_to_end(key)
+                found[key] = result
+                self.memory_hits += 1
+            else:
+                missing[key] = None
+
+        missing = list(missing)
+        disk_found = []
+        for start in range(0, len(missing), self.LOOKUP_BATCH_SIZE):
+            batch = missing[start:start + self.LOOKUP_BATCH_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            rows = self.conn.execute(f"""
+                SELECT text_hash, cities, addresses, is_event FROM analysis_cache
+                WHERE version = ? AND text_hash IN ({placeholders})
+            """, (self.version, *batch))
+            for key, cities, addresses, is_event in rows:
+                result = (json.loads(cities), json.loads(addresses), bool(is_event))
+                found[key] = result
+                disk_found.append(key)
+                self._remember(key, result)
+
+        if disk_found:
+            self.disk_hits += len(disk_found)
+            # Отметка использования нужна для вытеснения давно не встречавшихся текстов
+            now = time.time()
+            self.conn.executemany("UPDATE analysis_cache SET last_used = ? WHERE text_hash = ?",
+                                  [(now, key) for key in disk_found])
+            self.conn.commit()
+
+        return found
+
+    def put_many(self, results):
+        """Сохраняет результаты анализа {хэш текста: (города, адреса, признак события)}"""
+        if not results:
+            return
+
+        now = time.time()
+        rows = []
+        for key, result in results.items():
+            cities, addresses, is_event = result
+            rows.append((key, self.version, json.dumps(cities, ensure_ascii=False),
+                         json.dumps(addresses, ensure_ascii=False), int(bool(is_event)), now))
+            self._remember(key, (list(cities), list(addresses), bool(is_event)))
+
+        self.conn.executemany("""
+            INSERT OR REPLACE INTO analysis_cache (text_hash, version, cities, addresses, is_event, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        self.stored += len(rows)
+        self.rows_count += len(rows)
+        if self.rows_count > self.max_rows:
+            self._evict(int(self.max_rows * self.TRIM_RATIO))
+        self.conn.commit()
+
+    def close(self):
+        """Вытесняет давно не использованные записи сверх max_rows и закрывает файл"""
+        self._evict(self.max_rows)
+        self.conn.commit()
+        self.conn.close()
+
+    def get_statistics(self):
+        """Возвращает счетчики попаданий, промахов, сохраненных и вытесненных записей"""
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'stored': self.stored,
+            'evicted': self.evicted,
+        }
+
+    def add_statistics(self, statistics):
+        """Добавляет счетчики кэша из другого процесса (например, процесса чтения дампа)"""
+        self.memory_hits += statistics['memory_hits']
+        self.disk_hits += statistics['disk_hits']
+        self.misses += statistics['misses']
+        self.stored += statistics['stored']
+        self.evicted += statistics['evicted']
+
+    def _count_rows(self):
+        """Число записей в файле кэша"""
+        return self.conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+
+    def _evict(self, target_rows):
+        """Если записей больше max_rows, оставляет target_rows самых недавно использованных"""
+        self.rows_count = self._count_rows()
+        if self.rows_count <= self.max_rows:
+            return
+
+        evicted = self.conn.execute("""
+            DELETE FROM analysis_cache WHERE text_hash IN (
+                SELECT text_hash FROM analysis_cache ORDER BY last_used LIMIT ?
+            )
+        """, (self.rows_count - target_rows,)).rowcount
+        self.evicted += evicted
+        self.rows_count -= evicted
+
+    def _remember(self, key, result):
+        """Кладет результат в LRU кэш в памяти, вытесняя самый давний"""
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    @staticmethod
+    def _hash(content):
+        """Хэш текста поста (версия анализаторов хранится в отдельном столбце)"""
+        return hashlib.blake2b((content or "").encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+    @staticmethod
+    def _copy(result):
+        """Копия результата: списки городов и адресов не должны разделяться между постами"""
+        cities, addresses, is_event = result
+        return list(cities), list(addresses), is_event
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Набор бенчмарков миграции VK на синтетических дампах
+
+Создает дампы SyntheticDumpGenerator и замеряет пропускную способность (строк/сек) и пиковую
+память (RSS) TextAnalyzer, EventDetector, DataMigrator и полного run_migration. Каждый замер
+идет в отдельном процессе, чтобы пик памяти относился только к нему; из повторов берется
+лучший результат. Результаты сохраняются в JSON и сравниваются с базовым замером: при падении
+скорости или росте памяти больше порога набор завершается с кодом 1. Без базового замера
+набор не запускается: его нужно сначала сохранить с --save-baseline.
+
+Запуск: python -m migrators.vk.BenchmarkSuite [--posts N] [--repeat N] [--baseline путь]
+        [--output путь] [--save-baseline] [--throughput-threshold доля] [--memory-threshold доля]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Добавляем путь к модулям
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from migrators.vk.ResourceUsage import get_peak_rss_mb
+from migrators.vk.SyntheticDumpGenerator import SyntheticDumpGenerator
+
+# Пачка для пакетного определения приглашений (как в DataMigrator при read_chunk_size по умолчанию)
+EVENT_BATCH_SIZE = 1000
+
+
+def load_contents(vk_db_path):
+    """Загружает тексты постов дампа"""
+    conn = sqlite3.connect(vk_db_path)
+    try:
+        return [text for (text,) in conn.execute("SELECT post_content FROM vk_posts ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def bench_text_analyzer(dumps_dir, work_dir):
+    """Поиск городов и адресов в текстах постов первого дампа"""
+    from migrators.vk.TextAnalyzer import TextAnalyzer
+    from migrators.vk.VKMigratorLogger import VKMigratorLogger
+
+    contents = load_contents(_dump_paths(dumps_dir)[0])
+    analyzer = TextAnalyzer(VKMigratorLogger(echo=False))
+
+    start_time = time.perf_counter()
+    for content in contents:
+        analyzer.extract_locations_and_addresses(content)
+    return len(contents), time.perf_counter() - start_time
+
+
+def bench_event_detector(dumps_dir, work_dir):
+    """Пакетное определение приглашений в текстах постов первого дампа"""
+    from migrators.vk.EventDetector import EventDetector
+
+    contents = load_contents(_dump_paths(dumps_dir)[0])
+    detector = EventDetector()
+
+    start_time = time.perf_counter()
+    for start in range(0, len(contents), EVENT_BATCH_SIZE):
+        detector.extract_features_batch(contents[start:start + EVENT_BATCH_SIZE])
+    return len(contents), time.perf_counter() - start_time
+
+
+def bench_data_migrator(dumps_dir, work_dir):
+    """Миграция групп и постов первого дампа в пустую целевую базу через DataMigrator (SQL-движок)"""
+    from migrators.vk.DataMigrator import DataMigrator
+    from migrators.vk.DatabaseManager import DatabaseManager
+    from migrators.vk.EventDetector import EventDetector
+    from migrators.vk.TextAnalyzer import TextAnalyzer
+    from migrators.vk.VKMigratorConfig import VKMigratorConfig
+    from migrators.vk.VKMigratorLogger import VKMigratorLogger
+
+    vk_db_path = _dump_paths(dumps_dir)[0]
+    config = VKMigratorConfig(os.path.join(work_dir, "data_migrator.db"), dumps_dir, analysis_cache=False)
+    logger = VKMigratorLogger(echo=False)
+    db_manager = DatabaseManager(config, logger)
+    db_manager.create_target_database()
+    data_migrator = DataMigrator(config, logger, TextAnalyzer(logger))
+    event_detector = EventDetector()
+
+    start_time = time.perf_counter()
+    vk_conn = db_manager.connect_vk_db(vk_db_path)
+    target_conn = db_manager.connect_target()
+    db_manager.attach_vk_db(target_conn, vk_db_path)
+    data_migrator.migrate_groups_to_orgs(vk_conn.cursor(), target_conn.cursor(), os.path.basename(vk_db_path))
+    data_migrator.migrate_posts_attached(target_conn.cursor(), os.path.basename(vk_db_path), event_detector)
+    target_conn.commit()
+    db_manager.detach_vk_db(target_conn)
+    target_conn.close()
+    vk_conn.close()
+    elapsed = time.perf_counter() - start_time
+
+    if data_migrator.failures:
+        raise RuntimeError("миграция дампа завершилась ошибкой (подробности в логе DataMigrator)")
+    return len(load_contents(vk_db_path)), elapsed
+
+
+def bench_run_migration(dumps_dir, work_dir):
+    """Полная миграция всех дампов в пустую базу (VKDataMigrator.run_migration, без кэша анализа)"""
+    from migrators.vk.VKDataMigrator import VKDataMigrator
+
+    # Консольный вывод мигратора не нужен: подробности остаются в его отчете
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        migrator = VKDataMigrator(os.path.join(work_dir, "run_migration.db"), dumps_dir, analysis_cache=False)
+
+        start_time = time.perf_counter()
+        migrator.run_migration()
+        elapsed = time.perf_counter() - start_time
+
+    rows = sum(len(load_contents(path)) for path in _dump_paths(dumps_dir))
+
+    # Время этапов из метрик мигратора - для поиска причины регрессии
+    with open(migrator.config.metrics_path, 'r', encoding='utf-8') as f:
+        stages = {name: stage['wall_s'] for name, stage in json.load(f)['stages'].items()}
+    return rows, elapsed, stages
+
+
+# Бенчмарк возвращает (строк, секунд) и, если замерено, время этапов {этап: секунд}
+BENCHMARKS = {
+    'text_analyzer': bench_text_analyzer,
+    'event_detector': bench_event_detector,
+    'data_migrator': bench_data_migrator,
+    'run_migration': bench_run_migration,
+}
+
+
+def _dump_paths(dumps_dir):
+    """Пути к дампам папки по порядку имен"""
+    return sorted(os.path.join(dumps_dir, name) for name in os.listdir(dumps_dir) if name.endswith(".db"))
+
+
+def _run_benchmark(name, dumps_dir, work_dir):
+    """Выполняет один бенчмарк в отдельном процессе и возвращает его замер"""
+    rows, seconds, *stages = BENCHMARKS[name](dumps_dir, work_dir)
+    peak_rss_mb = get_peak_rss_mb()
+    measurement = {
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb, 1) if peak_rss_mb is not None else None,
+    }
+    if stages:
+        measurement['stages_wall_s'] = stages[0]
+    return measurement
+
+
+def generate_dumps(dumps_dir, params):
+    """Создает синтетические дампы по параметрам набора"""
+    for number in range(params['dumps']):
+        generator = SyntheticDumpGenerator(params['groups'], params['posts'], params['duplicate_ratio'],
+                                           params['post_length'], seed=params['seed'] + number)
+        counters = generator.generate(os.path.join(dumps_dir, f"synthetic_{number}.db"))
+        print(f"Дамп {number + 1}: групп {counters['groups']}, постов {counters['posts']} "
+              f"(повторов {counters['duplicates']}, без группы {counters['orphans']})")
+
+
+def run_suite(params, names, repeat):
+    """Выполняет бенчмарки names на синтетических дампах и возвращает результаты"""
+    work_dir = tempfile.mkdtemp(prefix="vk_benchmark_")
+    try:
+        dumps_dir = os.path.join(work_dir, "dumps")
+        os.makedirs(dumps_dir)
+        generate_dumps(dumps_dir, params)
+
+        benchmarks = {}
+        context = multiprocessing.get_context("spawn")
+        for name in names:
+            measurements = []
+            for attempt in range(repeat):
+                attempt_dir = os.path.join(work_dir, f"{name}_{attempt}")
+                os.makedirs(attempt_dir)
+                # Новый процесс на каждый повтор: пик памяти не наследуется от предыдущих замеров
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    measurements.append(executor.submit(_run_benchmark, name, dumps_dir, attempt_dir).result())
+                shutil.rmtree(attempt_dir)
+
+            best = min(measurements, key=lambda measurement: measurement['seconds'])
+            peaks = [measurement['peak_rss_mb'] for measurement in measurements
+                     if measurement['peak_rss_mb'] is not None]
+            best['peak_rss_mb'] = min(peaks) if peaks else None
+            best['repeats'] = repeat
+            benchmarks[name] = best
+            print(f"{name}: {best['rows']} строк за {best['seconds']:.3f} сек, {best['rows_per_sec']:.0f} строк/сек, "
+                  f"пик памяти {best['peak_rss_mb']} МБ")
+
+        return {
+            'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'platform': {
+                'python': platform.python_version(),
+                'sqlite': sqlite3.sqlite_version,
+                'machine': platform.platform(),
+                'cpus': os.cpu_count(),
+            },
+            'params': params,
+            'benchmarks': benchmarks,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare_with_baseline(results, baseline, throughput_threshold, memory_threshold):
+    """Сравнивает результаты с базовым замером и возвращает список регрессий"""
+    if baseline['params'] != results['params']:
+        return [f"параметры набора отличаются от базового замера ({baseline['params']}), "
+                f"сравнение невозможно: пересоздайте его с --save-baseline"]
+
+    regressions = []
+    print("\n=== СРАВНЕНИЕ С БАЗОВЫМ ЗАМЕРОМ ===")
+    print(f"Базовый замер от {baseline['created']}")
+    for name, current in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            print(f"{name}: нет в базовом замере")
+            continue
+
+        throughput_change = current['rows_per_sec'] / base['rows_per_sec'] - 1
+        line = f"{name}: {current['rows_per_sec']:.0f} строк/сек (база {base['rows_per_sec']:.0f}, " \
+               f"{throughput_change:+.1%})"
+        if throughput_change < -throughput_threshold:
+            regressions.append(f"{name}: скорость упала на {-throughput_change:.1%} "
+                               f"(порог {throughput_threshold:.0%})")
+
+        if current['peak_rss_mb'] is not None and base['peak_rss_mb']:
+            memory_change = current['peak_rss_mb'] / base['peak_rss_mb'] - 1
+            line += f", память {current['peak_rss_mb']} МБ (база {base['peak_rss_mb']}, {memory_change:+.1%})"
+            if memory_change > memory_threshold:
+                regressions.append(f"{name}: пик памяти вырос на {memory_change:.1%} "
+                                   f"(порог {memory_threshold:.0%})")
+        print(line)
+
+    return regressions
+
+
+def save_json(path, data):
+    """Сохраняет данные в JSON файл"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def main():
+    """Выполняет набор бенчмарков, сохраняет результаты и проверяет регрессии"""
+    parser = argparse.ArgumentParser(description="Бенчмарки миграции VK на синтетических дампах")
+    parser.add_argument("--dumps", type=int, default=2, help="количество синтетических дампов")
+    parser.add_argument("--groups", type=int, default=100, help="групп в каждом дампе")
+    parser.add_argument("--posts", type=int, default=5000, help="строк vk_posts в каждом дампе")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="доля повторов постов")
+    parser.add_argument("--length", type=int, default=330, help="средняя длина поста, символов")
+    parser.add_argument("--seed", type=int, default=0, help="начальное значение генератора дампов")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="выполнить только эти бенчмарки")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов каждого бенчмарка (берется лучший)")
+    parser.add_argument("--output", default="./db/benchmark.vk.json", help="файл результатов")
+    parser.add_argument("--baseline", default="./db/benchmark_baseline.vk.json", help="файл базового замера")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как базовый замер")
+    parser.add_argument("--throughput-threshold", type=float, default=0.25,
+                        help="допустимое падение скорости (доля, по умолчанию 0.25)")
+    parser.add_argument("--memory-threshold", type=float, default=0.2,
+                        help="допустимый рост пика памяти (доля, по умолчанию 0.2)")
+    args = parser.parse_args()
+
+    # Без базового замера сравнивать не с чем: молча сохранить текущий - значит пропустить регрессию
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        parser.error(f"базовый замер {args.baseline} не найден; сохраните его запуском с --save-baseline")
+
+    params = {
+        'dumps': args.dumps,
+        'groups': args.groups,
+        'posts': args.posts,
+        'duplicate_ratio': args.duplicates,
+        'post_length': args.length,
+        'seed': args.seed,
+    }
+
+    print("=== БЕНЧМАРКИ МИГРАЦИИ VK ===")
+    results = run_suite(params, args.only or list(BENCHMARKS), args.repeat)
+    save_json(args.output, results)
+    print(f"Результаты сохранены: {args.output}")
+
+    if args.save_baseline:
+        save_json(args.baseline, results)
+        print(f"Базовый замер сохранен: {args.baseline}")
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    regressions = compare_with_baseline(results, baseline, args.throughput_threshold, args.memory_threshold)
+    if regressions:
+        print("\nРегрессии:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+
+    print("Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
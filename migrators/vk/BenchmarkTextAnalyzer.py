@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Микробенчмарки TextAnalyzer на корпусе VK дампов
+
+Сравнивает префиксное дерево (CityMatcher) с прежними регулярными выражениями
+и однопроходную очистку текста (TextCleaner) с прежней цепочкой re.sub,
+проверяя, что результаты совпадают.
+
+Запуск: python -m migrators.vk.BenchmarkTextAnalyzer [папка с дампами]
+"""
+
+import os
+import re
+import sys
+import time
+
+# Добавляем путь к модулям
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from migrators.cities import get_all_cities, get_city_aliases, normalize_city_name
+from migrators.vk.TestTextCleaner import legacy_clean_text, load_texts
+from migrators.vk.TextAnalyzer import TextAnalyzer
+from migrators.vk.TextCleaner import TextCleaner
+from migrators.vk.VKMigratorLogger import VKMigratorLogger
+
+
+class LegacyCityExtractor:
+    """Прежний поиск городов шестью регулярными выражениями (эталон для сравнения)"""
+
+    def __init__(self):
+        all_city_names = set(get_all_cities() + list(get_city_aliases().keys()))
+        sorted_cities = sorted(all_city_names, key=len, reverse=True)
+        cities_pattern = '|'.join(re.escape(city) for city in sorted_cities)
+
+        city_patterns = [
+            rf'\b(?:г\.?\s*)?({cities_pattern})\b',
+            rf'\b(?:в|из|до|от|по|на|под|над|при|около|возле|рядом\s+с)\s+(?:г\.?\s*)?({cities_pattern})\b',
+            rf'\b(?:город|гор\.)\s+({cities_pattern})\b',
+            rf'\b({cities_pattern})\s*(?:обл\.|область|край|республика|респ\.)',
+            rf'\b({cities_pattern})\s*,',
+            rf'["\(]({cities_pattern})[")\]]'
+        ]
+        self.compiled_city_patterns = [
+            re.compile(pattern, re.IGNORECASE | re.UNICODE)
+            for pattern in city_patterns
+        ]
+
+    def extract_cities(self, text):
+        """Извлекает города из текста"""
+        found_cities = set()
+
+        for pattern in self.compiled_city_patterns:
+            for match in pattern.finditer(text):
+                for group in match.groups():
+                    if group:
+                        normalized_city = normalize_city_name(group.strip())
+                        if normalized_city:
+                            found_cities.add(normalized_city)
+
+        words = re.findall(r'\b[А-Яа-яёЁ\-]+\b', text)
+        for word in words:
+            normalized_city = normalize_city_name(word)
+            if normalized_city and len(word) >= 3:
+                found_cities.add(normalized_city)
+
+        return found_cities
+
+
+def load_corpus(dumps_dir):
+    """Загружает очищенные тексты постов и описаний групп из всех дампов папки"""
+    analyzer = TextAnalyzer(VKMigratorLogger(echo=False))
+    texts = [analyzer._clean_text(text) for text in load_texts(dumps_dir) if text.strip()]
+    return analyzer, texts
+
+
+def benchmark(name, function, texts):
+    """Прогоняет функцию по всем текстам и печатает время"""
+    start_time = time.perf_counter()
+    results = [function(text) for text in texts]
+    elapsed = time.perf_counter() - start_time
+
+    print(f"{name}: {elapsed:.3f} сек, {len(texts) / elapsed:.0f} текстов/сек")
+    return results, elapsed
+
+
+def benchmark_city_matcher(dumps_dir):
+    """Сравнивает скорость и результат поиска городов"""
+    analyzer, texts = load_corpus(dumps_dir)
+    legacy = LegacyCityExtractor()
+
+    print("=== ПОИСК ГОРОДОВ ===")
+    print(f"Текстов в корпусе: {len(texts)}, символов: {sum(len(text) for text in texts)}")
+
+    legacy_results, legacy_time = benchmark("Регулярные выражения", legacy.extract_cities, texts)
+    matcher_results, matcher_time = benchmark("Префиксное дерево", analyzer.city_matcher.extract_cities, texts)
+    print(f"Ускорение: {legacy_time / matcher_time:.1f}x")
+
+    differences = [
+        (text, expected, actual)
+        for text, expected, actual in zip(texts, legacy_results, matcher_results)
+        if expected != actual
+    ]
+    print(f"Расхождений: {len(differences)}")
+    for text, expected, actual in differences[:5]:
+        print(f"  {text[:100]}")
+        print(f"    ожидалось: {sorted(expected)}, найдено: {sorted(actual)}")
+
+    return not differences
+
+
+def benchmark_text_cleaner(dumps_dir):
+    """Сравнивает скорость однопроходной очистки текста с прежней цепочкой re.sub"""
+    texts = load_texts(dumps_dir)
+    cleaner = TextCleaner()
+
+    print("\n=== ОЧИСТКА ТЕКСТА ===")
+    print(f"Текстов в корпусе: {len(texts)}, символов: {sum(len(text) for text in texts)}")
+
+    legacy_results, legacy_time = benchmark("Цепочка re.sub", legacy_clean_text, texts)
+    cleaner_results, cleaner_time = benchmark("Один проход", cleaner.clean, texts)
+    print(f"Ускорение: {legacy_time / cleaner_time:.1f}x")
+
+    differences = sum(1 for expected, actual in zip(legacy_results, cleaner_results) if expected != actual)
+    print(f"Расхождений: {differences}")
+    return not differences
+
+
+if __name__ == "__main__":
+    dumps_dir = sys.argv[1] if len(sys.argv) > 1 else "./dumps/vk/"
+    cities_ok = benchmark_city_matcher(dumps_dir)
+    cleaner_ok = benchmark_text_cleaner(dumps_dir)
+    sys.exit(0 if cities_ok and cleaner_ok else 1)
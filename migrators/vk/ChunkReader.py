@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+class ChunkReader:
+    """Потоковое чтение таблиц VK дампа пачками ограниченного размера"""
+
+    def __init__(self, config):
+        self.config = config
+
+    @property
+    def max_chunk_bytes(self):
+        """Предельный объем текстовых данных в одной пачке"""
+        return int(self.config.read_chunk_max_mb * 1024 * 1024)
+
+    def iter_chunks(self, cursor, query, params=()):
+        """Выполняет запрос и отдает результат пачками по мере чтения курсора.
+
+        Пачка закрывается по достижении read_chunk_size строк или read_chunk_max_mb текста,
+        поэтому в памяти одновременно находится не больше одной пачки"""
+        cursor.execute(query, params)
+
+        chunk = []
+        chunk_bytes = 0
+        while True:
+            rows = cursor.fetchmany(self.config.read_chunk_size)
+            if not rows:
+                break
+
+            for row in rows:
+                chunk.append(row)
+                chunk_bytes += self._row_size(row)
+                if len(chunk) >= self.config.read_chunk_size or chunk_bytes >= self.max_chunk_bytes:
+                    yield chunk
+                    chunk = []
+                    chunk_bytes = 0
+
+        if chunk:
+            yield chunk
+
+    def iter_keyset_chunks(self, cursor, query, params=(), last_id=0):
+        """Постранично читает результат запроса по возрастанию ключа (rowid).
+
+        Запрос должен возвращать ключ первым столбцом и принимать последними параметрами
+        нижнюю границу ключа и LIMIT: "... WHERE id > ? ORDER BY id LIMIT ?".
+        Каждая страница - отдельный короткий запрос, поэтому между страницами можно писать
+        в ту же базу и фиксировать транзакции. Если страница превысила лимит по объему,
+        следующие читаются меньшими порциями"""
+        limit = self.config.read_chunk_size
+
+        while True:
+            cursor.execute(query, (*params, last_id, limit))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            last_id = rows[-1][0]
+            yield rows
+
+            chunk_bytes = sum(self._row_size(row) for row in rows)
+            if chunk_bytes > self.max_chunk_bytes:
+                limit = max(1, limit // 2)
+            elif chunk_bytes < self.max_chunk_bytes // 2:
+                limit = min(self.config.read_chunk_size, limit * 2)
+
+    @staticmethod
+    def _row_size(row):
+        """Оценивает объем строки по ее текстовым и бинарным полям"""
+        return sum(len(value) for value in row if isinstance(value, (str, bytes)))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+from collections import namedtuple
+
+from migrators.cities import fold_city_name, normalize_city_name, normalize_many
+
+# Упоминание города в тексте: нормализованное название, позиция и контексты упоминания
+CityMention = namedtuple('CityMention', ['city', 'start', 'end', 'contexts'])
+
+
+class CityMatcher:
+    """Поиск упоминаний городов за один проход по тексту с помощью префиксного дерева (trie).
+
+    Вместо регулярных выражений с альтернативой из всех городов и псевдонимов дерево строится
+    один раз, а текст проходится только от начал слов, поэтому стоимость поиска не зависит
+    от размера справочника. Семантика совпадает с прежним набором регулярных выражений:
+    на каждой позиции берется самое длинное название с границей слова (или с последующим
+    "обл."/"край"/...; склеенное с префиксом "г" название - только с границей слова), допускается
+    префикс "г."/"г", найденные упоминания не перекрываются, а отдельные слова дополнительно
+    проверяются целиком"""
+
+    # Ключ конечного узла в дереве (символы - всегда строки)
+    _END = None
+
+    _WORD_START = re.compile(r'\b\w')
+    _WORD = re.compile(r'\b[А-Яа-яёЁ\-]+\b')
+    _CITY_PREFIX = re.compile(r'г\.?\s*', re.IGNORECASE)
+    _REGION_SUFFIX = re.compile(r'\s*(?:обл\.|область|край|республика|респ\.)', re.IGNORECASE)
+
+    # Контексты упоминания (проверяются только в find_mentions)
+    _PREPOSITION_BEFORE = re.compile(
+        r'\b(?:в|из|до|от|по|на|под|над|при|около|возле|рядом\s+с)\s+(?:г\.?\s*)?$', re.IGNORECASE)
+    _CITY_WORD_BEFORE = re.compile(r'\b(?:город|гор\.)\s+$', re.IGNORECASE)
+    _COMMA_AFTER = re.compile(r'\s*,')
+
+    def __init__(self, names):
+        self.root = {}
+        self.names_count = 0
+        for name in names:
+            self._add(name)
+
+    def _add(self, name):
+        """Добавляет название в дерево (без учета регистра и различия ё/е)"""
+        node = self.root
+        for char in fold_city_name(name):
+            node = node.setdefault(char, {})
+        if self._END not in node:
+            node[self._END] = True
+            self.names_count += 1
+
+    def extract_cities(self, text):
+        """Возвращает множество нормализованных городов, упомянутых в тексте"""
+        found_cities = set()
+        for _, start, end in self._iter_matches(self._fold(text), text):
+            city = normalize_city_name(text[start:end])
+            if city:
+                found_cities.add(city)
+
+        found_cities.update(self._extract_word_cities(text))
+        return found_cities
+
+    def find_mentions(self, text):
+        """Возвращает упоминания городов с контекстами: "предлог", "г.", "город",
+        "область", "запятая", "кавычки" """
+        mentions = []
+        for mention_start, start, end in self._iter_matches(self._fold(text), text):
+            city = normalize_city_name(text[start:end])
+            if city:
+                contexts = self._get_contexts(text, mention_start, start, end)
+                mentions.append(CityMention(city, start, end, contexts))
+        return mentions
+
+    def _iter_matches(self, folded, text):
+        """Отдает неперекрывающиеся самые длинные совпадения от начал слов.
+
+        Каждое совпадение - (начало упоминания с префиксом "г.", начало названия, конец названия)"""
+        consumed_end = 0
+
+        for word_start in self._WORD_START.finditer(folded):
+            start = word_start.start()
+            if start < consumed_end:
+                continue
+
+            match = None
+
+            # Как и в регулярном выражении, сначала пробуем вариант с префиксом "г."
+            if folded[start] == 'г':
+                prefix = self._CITY_PREFIX.match(folded, start)
+                # Склеенное с "г" название ("гМосква") не начинается с границы слова, поэтому
+                # перед "обл."/"край"/... не засчитывается (там граница слова обязательна)
+                match = self._longest_match(text, folded, prefix.end(), self._is_word_start(text, prefix.end()))
+
+            if match is None:
+                match = self._longest_match(text, folded, start)
+
+            if match is not None:
+                consumed_end = match[1]
+                yield (start, *match)
+
+    def _longest_match(self, text, folded, start, region_allowed=True):
+        """Ищет самое длинное название из дерева, начинающееся в позиции start;
+        region_allowed - можно ли закончить название перед "обл."/"край"/... без границы слова"""
+        node = self.root
+        best_end = None
+        position = start
+        length = len(folded)
+
+        while position < length:
+            node = node.get(folded[position])
+            if node is None:
+                break
+            position += 1
+            if self._END in node and self._is_valid_end(text, position, region_allowed):
+                best_end = position
+
+        return (start, best_end) if best_end is not None else None
+
+    def _is_valid_end(self, text, position, region_allowed=True):
+        """Название должно заканчиваться на границе слова или перед "обл."/"край"/..."""
+        if position == len(text):
+            return True
+        char = text[position]
+        if not (char.isalnum() or char == '_'):
+            return True
+        return region_allowed and self._REGION_SUFFIX.match(text, position) is not None
+
+    @staticmethod
+    def _is_word_start(text, position):
+        """Есть ли граница слова перед позицией position (как \\b перед словом)"""
+        if position == 0:
+            return True
+        char = text[position - 1]
+        return not (char.isalnum() or char == '_')
+
+    def _extract_word_cities(self, text):
+        """Проверяет отдельные слова целиком (включая слова внутри уже найденных названий)"""
+        words = [word for word in self._WORD.findall(text) if len(word) >= 3]
+        return {city for city in normalize_many(words) if city}
+
+    def _get_contexts(self, text, mention_start, start, end):
+        """Определяет контексты упоминания города"""
+        contexts = []
+        if mention_start != start:
+            contexts.append("г.")
+
+        before = text[max(0, mention_start - 40):mention_start]
+        if self._PREPOSITION_BEFORE.search(before):
+            contexts.append("предлог")
+        if self._CITY_WORD_BEFORE.search(before):
+            contexts.append("город")
+        if self._REGION_SUFFIX.match(text, end):
+            contexts.append("область")
+        if self._COMMA_AFTER.match(text, end):
+            contexts.append("запятая")
+        if start > 0 and end < len(text) and text[start - 1] in '"(' and text[end] in '")]':
+            contexts.append("кавычки")
+        return contexts
+
+    @staticmethod
+    def _fold(text):
+        """Сворачивает регистр и ё/е в тексте, сохраняя позиции символов"""
+        folded = text.lower()
+        if len(folded) != len(text):
+            folded = ''.join(char if len(char.lower()) != 1 else char.lower() for char in text)
+        return folded.replace('ё', 'е')
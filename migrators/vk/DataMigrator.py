@@ -2,173 +2,692 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
+
+from migrators.vk.ChunkReader import ChunkReader
+from migrators.vk.EnrichmentPool import analyze_org, analyze_posts
+from migrators.vk.MigrationStats import MigrationStats
+from migrators.vk.PipelineMetrics import PipelineMetrics
 
 
 class DataMigrator:
     """Мигратор данных из VK в целевую базу"""
 
-    def __init__(self, config, logger, text_analyzer):
+    GROUPS_QUERY = ("SELECT url, descr, last_checked_date, last_post_date, last_event_date FROM vk_groups "
+                    "WHERE id > ? ORDER BY id")
+
+    def __init__(self, config, logger, text_analyzer, metrics=None):
         self.config = config
         self.logger = logger
         self.text_analyzer = text_analyzer
+        # Время этапов: чтение дампа, анализ, отсечение существующих, запись, фиксации
+        self.metrics = metrics if metrics is not None else PipelineMetrics(enabled=False)
+        self.reader = ChunkReader(config)
+        self.enrichment_pool = None  # Пул процессов для анализа текстов (при workers > 1)
+        self.analysis_cache = None  # Кэш результатов анализа постов по хэшу текста
+        self.failures = 0  # Сколько раз миграция групп или постов прервалась ошибкой
+        self.orphan_rowids = []  # rowid постов без организации в последнем файле
+        self.checkpointer = None  # Промежуточные фиксации с контрольной точкой (Checkpointer)
+
+    def migrate_groups_to_orgs(self, vk_cursor, target_cursor, source_file, start_rowid=0):
+        """Мигрирует данные из vk_groups в orgs с анализом городов (группы с rowid > start_rowid)"""
+        if self.config.orgs_bulk_mode:
+            return self.migrate_groups_to_orgs_bulk(vk_cursor, target_cursor, source_file, start_rowid)
 
-    def migrate_groups_to_orgs(self, vk_cursor, target_cursor, source_file):
-        """Мигрирует данные из vk_groups в orgs с анализом городов"""
         try:
-            # Получаем все группы из VK базы
-            vk_cursor.execute("SELECT url, descr, last_checked_date, last_post_date, last_event_date FROM vk_groups")
-            vk_groups = vk_cursor.fetchall()
+            start_time = time.perf_counter()
 
-            self.logger.log(f"Найдено {len(vk_groups)} групп в {source_file}")
+            groups_count = self._count_rows(vk_cursor, "vk_groups", start_rowid)
+
+            self.logger.log(f"Найдено {groups_count} {'новых ' if start_rowid else ''}групп в {source_file}")
 
             migrated_count = 0
             skipped_count = 0
 
-            for group in vk_groups:
+            # Читаем группы из VK базы пачками
+            for group in self._iter_rows(vk_cursor, self.GROUPS_QUERY, (start_rowid,)):
                 url, descr, last_checked_date, last_post_date, last_event_date = group
 
                 # Проверяем, есть ли уже такая организация в основной базе
-                target_cursor.execute("SELECT id FROM orgs WHERE url = ?", (url,))
-                existing_org = target_cursor.fetchone()
+                with self.metrics.stage("org_lookup", 1):
+                    target_cursor.execute("SELECT id FROM orgs WHERE url = ?", (url,))
+                    existing_org = target_cursor.fetchone()
 
                 if not existing_org:
                     # Анализируем города из описания и URL
-                    text_data = []
-                    if url:
-                        text_data.append(url)
-                    if descr:
-                        text_data.append(descr)
-
-                    combined_text = " ".join(text_data)
-                    cities, _ = self.text_analyzer.extract_locations_and_addresses(combined_text)
-                    cities_json = json.dumps(cities, ensure_ascii=False) if cities else "[]"
+                    cities, cities_json = self._analyze_org_cities(url, descr)
 
                     # Добавляем новую организацию с городами
-                    target_cursor.execute("""
-                        INSERT INTO orgs (url, descr_raw, last_checked_date, last_post_date, last_event_date, cities)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (url, descr, last_checked_date, last_post_date, last_event_date, cities_json))
+                    with self.metrics.stage("org_insert", 1):
+                        target_cursor.execute("""
+                            INSERT INTO orgs (url, descr_raw, last_checked_date, last_post_date, last_event_date, cities)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        """, (url, descr, last_checked_date, last_post_date, last_event_date, cities_json))
+                        self._record_orgs(target_cursor, [(url, cities)])
                     migrated_count += 1
-
-                    if cities and migrated_count <= self.config.log_limit_examples:
-                        self.logger.log(f"  + Добавлена организация: {url} (города: {cities})", False)
-                    elif migrated_count <= self.config.log_limit_examples:
-                        self.logger.log(f"  + Добавлена организация: {url}", False)
+                    self._log_added_org(url, cities, migrated_count)
                 else:
                     skipped_count += 1
-                    if skipped_count <= self.config.log_limit_examples:
-                        self.logger.log(f"  - Пропущена (уже существует): {url}", False)
+                    self._log_skipped_org(url, skipped_count)
 
             self.logger.log(f"Организации из {source_file}: добавлено {migrated_count}, пропущено {skipped_count}")
+            self._log_groups_rate(groups_count, start_time)
             return migrated_count
 
         except Exception as e:
+            self.failures += 1
             self.logger.log(f"Ошибка при миграции групп из {source_file}: {str(e)}")
             return 0
 
-    def migrate_posts(self, vk_cursor, target_cursor, source_file, event_detector):
-        """Мигрирует данные из vk_posts в posts с анализом городов и адресов"""
+    def migrate_groups_to_orgs_bulk(self, vk_cursor, target_cursor, source_file, start_rowid=0):
+        """Пакетно мигрирует vk_groups в orgs: url существующих организаций загружаются один раз,
+        анализируются только новые группы, вставка идет пакетами через executemany"""
         try:
-            # Получаем все посты из VK базы с информацией о группах
-            vk_cursor.execute("""
-                SELECT vp.group_id, vp.post_content, vp.post_date, vp.post_likes, 
+            start_time = time.perf_counter()
+
+            groups_count = self._count_rows(vk_cursor, "vk_groups", start_rowid)
+
+            self.logger.log(f"Найдено {groups_count} {'новых ' if start_rowid else ''}групп в {source_file}")
+
+            # Одним запросом загружаем соответствие url -> id для уже существующих организаций
+            org_ids = self._load_org_ids(target_cursor)
+
+            migrated_count = 0
+            skipped_count = 0
+            batch = []
+            added_orgs = []
+
+            for url, descr, last_checked_date, last_post_date, last_event_date in self._iter_rows(
+                    vk_cursor, self.GROUPS_QUERY, (start_rowid,)):
+                if url in org_ids:
+                    skipped_count += 1
+                    self._log_skipped_org(url, skipped_count)
+                    continue
+
+                # id новой организации станет известен только после вставки
+                org_ids[url] = None
+
+                cities, cities_json = self._analyze_org_cities(url, descr)
+                batch.append((url, descr, last_checked_date, last_post_date, last_event_date, cities_json))
+                added_orgs.append((url, cities))
+                migrated_count += 1
+                self._log_added_org(url, cities, migrated_count)
+
+                if len(batch) >= self.config.orgs_batch_size:
+                    self._insert_orgs(target_cursor, batch, added_orgs)
+                    batch = []
+                    added_orgs = []
+
+            if batch:
+                self._insert_orgs(target_cursor, batch, added_orgs)
+
+            self.logger.log(f"Организации из {source_file}: добавлено {migrated_count}, пропущено {skipped_count}")
+            self._log_groups_rate(groups_count, start_time)
+            return migrated_count
+
+        except Exception as e:
+            self.failures += 1
+            self.logger.log(f"Ошибка при миграции групп из {source_file}: {str(e)}")
+            return 0
+
+    def _count_rows(self, cursor, table, start_rowid=0):
+        """Возвращает количество строк в таблице с rowid больше start_rowid"""
+        if start_rowid:
+            cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE id > ?", (start_rowid,))
+        else:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+    def _iter_rows(self, cursor, query, params=(), stage="read_groups"):
+        """Построчно перебирает результат запроса, читая его пачками (время чтения - этап stage)"""
+        for chunk in self.metrics.iterate(stage, self.reader.iter_chunks(cursor, query, params)):
+            yield from chunk
+
+    def _load_org_ids(self, target_cursor):
+        """Загружает соответствие url -> id для всех организаций целевой базы"""
+        with self.metrics.stage("org_lookup") as stage:
+            target_cursor.execute("SELECT url, id FROM orgs")
+            org_ids = dict(target_cursor.fetchall())
+            stage.rows = len(org_ids)
+        return org_ids
+
+    def _insert_orgs(self, target_cursor, batch, added_orgs):
+        """Вставляет пакет организаций, их связи с городами и статистику вызовами executemany"""
+        with self.metrics.stage("org_insert", len(batch)):
+            target_cursor.executemany("""
+                INSERT INTO orgs (url, descr_raw, last_checked_date, last_post_date, last_event_date, cities)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, batch)
+            self._record_orgs(target_cursor, added_orgs)
+
+    def _record_orgs(self, target_cursor, orgs):
+        """Записывает связи добавленных организаций с городами и учитывает их в migration_stats;
+        orgs - список (url организации, города)"""
+        self._write_org_cities(target_cursor, orgs)
+        MigrationStats.add_orgs(target_cursor, orgs)
+
+    def _record_posts(self, target_cursor, posts):
+        """Записывает связи добавленных постов с городами и учитывает их в migration_stats;
+        posts - список (id поста, города, адреса, признак события)"""
+        self._write_post_cities(target_cursor, [(post_id, cities) for post_id, cities, _, _ in posts])
+        MigrationStats.add_posts(target_cursor, [post[1:] for post in posts])
+
+    def _write_org_cities(self, target_cursor, links):
+        """Пакетно записывает связи организаций с городами; links - список (url организации, города)"""
+        rows = [(city, url) for url, cities in links for city in cities]
+        if not rows:
+            return
+
+        self._intern_cities(target_cursor, (city for city, _ in rows))
+        target_cursor.executemany("""
+            INSERT OR IGNORE INTO org_cities (org_id, city_id)
+            SELECT o.id, c.id FROM orgs o JOIN cities c ON c.name = ? WHERE o.url = ?
+        """, rows)
+
+    def _write_post_cities(self, target_cursor, links):
+        """Пакетно записывает связи постов с городами; links - список (id поста, города)"""
+        rows = [(post_id, city) for post_id, cities in links for city in cities]
+        if not rows:
+            return
+
+        self._intern_cities(target_cursor, (city for _, city in rows))
+        target_cursor.executemany("""
+            INSERT OR IGNORE INTO post_cities (post_id, city_id)
+            SELECT ?, id FROM cities WHERE name = ?
+        """, rows)
+
+    def _intern_cities(self, target_cursor, names):
+        """Добавляет в справочник cities недостающие города"""
+        target_cursor.executemany("INSERT OR IGNORE INTO cities (name) VALUES (?)",
+                                  [(name,) for name in sorted(set(names))])
+
+    def _analyze_org_cities(self, url, descr):
+        """Анализирует города из описания и URL группы"""
+        with self.metrics.stage("org_analysis", 1):
+            cities = analyze_org(self.text_analyzer, url, descr)
+        cities_json = json.dumps(cities, ensure_ascii=False) if cities else "[]"
+        return cities, cities_json
+
+    def _log_added_org(self, url, cities, migrated_count):
+        """Логирует первые добавленные организации"""
+        if cities and migrated_count <= self.config.log_limit_examples:
+            self.logger.log("  + Добавлена организация: %s (города: %s)", url, cities, print_message=False)
+        elif migrated_count <= self.config.log_limit_examples:
+            self.logger.log("  + Добавлена организация: %s", url, print_message=False)
+
+    def _log_skipped_org(self, url, skipped_count):
+        """Логирует первые пропущенные организации"""
+        if skipped_count <= self.config.log_limit_examples:
+            self.logger.log("  - Пропущена (уже существует): %s", url, print_message=False)
+
+    def _log_groups_rate(self, groups_count, start_time):
+        """Логирует скорость обработки групп"""
+        elapsed = time.perf_counter() - start_time
+        rate = groups_count / elapsed if elapsed > 0 else 0
+        mode = "пакетный" if self.config.orgs_bulk_mode else "построчный"
+        self.logger.log(f"  Скорость ({mode} режим): {rate:.0f} групп/сек за {elapsed:.2f} сек")
+
+    def migrate_posts(self, vk_cursor, target_cursor, source_file, event_detector, start_rowid=0):
+        """Мигрирует данные из vk_posts в posts с анализом городов и адресов (посты с rowid > start_rowid)"""
+        try:
+            posts_count = self._count_rows(vk_cursor, "vk_posts", start_rowid)
+
+            self.logger.log(f"Найдено {posts_count} {'новых ' if start_rowid else ''}постов в {source_file}")
+
+            stats = self._new_posts_stats()
+
+            # Одним запросом загружаем соответствие url -> id организаций
+            org_ids = self._load_org_ids(target_cursor)
+
+            # Читаем посты из VK базы с информацией о группах страницами по rowid
+            chunks = self.reader.iter_keyset_chunks(vk_cursor, """
+                SELECT vp.id, vp.group_id, vp.post_content, vp.post_date, vp.post_likes, 
                        vp.post_comments, vp.post_reposts, vp.post_images, 
                        vp.vk_group_url, vp.post_id, vg.url
                 FROM vk_posts vp
                 LEFT JOIN vk_groups vg ON vp.group_id = vg.id
-            """)
-            vk_posts = vk_cursor.fetchall()
+                WHERE vp.id > ?
+                ORDER BY vp.id
+                LIMIT ?
+            """, last_id=start_rowid)
 
-            self.logger.log(f"Найдено {len(vk_posts)} постов в {source_file}")
+            chunks = self.metrics.iterate("read_posts", chunks)
+            self._write_posts(target_cursor, self._resolve_posts(chunks, org_ids, stats), event_detector, stats)
 
-            migrated_count = 0
-            skipped_count = 0
-            orphaned_count = 0
-            posts_with_cities = 0
-            posts_with_addresses = 0
+            self._log_posts_summary(source_file, stats)
+            return stats['migrated']
+
+        except Exception as e:
+            self.failures += 1
+            self.logger.log(f"Ошибка при миграции постов из {source_file}: {str(e)}")
+            return 0
+
+    def _resolve_posts(self, chunks, org_ids, stats):
+        """Находит org_id для пачек постов по URL группы; посты без организации учитывает и отбрасывает.
 
-            for post in vk_posts:
-                (group_id, post_content, post_date, post_likes, post_comments, post_reposts, post_images, vk_group_url,
-                 post_id, group_url) = post
+        Отдает пары (посты пачки, rowid последней прочитанной строки)"""
+        for chunk in chunks:
+            resolved = []
+
+            for row in chunk:
+                post = row[1:]
+                group_url, vk_group_url, post_id = post[9], post[7], post[8]
 
-                # Проверяем, есть ли уже такой пост в основной базе
                 check_url = group_url or vk_group_url
                 if post_id is None or check_url is None:
                     continue
-                target_cursor.execute("""
-                    SELECT p.id FROM posts p 
-                    JOIN orgs o ON p.org_id = o.id 
-                    WHERE p.post_id = ? AND o.url = ?
-                """, (post_id, check_url))
-                existing_post = target_cursor.fetchone()
-
-                if not existing_post:
-                    # Находим org_id по URL группы
-                    target_cursor.execute("SELECT id FROM orgs WHERE url = ?", (group_url or vk_group_url,))
-                    org_result = target_cursor.fetchone()
-
-                    if org_result:
-                        org_id = org_result[0]
-
-                        # Анализируем города и адреса из контента поста
-                        cities, addresses = self.text_analyzer.extract_locations_and_addresses(post_content)
-                        cities_json = json.dumps(cities, ensure_ascii=False) if cities else "[]"
-                        addresses_json = json.dumps(addresses, ensure_ascii=False) if addresses else "[]"
-                        is_event = event_detector.is_event_invitation(post_content)
-                        # Добавляем новый пост с городами и адресами
-                        target_cursor.execute("""
-                            INSERT INTO posts (org_id, post_content, content, post_date, 
-                                             post_likes, post_comments, post_reposts, 
-                                             post_images, images, post_id, cities, address, maybe_event)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """, (org_id, post_content, post_content, post_date, post_likes, post_comments, post_reposts,
-                              post_images, post_images, post_id, cities_json, addresses_json, is_event))
-
-                        migrated_count += 1
-
-                        if cities:
-                            posts_with_cities += 1
-                        if addresses:
-                            posts_with_addresses += 1
-
-                        if migrated_count <= self.config.log_limit_examples:
-                            city_info = f" (города: {cities})" if cities else ""
-                            addr_info = f" (адреса: {addresses})" if addresses else ""
-                            self.logger.log(
-                                f"  + Добавлен пост {post_id} для {group_url or vk_group_url}{city_info}{addr_info}",
-                                False)
-                    else:
-                        orphaned_count += 1
-                        content_preview = (post_content[:100] + "...") if post_content and len(
-                            post_content) > 100 else (post_content or "Нет контента")
-
-                        if orphaned_count <= self.config.log_limit_examples:
-                            self.logger.log(
-                                f"  ! Пост {post_id} пропущен - не найдена организация для {group_url or vk_group_url}",
-                                False)
-                            self.logger.log(f"    Group ID: {group_id}, Дата: {post_date}", False)
-                            self.logger.log(
-                                f"    Лайки: {post_likes}, Комментарии: {post_comments}, Репосты: {post_reposts}",
-                                False)
-                            self.logger.log(f"    Контент: {content_preview}", False)
+
+                # Находим org_id по URL группы
+                org_id = org_ids.get(check_url)
+
+                if org_id is not None:
+                    resolved.append((org_id, post, check_url))
                 else:
-                    skipped_count += 1
-                    content_preview = (post_content[:50] + "...") if post_content and len(post_content) > 50 else (
-                            post_content or "Нет контента")
-
-                    if skipped_count <= self.config.log_limit_examples:
-                        self.logger.log(f"  - Пропущен пост {post_id} (уже существует)", False)
-                        self.logger.log(f"    Организация: {group_url or vk_group_url}, Дата: {post_date}", False)
-                        self.logger.log(
-                            f"    Лайки: {post_likes}, Комментарии: {post_comments}, Репосты: {post_reposts}", False)
-                        self.logger.log(f"    Контент: {content_preview}", False)
-
-            self.logger.log(
-                f"Посты из {source_file}: добавлено {migrated_count}, пропущено {skipped_count}, без организации {orphaned_count}")
-            self.logger.log(f"  - с найденными городами: {posts_with_cities}")
-            self.logger.log(f"  - с найденными адресами: {posts_with_addresses}")
-            return migrated_count
+                    self._count_orphaned_post(post, check_url, row[0], stats)
+
+            yield resolved, chunk[-1][0]
+
+    def migrate_posts_attached(self, target_cursor, source_file, event_detector, schema="vk", start_rowid=0):
+        """Мигрирует посты из VK базы, подключенной к целевой через ATTACH DATABASE.
+
+        org_id и отсечение уже существующих пар (post_id, url организации) вычисляются одним
+        анти-соединением в SQL, через Python проходят только новые посты. Читаются только
+        посты с rowid больше start_rowid"""
+        try:
+            total_count = self._count_rows(target_cursor, f"{schema}.vk_posts", start_rowid)
+
+            self.logger.log(f"Найдено {total_count} {'новых ' if start_rowid else ''}постов в {source_file}")
+
+            # Посты без post_id или без URL группы не мигрируются (как и в построчном режиме)
+            target_cursor.execute(f"""
+                SELECT COUNT(*)
+                FROM {schema}.vk_posts vp
+                LEFT JOIN {schema}.vk_groups vg ON vp.group_id = vg.id
+                WHERE vp.post_id IS NOT NULL
+                  AND COALESCE(NULLIF(vg.url, ''), vp.vk_group_url) IS NOT NULL
+                  AND vp.id > ?
+            """, (start_rowid,))
+            candidates_count = target_cursor.fetchone()[0]
+
+            stats = self._new_posts_stats()
+
+            # Примеры уже существующих постов логируются заранее, чтобы не повторять их ниже
+            stats['skipped'] = self._log_existing_attached_posts(target_cursor, schema, start_rowid)
+
+            # Новые посты читаются страницами по rowid: каждая страница заново проходит анти-join,
+            # поэтому повторы поста внутри дампа со следующих страниц отсекаются уже в SQL
+            chunks = self.reader.iter_keyset_chunks(target_cursor, f"""
+                SELECT vp.id, vp.group_id, vp.post_content, vp.post_date, vp.post_likes,
+                       vp.post_comments, vp.post_reposts, vp.post_images,
+                       vp.vk_group_url, vp.post_id, vg.url, o.id
+                FROM {schema}.vk_posts vp
+                LEFT JOIN {schema}.vk_groups vg ON vp.group_id = vg.id
+                LEFT JOIN main.orgs o ON o.url = COALESCE(NULLIF(vg.url, ''), vp.vk_group_url)
+                WHERE vp.post_id IS NOT NULL
+                  AND COALESCE(NULLIF(vg.url, ''), vp.vk_group_url) IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM main.posts p
+                      WHERE p.org_id = o.id AND p.post_id = vp.post_id
+                  )
+                  AND vp.id > ?
+                ORDER BY vp.id
+                LIMIT ?
+            """, last_id=start_rowid)
+
+            # Время чтения включает и отсечение существующих постов анти-join
+            chunks = self.metrics.iterate("read_posts", chunks)
+            self._write_posts(target_cursor, self._resolve_attached_posts(chunks, stats), event_detector, stats,
+                              check_existing=False)
+
+            # Всё, что не добавлено и не осталось без организации, уже есть в целевой базе:
+            # либо отсеяно анти-join, либо проигнорировано уникальным индексом
+            stats['skipped'] = candidates_count - stats['migrated'] - stats['orphaned']
+
+            self._log_posts_summary(source_file, stats)
+            return stats['migrated']
 
         except Exception as e:
+            self.failures += 1
             self.logger.log(f"Ошибка при миграции постов из {source_file}: {str(e)}")
             return 0
+
+    def _resolve_attached_posts(self, chunks, stats):
+        """Отбрасывает из пачек анти-join посты без организации; отдает пары (посты, rowid последней строки)"""
+        for chunk in chunks:
+            resolved = []
+
+            for row in chunk:
+                post, org_id = row[1:-1], row[-1]
+                check_url = post[9] or post[7]
+
+                if org_id is not None:
+                    resolved.append((org_id, post, check_url))
+                else:
+                    self._count_orphaned_post(post, check_url, row[0], stats)
+
+            yield resolved, chunk[-1][0]
+
+    def _log_existing_attached_posts(self, target_cursor, schema, start_rowid=0):
+        """Логирует примеры постов, отсеянных анти-join как уже существующие, и возвращает их число"""
+        target_cursor.execute(f"""
+            SELECT vp.group_id, vp.post_content, vp.post_date, vp.post_likes,
+                   vp.post_comments, vp.post_reposts, vp.post_images,
+                   vp.vk_group_url, vp.post_id, vg.url
+            FROM {schema}.vk_posts vp
+            LEFT JOIN {schema}.vk_groups vg ON vp.group_id = vg.id
+            JOIN main.orgs o ON o.url = COALESCE(NULLIF(vg.url, ''), vp.vk_group_url)
+            WHERE vp.post_id IS NOT NULL
+              AND vp.id > ?
+              AND EXISTS (
+                  SELECT 1 FROM main.posts p
+                  WHERE p.org_id = o.id AND p.post_id = vp.post_id
+              )
+            ORDER BY vp.id
+            LIMIT ?
+        """, (start_rowid, self.config.log_limit_examples))
+        examples = target_cursor.fetchall()
+        for skipped_count, post in enumerate(examples, 1):
+            self._log_skipped_post(post, post[9] or post[7], skipped_count)
+        return len(examples)
+
+    def _new_posts_stats(self):
+        """Создает счетчики миграции постов одного файла"""
+        self.orphan_rowids = []
+        return {
+            'migrated': 0,
+            'skipped': 0,
+            'orphaned': 0,
+            'with_cities': 0,
+            'with_addresses': 0,
+        }
+
+    def _count_orphaned_post(self, post, group_url, rowid, stats):
+        """Учитывает пост без организации и запоминает его rowid.
+
+        Организация может появиться позже (из другого дампа), поэтому такие посты сохраняются
+        в migration_orphans и перечитываются, когда она появится"""
+        stats['orphaned'] += 1
+        self.orphan_rowids.append(rowid)
+        self._log_orphaned_post(post, group_url, stats['orphaned'])
+
+    def _write_posts(self, target_cursor, chunks, event_detector, stats, check_existing=True):
+        """Записывает пачки постов с известным org_id в целевую базу.
+
+        Каждая пачка проходит три шага: отбор новых постов (уже существующие в целевой базе
+        и повторы внутри пачки отбрасываются до дорогого анализа), анализ их текстов и вставка
+        одним INSERT OR IGNORE вместе с результатами анализа. При включенном пуле процессов
+        анализ пачки идет параллельно с отбором следующей. check_existing=False - существующие
+        посты уже отсечены в SQL (анти-join SQL-движка).
+
+        Перед промежуточной фиксацией вставляются все отобранные посты, поэтому в базе не бывает
+        постов без результатов анализа"""
+        pending = None
+
+        for resolved, last_rowid in chunks:
+            pending_keys = {(org_id, post[8]) for org_id, post, _ in pending[0]} if pending else set()
+            selected = self._select_new_posts(target_cursor, resolved, pending_keys, stats, check_existing)
+            analysis = self._start_analysis([post[1] for _, post, _ in selected], event_detector)
+
+            if pending:
+                self._insert_analyzed_posts(target_cursor, *pending, stats)
+            pending = (selected, analysis)
+
+            if self.checkpointer is not None and self.checkpointer.is_due(len(resolved)):
+                self._insert_analyzed_posts(target_cursor, *pending, stats)
+                pending = None
+                with self.metrics.stage("commit"):
+                    self.checkpointer.commit(target_cursor, last_rowid, self.orphan_rowids)
+
+        if pending:
+            self._insert_analyzed_posts(target_cursor, *pending, stats)
+
+    def _select_new_posts(self, target_cursor, resolved, pending_keys, stats, check_existing=True):
+        """Возвращает посты пачки, которых еще нет в целевой базе, без повторов (org_id, post_id).
+
+        pending_keys - посты предыдущей пачки, отобранные, но еще не вставленные. Для
+        отброшенных постов дорогой анализ текста не выполняется"""
+        selected = []
+        seen = set(pending_keys)
+
+        with self.metrics.stage("post_dedup", len(resolved)):
+            for org_id, post, group_url in resolved:
+                key = (org_id, post[8])
+                exists = key in seen
+                if not exists and check_existing:
+                    target_cursor.execute("SELECT 1 FROM posts WHERE org_id = ? AND post_id = ?", key)
+                    exists = target_cursor.fetchone() is not None
+
+                if exists:
+                    stats['skipped'] += 1
+                    self._log_skipped_post(post, group_url, stats['skipped'])
+                    continue
+
+                seen.add(key)
+                selected.append((org_id, post, group_url))
+
+        return selected
+
+    def _start_analysis(self, contents, event_detector):
+        """Запускает анализ текстов постов и возвращает функцию получения результатов.
+
+        Тексты, результаты которых уже есть в кэше анализа, повторно не анализируются"""
+        with self.metrics.stage("post_analysis", len(contents)):
+            if self.analysis_cache is not None:
+                return self.analysis_cache.analyze(contents,
+                                                   lambda missing: self._analyze_contents(missing, event_detector))
+            return self._analyze_contents(contents, event_detector)
+
+    def _analyze_contents(self, contents, event_detector):
+        """Анализирует тексты в пуле процессов или в основном процессе"""
+        if self.enrichment_pool is not None:
+            return self.enrichment_pool.submit(contents)
+
+        results = analyze_posts(self.text_analyzer, event_detector, contents, self.metrics)
+        return lambda: results
+
+    def _insert_analyzed_posts(self, target_cursor, selected, analysis, stats):
+        """Вставляет отобранные посты вместе с городами, адресами и признаком события"""
+        added_posts = []
+
+        # Ожидание результатов пула процессов и кэша анализа
+        with self.metrics.stage("analysis_wait", len(selected)):
+            results = analysis()
+
+        with self.metrics.stage("post_insert", len(selected)):
+            for (org_id, post, group_url), (cities, addresses, is_event) in zip(selected, results):
+                row_id = self._insert_post(target_cursor, org_id, post, cities, addresses, is_event)
+                if row_id is None:
+                    stats['skipped'] += 1
+                    self._log_skipped_post(post, group_url, stats['skipped'])
+                    continue
+
+                added_posts.append((row_id, cities, addresses, is_event))
+                self._count_added_post(post[8], group_url, cities, addresses, stats)
+
+            self._record_posts(target_cursor, added_posts)
+
+    def _insert_post(self, target_cursor, org_id, post, cities, addresses, is_event):
+        """Вставляет пост с результатами анализа; возвращает его id или None, если пост уже есть"""
+        (group_id, post_content, post_date, post_likes, post_comments, post_reposts, post_images, vk_group_url,
+         post_id) = post[:9]
+        cities_json = json.dumps(cities, ensure_ascii=False) if cities else "[]"
+        addresses_json = json.dumps(addresses, ensure_ascii=False) if addresses else "[]"
+
+        target_cursor.execute("""
+            INSERT OR IGNORE INTO posts (org_id, post_content, content, post_date, 
+                                        post_likes, post_comments, post_reposts, 
+                                        post_images, images, post_id, cities, address, maybe_event)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (org_id, post_content, post_content, post_date, post_likes, post_comments, post_reposts,
+              post_images, post_images, post_id, cities_json, addresses_json, is_event))
+
+        return target_cursor.lastrowid if target_cursor.rowcount else None
+
+    def _count_added_post(self, post_id, group_url, cities, addresses, stats):
+        """Учитывает добавленный пост в счетчиках файла и логирует первые примеры"""
+        stats['migrated'] += 1
+
+        if cities:
+            stats['with_cities'] += 1
+        if addresses:
+            stats['with_addresses'] += 1
+
+        if stats['migrated'] <= self.config.log_limit_examples:
+            message = "  + Добавлен пост %s для %s"
+            args = [post_id, group_url]
+            if cities:
+                message += " (города: %s)"
+                args.append(cities)
+            if addresses:
+                message += " (адреса: %s)"
+                args.append(addresses)
+            self.logger.log(message, *args, print_message=False)
+
+    def write_analyzed_dump(self, target_cursor, messages, org_ids, source_file, group_rowid=0, post_rowid=0):
+        """Записывает дамп, прочитанный и проанализированный в отдельном процессе (ParallelIngestor).
+
+        messages - упорядоченный поток пар (тип, данные) от процесса чтения. Счетчики и примеры
+        в логе совпадают с последовательной миграцией того же файла (group_rowid и post_rowid -
+        отметки, после которых читался дамп, нужны только для сообщений лога).
+        Возвращает количество добавленных организаций и постов"""
+        org_stats = {'migrated': 0, 'skipped': 0}
+        post_stats = self._new_posts_stats()
+        candidates_count = 0
+
+        for kind, payload in messages:
+            if kind == 'groups_count':
+                self.logger.log(f"Найдено {payload} {'новых ' if group_rowid else ''}групп в {source_file}")
+            elif kind == 'orgs':
+                with self.metrics.stage("org_insert", len(payload)):
+                    self._write_analyzed_orgs(target_cursor, payload, org_ids, org_stats)
+            elif kind == 'orgs_done':
+                self.logger.log(f"Организации из {source_file}: добавлено {org_stats['migrated']}, "
+                                f"пропущено {org_stats['skipped']}")
+                if self.checkpointer is not None:
+                    with self.metrics.stage("commit"):
+                        self.checkpointer.commit(target_cursor)
+            elif kind == 'posts_count':
+                posts_count, candidates_count = payload
+                self.logger.log(f"Найдено {posts_count} {'новых ' if post_rowid else ''}постов в {source_file}")
+            elif kind == 'existing_posts':
+                for skipped_count, post in enumerate(payload, 1):
+                    self._log_skipped_post(post, post[9] or post[7], skipped_count)
+                post_stats['skipped'] = len(payload)
+            elif kind == 'posts':
+                # Отсечение существующих постов и вставка - один INSERT OR IGNORE на пост
+                with self.metrics.stage("post_insert", len(payload)):
+                    self._write_analyzed_posts(target_cursor, payload, org_ids, post_stats)
+                if self.checkpointer is not None and self.checkpointer.is_due(len(payload)):
+                    with self.metrics.stage("commit"):
+                        self.checkpointer.commit(target_cursor, payload[-1][0], self.orphan_rowids)
+            elif kind == 'analysis_cache':
+                if self.analysis_cache is not None:
+                    self.analysis_cache.add_statistics(payload)
+            elif kind == 'lemma_cache':
+                # Кэш лемм процесса чтения: в отчет идет сумма по всем процессам
+                self.text_analyzer.add_lemma_cache_info(payload)
+            elif kind == 'metrics':
+                # Этапы чтения и анализа, замеренные в процессе чтения
+                self.metrics.merge(payload)
+
+        # Как и в SQL-движке: всё, что не добавлено и не осталось без организации, уже существует
+        post_stats['skipped'] = candidates_count - post_stats['migrated'] - post_stats['orphaned']
+
+        self._log_posts_summary(source_file, post_stats)
+        return org_stats['migrated'], post_stats['migrated']
+
+    def _write_analyzed_orgs(self, target_cursor, groups, org_ids, stats):
+        """Записывает группы, прочитанные и проанализированные в другом процессе.
+
+        groups - список (url, values, cities), где values равно None для групп, уже существовавших
+        в целевой базе на момент чтения. org_ids пополняется id добавленных организаций"""
+        added_orgs = []
+
+        for url, values, cities in groups:
+            if values is None or url in org_ids:
+                stats['skipped'] += 1
+                self._log_skipped_org(url, stats['skipped'])
+                continue
+
+            target_cursor.execute("""
+                INSERT OR IGNORE INTO orgs (url, descr_raw, last_checked_date, last_post_date, last_event_date, cities)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, values)
+
+            if target_cursor.rowcount == 0:
+                stats['skipped'] += 1
+                self._log_skipped_org(url, stats['skipped'])
+                continue
+
+            org_ids[url] = target_cursor.lastrowid
+            added_orgs.append((url, cities))
+            stats['migrated'] += 1
+            self._log_added_org(url, cities, stats['migrated'])
+
+        self._record_orgs(target_cursor, added_orgs)
+
+    def _write_analyzed_posts(self, target_cursor, posts, org_ids, stats):
+        """Записывает посты, прочитанные и проанализированные в другом процессе.
+
+        posts - список (rowid, post, url группы, города, адреса, признак события); org_id определяется
+        в момент записи, поэтому учитываются и организации из предыдущих файлов"""
+        added_posts = []
+
+        for rowid, post, group_url, cities, addresses, is_event in posts:
+            org_id = org_ids.get(group_url)
+
+            if org_id is None:
+                self._count_orphaned_post(post, group_url, rowid, stats)
+                continue
+
+            row_id = self._insert_post(target_cursor, org_id, post, cities, addresses, is_event)
+            if row_id is None:
+                stats['skipped'] += 1
+                self._log_skipped_post(post, group_url, stats['skipped'])
+                continue
+
+            added_posts.append((row_id, cities, addresses, is_event))
+            self._count_added_post(post[8], group_url, cities, addresses, stats)
+
+        self._record_posts(target_cursor, added_posts)
+
+    def _log_orphaned_post(self, post, group_url, orphaned_count):
+        """Логирует первые посты, для которых не найдена организация"""
+        if orphaned_count > self.config.log_limit_examples:
+            return
+
+        group_id, post_content, post_date, post_likes, post_comments, post_reposts = post[:6]
+        post_id = post[8]
+        content_preview = (post_content[:100] + "...") if post_content and len(
+            post_content) > 100 else (post_content or "Нет контента")
+
+        self.logger.log("  ! Пост %s пропущен - не найдена организация для %s", post_id, group_url,
+                        print_message=False)
+        self.logger.log("    Group ID: %s, Дата: %s", group_id, post_date, print_message=False)
+        self.logger.log("    Лайки: %s, Комментарии: %s, Репосты: %s", post_likes, post_comments, post_reposts,
+                        print_message=False)
+        self.logger.log("    Контент: %s", content_preview, print_message=False)
+
+    def _log_skipped_post(self, post, group_url, skipped_count):
+        """Логирует первые пропущенные (уже существующие) посты"""
+        if skipped_count > self.config.log_limit_examples:
+            return
+
+        post_content, post_date, post_likes, post_comments, post_reposts = post[1:6]
+        post_id = post[8]
+        content_preview = (post_content[:50] + "...") if post_content and len(post_content) > 50 else (
+                post_content or "Нет контента")
+
+        self.logger.log("  - Пропущен пост %s (уже существует)", post_id, print_message=False)
+        self.logger.log("    Организация: %s, Дата: %s", group_url, post_date, print_message=False)
+        self.logger.log("    Лайки: %s, Комментарии: %s, Репосты: %s", post_likes, post_comments, post_reposts,
+                        print_message=False)
+        self.logger.log("    Контент: %s", content_preview, print_message=False)
+
+    def _log_posts_summary(self, source_file, stats):
+        """Логирует итоги миграции постов одного файла"""
+        self.logger.log(
+            f"Посты из {source_file}: добавлено {stats['migrated']}, пропущено {stats['skipped']}, "
+            f"без организации {stats['orphaned']}")
+        self.logger.log(f"  - с найденными городами: {stats['with_cities']}")
+        self.logger.log(f"  - с найденными адресами: {stats['with_addresses']}")
@@ -3,23 +3,176 @@
 
 import sqlite3
 import os
+import time
 import glob
+import pathlib
 
+from migrators.vk.MigrationStats import MigrationStats
+from migrators.vk.PipelineMetrics import PipelineMetrics
 
 class DatabaseManager:
     """Менеджер базы данных для VK мигратора"""
 
-    def __init__(self, config, logger):
+    # Профили соединений: PRAGMA, применяемые при открытии базы, и нужна ли контрольная точка WAL в конце
+    CONNECTION_PROFILES = {
+        # Пакетная загрузка: WAL без fsync на каждый commit, большой кэш страниц, mmap и временные данные
+        # в памяти. При сбое питания теряются только последние транзакции, база остается целой
+        "bulk": {
+            "pragmas": {
+                "journal_mode": "WAL",
+                "synchronous": "NORMAL",
+                "cache_size": -262144,  # 256 МБ (отрицательное значение - в КБ)
+                "mmap_size": 268435456,  # 256 МБ
+                "temp_store": "MEMORY",
+            },
+            "checkpoint_at_end": False,
+        },
+        # Надежный: fsync на каждый commit, настройки кэша и временных данных по умолчанию,
+        # в конце миграции WAL переносится в основной файл и обрезается
+        "safe": {
+            "pragmas": {
+                "journal_mode": "WAL",
+                "synchronous": "FULL",
+                "cache_size": -2000,
+                "mmap_size": 0,
+                "temp_store": "DEFAULT",
+            },
+            "checkpoint_at_end": True,
+        },
+    }
+
+    # Вторичные индексы для чтения мигрированных данных. Во время загрузки они не нужны: отбор новых
+    # организаций и постов идет по UNIQUE(orgs.url) и уникальному индексу idx_posts_org_post, а связей
+    # с городами - по первичным ключам post_cities и org_cities, которые остаются всегда (выборка
+    # по org_id тоже обслуживается idx_posts_org_post)
+    SECONDARY_INDEXES = {
+        "idx_post_cities_city": "post_cities(city_id, post_id)",
+        "idx_org_cities_city": "org_cities(city_id, org_id)",
+        "idx_posts_post_id": "posts(post_id)",
+        "idx_posts_post_date": "posts(post_date)",
+        "idx_posts_cities": "posts(cities) WHERE cities IS NOT NULL AND cities != '[]'",
+        "idx_posts_address": "posts(id) WHERE address IS NOT NULL AND address != '[]'",
+        "idx_orgs_last_post_date": "orgs(last_post_date)",
+        "idx_orgs_cities": "orgs(cities) WHERE cities IS NOT NULL AND cities != '[]'",
+    }
+
+    # PRAGMA, которые не меняют файл: только они применяются к дампам, открытым на чтение
+    READ_PRAGMAS = ("cache_size", "mmap_size", "temp_store")
+    # PRAGMA, действующие на соединение целиком, а не на отдельную подключенную базу
+    CONNECTION_PRAGMAS = ("temp_store",)
+
+    def __init__(self, config, logger, metrics=None):
         self.config = config
         self.logger = logger
+        self.metrics = metrics if metrics is not None else PipelineMetrics(enabled=False)
+        self.phase_timings = []  # [(фаза, секунды)] загрузки для отчета
+        self._load_started = None
+
+    @property
+    def profile(self):
+        """Профиль соединений, выбранный в конфигурации"""
+        return self.get_profile(self.config.connection_profile)
+
+    @classmethod
+    def get_profile(cls, name):
+        """Возвращает профиль соединений по имени"""
+        if name not in cls.CONNECTION_PROFILES:
+            raise ValueError(f"Неизвестный профиль соединений SQLite: {name} "
+                             f"(доступны: {', '.join(cls.CONNECTION_PROFILES)})")
+        return cls.CONNECTION_PROFILES[name]
+
+    @classmethod
+    def apply_profile(cls, conn, profile, schema="main", read_only=False):
+        """Применяет PRAGMA профиля к базе schema соединения (для read_only - только READ_PRAGMAS)"""
+        for name, value in profile["pragmas"].items():
+            if read_only and name not in cls.READ_PRAGMAS:
+                continue
+            target = name if name in cls.CONNECTION_PRAGMAS else f"{schema}.{name}"
+            conn.execute(f"PRAGMA {target} = {value}")
+
+    def connect_target(self, **kwargs):
+        """Открывает целевую базу с PRAGMA выбранного профиля.
+
+        Соединение открывается по URI, чтобы к нему можно было подключать дампы по URI (см. attach_vk_db)"""
+        conn = sqlite3.connect(self.file_uri(self.config.target_db_path), uri=True, **kwargs)
+        self.apply_profile(conn, self.profile)
+        return conn
+
+    def connect_vk_db(self, vk_db_path, **kwargs):
+        """Открывает VK дамп только на чтение (см. open_vk_db)"""
+        return self.open_vk_db(self.config, vk_db_path, **kwargs)
+
+    @classmethod
+    def open_vk_db(cls, config, vk_db_path, **kwargs):
+        """Открывает VK дамп только на чтение с настройками кэша профиля и mmap размером vk_dump_mmap_size.
+
+        Дамп не меняется во время миграции, поэтому без незавершенного журнала он открывается
+        как immutable: без блокировок, и его могут одновременно читать несколько процессов"""
+        conn = sqlite3.connect(cls.vk_db_uri(vk_db_path), uri=True, **kwargs)
+        cls.apply_vk_db_settings(conn, config)
+        return conn
+
+    @classmethod
+    def vk_db_uri(cls, vk_db_path):
+        """URI дампа только на чтение; immutable, если рядом нет незавершенного журнала (immutable его не читает)"""
+        if cls.has_pending_journal(vk_db_path):
+            return cls.file_uri(vk_db_path, mode="ro")
+        return cls.file_uri(vk_db_path, mode="ro", immutable=1)
+
+    @staticmethod
+    def has_pending_journal(vk_db_path):
+        """Есть ли рядом с дампом непустой WAL или журнал отката: изменения, которых нет в основном файле"""
+        for suffix in ("-wal", "-journal"):
+            journal_path = vk_db_path + suffix
+            if os.path.exists(journal_path) and os.path.getsize(journal_path) > 0:
+                return True
+        return False
+
+    @classmethod
+    def apply_vk_db_settings(cls, conn, config, schema="main"):
+        """Применяет к дампу настройки чтения профиля и mmap_size для дампов"""
+        cls.apply_profile(conn, cls.get_profile(config.connection_profile), schema, read_only=True)
+        conn.execute(f"PRAGMA {schema}.mmap_size = {int(config.vk_dump_mmap_size)}")
+
+    def get_profile_description(self):
+        """Строка для отчета: имя профиля и его PRAGMA"""
+        pragmas = ", ".join(f"{name}={value}" for name, value in self.profile["pragmas"].items())
+        checkpoint = ", контрольная точка WAL в конце" if self.profile["checkpoint_at_end"] else ""
+        return f"{self.config.connection_profile} ({pragmas}{checkpoint})"
+
+    def finish_target_database(self):
+        """Завершает работу с целевой базой: для надежного профиля переносит WAL в основной файл"""
+        if not self.profile["checkpoint_at_end"]:
+            return
+
+        conn = self.connect_target()
+        try:
+            with self.metrics.stage("wal_checkpoint"):
+                busy, wal_pages, checkpointed_pages = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        finally:
+            conn.close()
+
+        if busy:
+            self.logger.log("Контрольная точка WAL не завершена: база занята другим соединением")
+        else:
+            self.logger.log(f"Контрольная точка WAL: перенесено страниц {checkpointed_pages}", print_message=False)
+
+    @staticmethod
+    def file_uri(path, **params):
+        """Строит SQLite URI для файла базы данных, например file:///path/vk.db?mode=ro"""
+        uri = pathlib.Path(path).resolve().as_uri()
+        if params:
+            uri += "?" + "&".join(f"{name}={value}" for name, value in params.items())
+        return uri
 
     def get_vk_db_files(self):
-        """Получает список всех .db файлов в директории dumps/vk/"""
+        """Получает список всех .db файлов в директории dumps/vk/ (от больших к меньшим)"""
         pattern = os.path.join(self.config.vk_dumps_dir, "*.db")
-        files = glob.glob(pattern)
+        # Крупные файлы первыми: при параллельной обработке так не остается длинного хвоста
+        files = sorted(glob.glob(pattern), key=lambda path: (-os.path.getsize(path), path))
         self.logger.log(f"Найдено {len(files)} файлов VK базы данных в {self.config.vk_dumps_dir}")
         for file in files:
-            self.logger.log(f"  - {file}", False)
+            self.logger.log(f"  - {file}", print_message=False)
         return files
 
     def create_target_database(self):
@@ -27,7 +180,7 @@ class DatabaseManager:
         # Создаем директорию если её нет
         os.makedirs(os.path.dirname(self.config.target_db_path), exist_ok=True)
 
-        conn = sqlite3.connect(self.config.target_db_path)
+        conn = self.connect_target()
         cursor = conn.cursor()
 
         # Создаем таблицу orgs с полем cities
@@ -67,9 +220,100 @@ class DatabaseManager:
             )
         """)
 
+        # Справочник городов и связи с ними постов и организаций. Столбцы cities с JSON остаются
+        # для совместимости, а выборки по городу и топы городов идут по индексам связей
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'cities'")
+        new_city_tables = cursor.fetchone() is None
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS cities (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE NOT NULL
+            )
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS post_cities (
+                post_id INTEGER NOT NULL,
+                city_id INTEGER NOT NULL,
+                PRIMARY KEY (post_id, city_id)
+            ) WITHOUT ROWID
+        """)
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS org_cities (
+                org_id INTEGER NOT NULL,
+                city_id INTEGER NOT NULL,
+                PRIMARY KEY (org_id, city_id)
+            ) WITHOUT ROWID
+        """)
+
+        # Статистика, которую мигратор ведет по мере записи (см. MigrationStats)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'migration_stats'")
+        new_stats_table = cursor.fetchone() is None
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS migration_stats (
+                metric TEXT NOT NULL,
+                city_id INTEGER NOT NULL DEFAULT 0,
+                value INTEGER NOT NULL,
+                PRIMARY KEY (metric, city_id)
+            ) WITHOUT ROWID
+        """)
+
+        # Состояние инкрементальной миграции: что уже прочитано из каждого дампа
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS migration_state (
+                source_file TEXT PRIMARY KEY,
+                file_size INTEGER,
+                file_mtime REAL,
+                fingerprint TEXT,
+                max_group_rowid INTEGER,
+                max_post_rowid INTEGER,
+                max_post_date TEXT,
+                migrated_at TEXT
+            )
+        """)
+
+        # Контрольные точки незавершенной миграции дампов (для продолжения после сбоя)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS migration_checkpoint (
+                source_file TEXT PRIMARY KEY,
+                group_rowid INTEGER,
+                post_rowid INTEGER,
+                updated_at TEXT
+            )
+        """)
+
+        # Посты без организации, уже прочитанные из дампов: перечитываются, когда организация появится
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS migration_orphans (
+                source_file TEXT NOT NULL,
+                post_rowid INTEGER NOT NULL,
+                PRIMARY KEY (source_file, post_rowid)
+            ) WITHOUT ROWID
+        """)
+
         # Добавляем столбцы если они не существуют (для обратной совместимости)
         self._add_columns_if_not_exist(cursor)
 
+        # Создаем индексы (для существующих баз - с предварительной проверкой дублей);
+        # дубли удаляются до заполнения связей с городами, чтобы не оставить связей удаленных постов
+        try:
+            self._create_indexes(cursor)
+        except RuntimeError:
+            conn.rollback()
+            conn.close()
+            raise
+
+        # База мигрирована до появления связей с городами: заполняем их из столбцов cities
+        if new_city_tables:
+            self._fill_city_links(cursor)
+
+        # Для базы, мигрированной до появления статистики, считаем ее по данным один раз
+        if new_stats_table:
+            MigrationStats.recompute(cursor)
+
         conn.commit()
         conn.close()
         self.logger.log(f"Целевая база данных создана/проверена: {self.config.target_db_path}")
@@ -91,11 +335,210 @@ class DatabaseManager:
         except sqlite3.OperationalError:
             pass
 
+    def _fill_city_links(self, cursor):
+        """Заполняет справочник городов и связи с ними из JSON в столбцах cities (один раз для старых баз)"""
+        for table in ("orgs", "posts"):
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO cities (name)
+                SELECT DISTINCT j.value
+                FROM {table} t, json_each(t.cities) j
+                WHERE t.cities IS NOT NULL AND t.cities != '[]' AND json_valid(t.cities)
+                ORDER BY j.value
+            """)
+
+        cursor.execute("""
+            INSERT OR IGNORE INTO org_cities (org_id, city_id)
+            SELECT o.id, c.id
+            FROM orgs o, json_each(o.cities) j
+            JOIN cities c ON c.name = j.value
+            WHERE o.cities IS NOT NULL AND o.cities != '[]' AND json_valid(o.cities)
+        """)
+        org_links = cursor.rowcount
+
+        cursor.execute("""
+            INSERT OR IGNORE INTO post_cities (post_id, city_id)
+            SELECT p.id, c.id
+            FROM posts p, json_each(p.cities) j
+            JOIN cities c ON c.name = j.value
+            WHERE p.cities IS NOT NULL AND p.cities != '[]' AND json_valid(p.cities)
+        """)
+        post_links = cursor.rowcount
+
+        if org_links or post_links:
+            self.logger.log(f"Связи с городами заполнены из существующих данных: организаций {org_links}, "
+                            f"постов {post_links}")
+
+    def _create_indexes(self, cursor):
+        """Создает индексы и ограничение уникальности (org_id, post_id) для постов"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_posts_org_post'")
+        if not cursor.fetchone():
+            # База создана до появления ограничения: в ней могут быть дубли постов
+            self._resolve_duplicate_posts(cursor)
+
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_posts_org_post ON posts(org_id, post_id)")
+        self._create_secondary_indexes(cursor)
+
+    def _resolve_duplicate_posts(self, cursor):
+        """Проверяет дубли (org_id, post_id) перед созданием уникального индекса.
+
+        Удаление необратимо, поэтому выполняется только при dedupe_posts (оставляется первый
+        экземпляр каждого поста); иначе миграция останавливается со списком дублей"""
+        cursor.execute("""
+            SELECT org_id, post_id, COUNT(*)
+            FROM posts
+            WHERE org_id IS NOT NULL AND post_id IS NOT NULL
+            GROUP BY org_id, post_id
+            HAVING COUNT(*) > 1
+            ORDER BY org_id, post_id
+        """)
+        duplicates = cursor.fetchall()
+        if not duplicates:
+            return
+
+        if not self.config.dedupe_posts:
+            self.logger.log(f"В целевой базе найдены дубли постов (org_id, post_id): {len(duplicates)}")
+            for org_id, post_id, count in duplicates[:self.config.log_limit_duplicates]:
+                self.logger.log(f"  - org_id {org_id}, post_id {post_id}: {count} копий")
+            if len(duplicates) > self.config.log_limit_duplicates:
+                self.logger.log(f"  ... и еще {len(duplicates) - self.config.log_limit_duplicates}")
+            raise RuntimeError(f"в целевой базе {len(duplicates)} дублей постов (org_id, post_id); "
+                               f"удалить их можно с dedupe_posts=True (--dedupe-posts)")
+
+        cursor.execute("""
+            DELETE FROM posts
+            WHERE org_id IS NOT NULL AND post_id IS NOT NULL
+              AND id NOT IN (
+                  SELECT MIN(id) FROM posts
+                  WHERE org_id IS NOT NULL AND post_id IS NOT NULL
+                  GROUP BY org_id, post_id
+              )
+        """)
+        deleted = cursor.rowcount
+        # Связи с городами удаленных постов (если таблица уже была заполнена)
+        cursor.execute("DELETE FROM post_cities WHERE post_id NOT IN (SELECT id FROM posts)")
+        self.logger.log(f"Удалено дублей постов перед созданием уникального индекса: {deleted} "
+                        f"(пар org_id, post_id: {len(duplicates)})")
+
+    def _create_secondary_indexes(self, cursor):
+        """Создает недостающие вторичные индексы"""
+        for name, definition in self.SECONDARY_INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+
+    def begin_bulk_load(self, plans):
+        """Начинает фазу загрузки по планам дампов: удаляет вторичные индексы, если их построение отложено.
+
+        Поддерживать индексы при вставке каждой строки дороже, чем построить их один раз в конце,
+        но только если загружается много строк (см. _should_defer_indexes). Если миграция
+        прервется, create_target_database при следующем запуске создаст их заново"""
+        self.phase_timings = []
+        self._load_started = time.perf_counter()
+        # Дампы без нужных таблиц (max_post_rowid = None) пропускаются и ничего не загружают
+        plans = [plan for plan in plans if plan.mode != 'unchanged' and plan.max_post_rowid is not None]
+        self.load_planned = bool(plans)
+        self.indexes_deferred = self.config.defer_indexes and self._should_defer_indexes(plans)
+        if not self.indexes_deferred:
+            return
+
+        conn = self.connect_target()
+        try:
+            with self.metrics.stage("drop_indexes"):
+                for name in self.SECONDARY_INDEXES:
+                    conn.execute(f"DROP INDEX IF EXISTS {name}")
+                conn.commit()
+        finally:
+            conn.close()
+
+        self._add_phase_timing("удаление вторичных индексов", self._load_started)
+        self._load_started = time.perf_counter()
+
+    def finish_bulk_load(self):
+        """Завершает фазу загрузки: строит отложенные индексы и обновляет статистику для планировщика.
+
+        После перестройки индексов выполняется полный ANALYZE, после небольшой дозагрузки -
+        PRAGMA optimize (пересчитывает только устаревшую статистику), без загрузки - ничего"""
+        self._add_phase_timing("загрузка", self._load_started)
+        if not self.load_planned:
+            return
+
+        conn = self.connect_target()
+        try:
+            if self.indexes_deferred:
+                started = time.perf_counter()
+                with self.metrics.stage("build_indexes"):
+                    self._create_secondary_indexes(conn.cursor())
+                    conn.commit()
+                self._add_phase_timing("построение вторичных индексов", started)
+
+                started = time.perf_counter()
+                with self.metrics.stage("analyze"):
+                    conn.execute("ANALYZE")
+                    conn.commit()
+                self._add_phase_timing("ANALYZE", started)
+            else:
+                started = time.perf_counter()
+                with self.metrics.stage("analyze"):
+                    conn.execute("PRAGMA optimize")
+                    conn.commit()
+                self._add_phase_timing("PRAGMA optimize", started)
+        finally:
+            conn.close()
+
+    def _should_defer_indexes(self, plans):
+        """Решает по планам дампов, откладывать ли вторичные индексы: при полной загрузке или
+        продолжении с контрольной точки - да, при дозагрузке - если она не меньше
+        defer_indexes_min_ratio от числа постов в базе"""
+        if any(plan.mode in ('full', 'resume') for plan in plans):
+            return True
+
+        tail_rows = sum(plan.max_post_rowid - plan.post_rowid for plan in plans)
+        if not tail_rows:
+            return False
+
+        conn = self.connect_target()
+        try:
+            posts_count = MigrationStats.load_totals(conn.cursor())[MigrationStats.POSTS]
+        finally:
+            conn.close()
+
+        if tail_rows >= posts_count * self.config.defer_indexes_min_ratio:
+            return True
+        self.logger.log(f"Вторичные индексы сохраняются: дозагрузка {tail_rows} строк постов "
+                        f"при {posts_count} постах в базе", print_message=False)
+        return False
+
+    def get_phase_timings_description(self):
+        """Строка для отчета: длительность фаз загрузки"""
+        return ", ".join(f"{phase} {seconds:.2f} сек" for phase, seconds in self.phase_timings)
+
+    def _add_phase_timing(self, phase, started):
+        """Запоминает длительность фазы загрузки и логирует ее"""
+        seconds = time.perf_counter() - started
+        self.phase_timings.append((phase, seconds))
+        self.logger.log(f"Фаза \"{phase}\": {seconds:.2f} сек", print_message=False)
+
+    def attach_vk_db(self, target_conn, vk_db_path, schema="vk"):
+        """Подключает VK базу к соединению с целевой базой через ATTACH DATABASE (только на чтение, см. open_vk_db).
+
+        ATTACH невозможен внутри транзакции, поэтому вызывается до первой записи в целевую базу"""
+        target_conn.execute("ATTACH DATABASE ? AS " + schema, (self.vk_db_uri(vk_db_path),))
+        self.apply_vk_db_settings(target_conn, self.config, schema)
+
+    def detach_vk_db(self, target_conn, schema="vk"):
+        """Отключает VK базу от соединения с целевой базой (после commit)"""
+        target_conn.execute("DETACH DATABASE " + schema)
+
     def check_vk_db_structure(self, vk_cursor, source_file):
         """Проверяет структуру VK базы данных"""
-        vk_cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-        tables = [row[0] for row in vk_cursor.fetchall()]
-        self.logger.log(f"Таблицы в файле: {', '.join(tables)}", False)
+        return self.check_vk_tables(self.get_tables(vk_cursor), source_file)
+
+    def get_tables(self, cursor):
+        """Возвращает список таблиц базы данных"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        return [row[0] for row in cursor.fetchall()]
+
+    def check_vk_tables(self, tables, source_file):
+        """Проверяет, что в VK базе есть необходимые таблицы"""
+        self.logger.log(f"Таблицы в файле: {', '.join(tables)}", print_message=False)
 
         if 'vk_groups' not in tables or 'vk_posts' not in tables:
             self.logger.log(f"Пропускаем {source_file} - отсутствуют необходимые таблицы")
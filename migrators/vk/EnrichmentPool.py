@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from migrators.vk.EventDetector import EventDetector
+from migrators.vk.PipelineMetrics import PipelineMetrics
+from migrators.vk.TextAnalyzer import TextAnalyzer
+from migrators.vk.VKMigratorLogger import VKMigratorLogger
+
+# Анализаторы рабочего процесса создаются один раз при его запуске
+_worker_text_analyzer = None
+_worker_event_detector = None
+
+
+def analyze_org(text_analyzer, url, descr):
+    """Анализирует города группы по ее URL и описанию"""
+    text_data = []
+    if url:
+        text_data.append(url)
+    if descr:
+        text_data.append(descr)
+
+    combined_text = " ".join(text_data)
+    cities, _ = text_analyzer.extract_locations_and_addresses(combined_text)
+    return cities
+
+
+def analyze_posts(text_analyzer, event_detector, contents, metrics=None):
+    """Анализирует пачку текстов постов; приглашения определяются пакетно по столбцам.
+
+    С metrics замеряются этапы EventDetector и TextAnalyzer и задержка анализа каждого поста"""
+    if metrics is None or not metrics.enabled:
+        is_event_column = event_detector.extract_features_batch(contents)['is_event']
+        return [
+            (*text_analyzer.extract_locations_and_addresses(content), bool(is_event))
+            for content, is_event in zip(contents, is_event_column)
+        ]
+
+    with metrics.stage("post_analysis.event_detection", len(contents)):
+        is_event_column = event_detector.extract_features_batch(contents)['is_event']
+
+    results = []
+    latencies = []
+    with metrics.stage("post_analysis.text_analysis", len(contents)):
+        for content, is_event in zip(contents, is_event_column):
+            started = time.perf_counter()
+            results.append((*text_analyzer.extract_locations_and_addresses(content), bool(is_event)))
+            latencies.append(time.perf_counter() - started)
+    metrics.observe("post_text_analysis", latencies)
+    return results
+
+
+def _init_worker(morphology, lemma_cache_size):
+    """Создает анализаторы в рабочем процессе"""
+    global _worker_text_analyzer, _worker_event_detector
+    _worker_text_analyzer = TextAnalyzer(VKMigratorLogger(echo=False), morphology, lemma_cache_size)
+    _worker_event_detector = EventDetector()
+
+
+def _analyze_contents(contents, metrics_enabled):
+    """Анализирует пачку текстов в рабочем процессе; возвращает результаты, метрики задачи
+    и статистику кэша лемм процесса"""
+    metrics = PipelineMetrics(metrics_enabled)
+    results = analyze_posts(_worker_text_analyzer, _worker_event_detector, contents, metrics)
+    return results, metrics.to_raw(), _worker_text_analyzer.get_lemma_cache_raw()
+
+
+class EnrichmentPool:
+    """Пул процессов для параллельного анализа текстов постов.
+
+    В пул уходят только тексты, запись в SQLite остается в родительском процессе.
+    Результаты возвращаются в порядке исходных текстов, метрики рабочих процессов
+    добавляются в metrics родительского, статистика их кэшей лемм - в text_analyzer"""
+
+    # На сколько частей делить пачку на каждый процесс, чтобы выровнять нагрузку
+    TASKS_PER_WORKER = 4
+
+    def __init__(self, logger, workers, morphology=False, lemma_cache_size=100000, metrics=None,
+                 text_analyzer=None):
+        self.logger = logger
+        self.workers = workers
+        self.metrics = metrics if metrics is not None else PipelineMetrics(enabled=False)
+        self.text_analyzer = text_analyzer
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(morphology, lemma_cache_size))
+        self.logger.log(f"Запущен пул анализа текстов: {workers} процессов")
+
+    def submit(self, contents):
+        """Отправляет тексты на анализ и возвращает функцию, ожидающую результаты"""
+        if not contents:
+            return lambda: []
+
+        task_size = max(1, -(-len(contents) // (self.workers * self.TASKS_PER_WORKER)))
+        futures = [
+            self.executor.submit(_analyze_contents, contents[start:start + task_size], self.metrics.enabled)
+            for start in range(0, len(contents), task_size)
+        ]
+
+        def collect():
+            results = []
+            for future in futures:
+                task_results, task_metrics, lemma_cache = future.result()
+                self.metrics.merge(task_metrics)
+                if self.text_analyzer is not None:
+                    self.text_analyzer.add_lemma_cache_info(lemma_cache)
+                results.extend(task_results)
+            return results
+
+        return collect
+
+    def close(self):
+        """Останавливает рабочие процессы"""
+        self.executor.shutdown()
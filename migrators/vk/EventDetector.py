@@ -1,6 +1,48 @@
 # Ключевые слова, характерные для приглашений на мероприятия
+import hashlib
 import re
-from typing import Dict, Tuple, List
+from array import array
+from collections import namedtuple
+from typing import Dict, Iterable, Tuple, List
+
+from migrators.vk.RuleEvaluator import RuleEvaluator
+
+# Признаки поста в порядке вычисления и решение по правилам
+EventFeatures = namedtuple('EventFeatures', ['has_invitation_keywords', 'has_location', 'has_date', 'has_prices',
+                                             'has_program', 'has_contact', 'has_time', 'is_event'])
+
+
+def compile_patterns(patterns: List[str], flags: int = re.IGNORECASE) -> re.Pattern:
+    """Объединяет семейство паттернов в одно регулярное выражение-альтернативу.
+
+    search по нему находит совпадение, если его находит хотя бы один исходный паттерн,
+    но текст просматривается один раз, а не по разу на каждый паттерн"""
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags)
+
+
+def compile_keywords(keywords: List[str]) -> re.Pattern:
+    """Собирает ключевые слова в префиксное дерево и компилирует его в регулярное выражение.
+
+    Общие префиксы слов проверяются один раз ("при(?:глашаем|глашение|ходите)"), поэтому
+    поиск любого из слов - один проход автомата по тексту вместо поиска каждого слова отдельно"""
+    root = {}
+    for keyword in keywords:
+        node = root
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        is_end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        if len(branches) == 1 and not is_end:
+            return branches[0]
+        alternation = '(?:' + '|'.join(branches) + ')'
+        return alternation + '?' if is_end else alternation
+
+    return re.compile(build(root))
 
 
 class EventDetector:
@@ -115,10 +157,40 @@ class EventDetector:
         r'\b[A-Z][a-z]+\s*/\s*[A-Z][a-z]+\s*/\s*[A-Z][a-z]+\b',  # тройные имена
     ]
 
+    # Ключевые слова сервиса/услуг
+    SERVICE_KEYWORDS = ['бронирование', 'бронь', 'стол', 'столы', 'ресторан', 'кафе', 'администратор', 'подробности',
+        'услуги', 'сервис', 'меню', 'винная карта', 'бар', 'клуб', 'заведение']
+
+    # Скомпилированные при загрузке класса семейства паттернов и автоматы ключевых слов:
+    # каждый признак определяется одним проходом по тексту
+    INVITATION_KEYWORDS_RE = compile_keywords(INVITATION_KEYWORDS)
+    LOCATION_KEYWORDS_RE = compile_keywords(LOCATION_KEYWORDS)
+    SERVICE_KEYWORDS_RE = compile_keywords(SERVICE_KEYWORDS)
+    TIME_RE = compile_patterns(TIME_PATTERNS)
+    DATE_RE = compile_patterns(DATE_PATTERNS)
+    CONTACT_RE = compile_patterns(CONTACT_PATTERNS)
+    PRICE_RE = compile_patterns(PRICE_PATTERNS)
+    PROGRAM_RE = compile_patterns(PROGRAM_PATTERNS)
+
+    # Версия правил: увеличивать при изменении _apply_rules (паттерны учитываются в get_version сами)
+    RULES_VERSION = 1
+
     def __init__(self, logger=None):
         """Инициализация детектора событий"""
         self.logger = logger
 
+        # Признаки в порядке вычисления: дешевые и чаще всего решающие первыми
+        # (порядок подобран по затратам и частоте признаков на корпусе дампов)
+        self.rule_evaluator = RuleEvaluator([
+            ('has_invitation_keywords', lambda content, content_lower: self._has_invitation_keywords(content_lower)),
+            ('has_location', lambda content, content_lower: self._has_location_mention(content_lower)),
+            ('has_date', lambda content, content_lower: self._has_date_mention(content_lower)),
+            ('has_prices', lambda content, content_lower: self._has_price_mention(content)),
+            ('has_program', lambda content, content_lower: self._has_program_mention(content)),
+            ('has_contact', lambda content, content_lower: self._has_contact_mention(content_lower)),
+            ('has_time', lambda content, content_lower: self._has_time_mention(content_lower)),
+        ], self._apply_rules)
+
     def is_event_invitation(self, content: str) -> bool:
         """
         Определяет, является ли пост приглашением на мероприятие
@@ -133,36 +205,24 @@ class EventDetector:
         if not content:
             return False
 
-        content_lower = content.lower()
-
-        # Проверяем наличие ключевых слов приглашения
-        has_invitation_keywords = self._has_invitation_keywords(content_lower)
+        # Признаки вычисляются лениво и только пока результат правил не определен
+        is_event = self.rule_evaluator.evaluate(content, content.lower())
 
-        # Проверяем наличие даты
-        has_date = self._has_date_mention(content_lower)
-
-        # Проверяем наличие времени
-        has_time = self._has_time_mention(content_lower)
-
-        # Проверяем наличие места
-        has_location = self._has_location_mention(content_lower)
-
-        # Проверяем наличие контактной информации
-        has_contact = self._has_contact_mention(content_lower)
-
-        # Проверяем наличие цен
-        has_prices = self._has_price_mention(content)
+        if self.logger and is_event:
+            self.logger.log(f"    Обнаружено приглашение на мероприятие", print_message=False)
 
-        # Проверяем наличие программы мероприятия
-        has_program = self._has_program_mention(content)
+        return is_event
 
+    @staticmethod
+    def _apply_rules(has_invitation_keywords: bool, has_date: bool, has_time: bool, has_location: bool,
+                     has_contact: bool, has_prices: bool, has_program: bool) -> bool:
+        """Правила определения приглашения по признакам поста"""
         # Расширенная логика определения события:
         # 1. Классический вариант: ключевые слова + (дата ИЛИ время ИЛИ место)
         # 2. Развлекательный вариант: время + контакты + (цены ИЛИ программа)
         # 3. Программный вариант: программа + время + (контакты ИЛИ цены)
         # 4. Ресторанный вариант: ключевые слова + время + цены
-
-        is_event = (
+        return (
             # Классический вариант
             (has_invitation_keywords and (has_date or has_time or has_location)) or
             # Развлекательный вариант
@@ -175,71 +235,55 @@ class EventDetector:
             (sum([has_invitation_keywords, has_time, has_contact, has_prices, has_program]) >= 3)
         )
 
-        if self.logger and is_event:
-            self.logger.log(f"    Обнаружено приглашение на мероприятие", False)
+    def get_feature_statistics(self) -> Dict[str, Dict]:
+        """Возвращает число вычислений и затраченное время по каждому признаку"""
+        return self.rule_evaluator.get_statistics()
 
-        return is_event
+    def get_version(self) -> str:
+        """
+        Версия результатов детектора для кэша анализа
+
+        Returns:
+            str: Версия правил и хэш всех паттернов признаков
+        """
+        digest = hashlib.blake2b(digest_size=8)
+        for pattern in (self.INVITATION_KEYWORDS_RE, self.LOCATION_KEYWORDS_RE, self.TIME_RE, self.DATE_RE,
+                        self.CONTACT_RE, self.PRICE_RE, self.PROGRAM_RE):
+            digest.update(pattern.pattern.encode('utf-8'))
+            digest.update(b'\0')
+        return f"e{self.RULES_VERSION}.{digest.hexdigest()}"
 
     def _has_price_mention(self, content: str) -> bool:
         """Проверяет наличие упоминания цен"""
-        for pattern in self.PRICE_PATTERNS:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True
-        return False
+        return self.PRICE_RE.search(content) is not None
 
     def _has_program_mention(self, content: str) -> bool:
         """Проверяет наличие программы мероприятия"""
-        for pattern in self.PROGRAM_PATTERNS:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True
-        return False
+        return self.PROGRAM_RE.search(content) is not None
 
     def _has_contact_mention(self, content: str) -> bool:
         """Проверяет наличие контактной информации"""
-        for pattern in self.CONTACT_PATTERNS:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True
-        return False
+        return self.CONTACT_RE.search(content) is not None
 
     def _has_service_keywords(self, content: str) -> bool:
         """Проверяет наличие ключевых слов сервиса/услуг"""
-        service_keywords = [
-            'бронирование', 'бронь', 'стол', 'столы', 'ресторан', 'кафе',
-            'администратор', 'подробности', 'услуги', 'сервис', 'меню',
-            'винная карта', 'бар', 'клуб', 'заведение'
-        ]
-        for keyword in service_keywords:
-            if keyword in content:
-                return True
-        return False
+        return self.SERVICE_KEYWORDS_RE.search(content) is not None
 
     def _has_invitation_keywords(self, content: str) -> bool:
         """Проверяет наличие ключевых слов приглашения"""
-        for keyword in self.INVITATION_KEYWORDS:
-            if keyword in content:
-                return True
-        return False
+        return self.INVITATION_KEYWORDS_RE.search(content) is not None
 
     def _has_date_mention(self, content: str) -> bool:
         """Проверяет наличие упоминания даты"""
-        for pattern in self.DATE_PATTERNS:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True
-        return False
+        return self.DATE_RE.search(content) is not None
 
     def _has_time_mention(self, content: str) -> bool:
         """Проверяет наличие упоминания времени"""
-        for pattern in self.TIME_PATTERNS:
-            if re.search(pattern, content, re.IGNORECASE):
-                return True
-        return False
+        return self.TIME_RE.search(content) is not None
 
     def _has_location_mention(self, content: str) -> bool:
         """Проверяет наличие упоминания места"""
-        for keyword in self.LOCATION_KEYWORDS:
-            if keyword in content:
-                return True
-        return False
+        return self.LOCATION_KEYWORDS_RE.search(content) is not None
 
     def _get_found_keywords(self, content: str) -> List[str]:
         """Возвращает найденные ключевые слова"""
@@ -249,43 +293,102 @@ class EventDetector:
                 found.append(keyword)
         return found
 
-    def get_event_analysis(self, content: str) -> Dict:
+    def extract_features(self, content: str) -> EventFeatures:
         """
-        Получает детальную информацию о том, почему пост считается/не считается приглашением
+        Вычисляет все признаки поста и решение по правилам, каждый признак - один раз
 
         Args:
             content: Текст поста для анализа
 
         Returns:
-            Dict: Детальный анализ поста
+            EventFeatures: Признаки и решение is_event
         """
         if not content:
-            return {
-                'is_event': False,
-                'has_invitation_keywords': False,
-                'has_date': False,
-                'has_time': False,
-                'has_location': False,
-                'has_contact': False,
-                'has_prices': False,
-                'has_program': False,
-                'has_service_keywords': False,
-                'found_keywords': []
-            }
+            return EventFeatures(*[False] * len(EventFeatures._fields))
 
         content_lower = content.lower()
+        features = {
+            name: function(content, content_lower)
+            for name, function in zip(self.rule_evaluator.names, self.rule_evaluator.functions)
+        }
+        return EventFeatures(is_event=self._apply_rules(**features), **features)
+
+    def extract_features_batch(self, texts: Iterable[str], all_features: bool = False) -> Dict[str, array]:
+        """
+        Анализирует пачку текстов и возвращает результат по столбцам
+
+        Одинаковые тексты (репосты) анализируются один раз - только за счет этого пачка
+        быстрее поштучного is_event_invitation. Каждый уникальный текст по-прежнему проверяется
+        паттернами отдельно: время уходит на сам поиск, а не на вызовы, и поиск по склеенным
+        текстам пачки не быстрее. Без all_features признаки вычисляются лениво и возвращается
+        только столбец is_event.
+        Столбцы - array('B') из 0/1: их можно передать в executemany или
+        обернуть numpy.frombuffer(column, dtype=bool) без копирования.
+
+        Args:
+            texts: Список или итератор текстов постов
+            all_features: Вернуть также столбцы всех признаков
+
+        Returns:
+            Dict: Имя столбца -> array('B') в порядке исходных текстов
+        """
+        positions = {}
+        unique_texts = []
+        text_positions = array('L')
+        for text in texts:
+            text = text or ""
+            position = positions.get(text)
+            if position is None:
+                position = positions[text] = len(unique_texts)
+                unique_texts.append(text)
+            text_positions.append(position)
+
+        if all_features:
+            unique_columns = {name: array('B') for name in EventFeatures._fields}
+            for text in unique_texts:
+                for name, value in zip(EventFeatures._fields, self.extract_features(text)):
+                    unique_columns[name].append(value)
+        else:
+            # Пустые тексты не считаются приглашениями и признаки для них не вычисляются
+            items = [(text, text.lower()) for text in unique_texts if text]
+            decisions = iter(self.rule_evaluator.evaluate_batch(items))
+            unique_columns = {'is_event': array('B', (next(decisions) if text else 0 for text in unique_texts))}
+
+        columns = {
+            name: array('B', (column[position] for position in text_positions))
+            for name, column in unique_columns.items()
+        }
+
+        if self.logger:
+            for _ in range(columns['is_event'].count(1)):
+                self.logger.log(f"    Обнаружено приглашение на мероприятие", print_message=False)
+
+        return columns
+
+    def get_event_analysis(self, content: str) -> Dict:
+        """
+        Получает детальную информацию о том, почему пост считается/не считается приглашением
+
+        Args:
+            content: Текст поста для анализа
+
+        Returns:
+            Dict: Детальный анализ поста
+        """
+        features = self.extract_features(content)
+        content_lower = content.lower() if content else ""
 
         return {
-            'is_event': self.is_event_invitation(content),
-            'has_invitation_keywords': self._has_invitation_keywords(content_lower),
-            'has_date': self._has_date_mention(content_lower),
-            'has_time': self._has_time_mention(content_lower),
-            'has_location': self._has_location_mention(content_lower),
-            'has_contact': self._has_contact_mention(content_lower),
-            'has_prices': self._has_price_mention(content),
-            'has_program': self._has_program_mention(content),
-            'has_service_keywords': self._has_service_keywords(content_lower),
-            'found_keywords': self._get_found_keywords(content_lower)
+            'is_event': features.is_event,
+            'has_invitation_keywords': features.has_invitation_keywords,
+            'has_date': features.has_date,
+            'has_time': features.has_time,
+            'has_location': features.has_location,
+            'has_contact': features.has_contact,
+            'has_prices': features.has_prices,
+            'has_program': features.has_program,
+            'has_service_keywords': bool(content) and self._has_service_keywords(content_lower),
+            'found_keywords': self._get_found_keywords(content_lower) if content else []
         }
 
     def analyze_batch(self, posts: List[Tuple]) -> Dict:
@@ -299,20 +402,14 @@ class EventDetector:
             Dict: Статистика анализа
         """
         total_posts = len(posts)
-        event_posts = 0
-        analyzed_posts = []
-
-        for post_id, content in posts:
-            is_event = self.is_event_invitation(content)
-            if is_event:
-                event_posts += 1
-            analyzed_posts.append((post_id, is_event))
+        is_event_column = self.extract_features_batch(content for _, content in posts)['is_event']
+        event_posts = sum(is_event_column)
 
         return {
             'total_posts': total_posts,
             'event_posts': event_posts,
             'regular_posts': total_posts - event_posts,
             'event_percentage': (event_posts / total_posts * 100) if total_posts > 0 else 0,
-            'analyzed_posts': analyzed_posts
+            'analyzed_posts': [(post_id, bool(is_event)) for (post_id, _), is_event in zip(posts, is_event_column)],
+            'is_event': is_event_column
         }
-
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from migrators.vk.DatabaseManager import DatabaseManager
+
+# План обработки дампа: mode - "unchanged" (пропустить), "tail" (дочитать хвост), "resume"
+# (продолжить с контрольной точки) или "full"; group_rowid и post_rowid - с каких rowid читать;
+# остальное - новое состояние
+DumpPlan = namedtuple('DumpPlan', [
+    'mode', 'group_rowid', 'post_rowid', 'file_size', 'file_mtime', 'fingerprint',
+    'max_group_rowid', 'max_post_rowid', 'max_post_date',
+])
+
+
+class MigrationState:
+    """Инкрементальная миграция по отметкам, сохраненным в таблице migration_state целевой базы.
+
+    Для каждого дампа хранятся размер, время изменения, отпечаток содержимого и наибольшие
+    rowid групп и постов (а также post_date), которые уже прочитаны. Неизменившийся дамп
+    пропускается целиком, у дополненного читаются только строки после отметок. rowid постов
+    без организации хранятся в migration_orphans: посты перечитываются с первого из них, только
+    когда для него появилась организация.
+    Если дамп перезаписан (отметки указывают на несуществующие строки), он читается полностью -
+    повторы при этом отсекаются как обычно"""
+
+    # Сколько байт с начала и с конца файла входит в отпечаток
+    FINGERPRINT_BYTES = 65536
+    # Сколько rowid постов без организации проверять одним запросом IN (...)
+    ORPHAN_BATCH_SIZE = 500
+
+    def __init__(self, config, logger):
+        self.config = config
+        self.logger = logger
+        self.modes = {'unchanged': 0, 'tail': 0, 'resume': 0, 'full': 0}
+        self.checkpoint_commits = 0  # Сколько раз транзакция фиксировалась с контрольной точкой
+
+    @classmethod
+    def fingerprint(cls, path):
+        """Отпечаток дампа: хэш начала файла (заголовок SQLite со счетчиком изменений) и его конца"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            digest.update(f.read(cls.FINGERPRINT_BYTES))
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size > cls.FINGERPRINT_BYTES:
+                f.seek(max(cls.FINGERPRINT_BYTES, size - cls.FINGERPRINT_BYTES))
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def plan(self, vk_db_path):
+        """Решает, как обрабатывать дамп: пропустить, дочитать новые строки или прочитать полностью"""
+        source_file = os.path.basename(vk_db_path)
+        stat = os.stat(vk_db_path)
+        fingerprint = self.fingerprint(vk_db_path)
+        state = self._load_state(source_file) if self.config.incremental else None
+        # Контрольная точка прерванного запуска учитывается и без инкрементальной миграции
+        checkpoint = self._load_checkpoint(source_file)
+
+        # Незавершенный журнал означает изменения, которых еще нет в основном файле
+        has_journal = DatabaseManager.has_pending_journal(vk_db_path)
+
+        unchanged_file = (state is not None and not has_journal and state['file_size'] == stat.st_size
+                          and state['file_mtime'] == stat.st_mtime and state['fingerprint'] == fingerprint)
+
+        vk_conn = DatabaseManager.open_vk_db(self.config, vk_db_path)
+        try:
+            max_group_rowid = vk_conn.execute("SELECT COALESCE(MAX(id), 0) FROM vk_groups").fetchone()[0]
+            max_post_rowid = vk_conn.execute("SELECT COALESCE(MAX(id), 0) FROM vk_posts").fetchone()[0]
+            # Первый прочитанный ранее пост без организации, для которого она появилась
+            orphan_rowid = self._find_resolved_orphan(vk_conn, source_file, state) if state is not None else None
+
+            if (checkpoint is None and unchanged_file and orphan_rowid is None
+                    and state['max_group_rowid'] == max_group_rowid and state['max_post_rowid'] == max_post_rowid):
+                return self._count(DumpPlan('unchanged', max_group_rowid, max_post_rowid, stat.st_size,
+                                            stat.st_mtime, fingerprint, max_group_rowid, max_post_rowid,
+                                            state['max_post_date']))
+
+            mode = 'full'
+            group_rowid = post_rowid = 0
+            previous_post_date = None
+            if state is not None and self._is_prefix_intact(vk_conn, state, max_group_rowid, max_post_rowid):
+                mode = 'tail'
+                group_rowid = state['max_group_rowid']
+                post_rowid = state['max_post_rowid']
+                if orphan_rowid is not None:
+                    post_rowid = min(post_rowid, orphan_rowid - 1)
+                previous_post_date = state['max_post_date']
+
+            # Дата считается только по новым строкам: стоимость пропорциональна приросту дампа
+            max_post_date = vk_conn.execute("SELECT MAX(post_date) FROM vk_posts WHERE id > ? AND id <= ?",
+                                            (post_rowid, max_post_rowid)).fetchone()[0]
+            max_post_date = max(filter(None, (max_post_date, previous_post_date)), default=None)
+
+            if (checkpoint is not None and checkpoint['group_rowid'] <= max_group_rowid
+                    and checkpoint['post_rowid'] <= max_post_rowid):
+                mode = 'resume'
+                group_rowid = checkpoint['group_rowid']
+                post_rowid = checkpoint['post_rowid']
+        except sqlite3.Error:
+            # Нет нужных таблиц: дамп будет пропущен проверкой структуры, состояние не сохраняется
+            return self._count(DumpPlan('full', 0, 0, stat.st_size, stat.st_mtime, fingerprint, None, None, None))
+        finally:
+            vk_conn.close()
+
+        return self._count(DumpPlan(mode, group_rowid, post_rowid, stat.st_size, stat.st_mtime, fingerprint,
+                                    max_group_rowid, max_post_rowid, max_post_date))
+
+    def log_plan(self, plan, source_file):
+        """Логирует, как будет обработан дамп"""
+        if plan.mode == 'unchanged':
+            self.logger.log(f"Файл {source_file} не изменился с прошлой миграции, пропускаем")
+        elif plan.mode == 'tail':
+            self.logger.log(f"Файл {source_file} дополнен: читаем группы после rowid {plan.group_rowid}, "
+                            f"посты после rowid {plan.post_rowid}")
+        elif plan.mode == 'resume':
+            self.logger.log(f"Продолжаем {source_file} с контрольной точки: группы после rowid {plan.group_rowid}, "
+                            f"посты после rowid {plan.post_rowid}")
+
+    def save(self, target_cursor, source_file, plan, orphan_rowids=()):
+        """Записывает новые отметки дампа и снимает его контрольную точку; вызывается в той же
+        транзакции, что и запись данных.
+
+        orphan_rowids - rowid прочитанных в этот раз постов без организации"""
+        target_cursor.execute("DELETE FROM migration_checkpoint WHERE source_file = ?", (source_file,))
+        if plan.max_post_rowid is None:
+            return
+
+        self.save_orphans(target_cursor, source_file, plan.post_rowid, orphan_rowids)
+        target_cursor.execute("""
+            INSERT OR REPLACE INTO migration_state (source_file, file_size, file_mtime, fingerprint,
+                                                    max_group_rowid, max_post_rowid, max_post_date, migrated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (source_file, plan.file_size, plan.file_mtime, plan.fingerprint, plan.max_group_rowid,
+              plan.max_post_rowid, plan.max_post_date, datetime.now().isoformat(timespec='seconds')))
+
+    @staticmethod
+    def save_orphans(target_cursor, source_file, post_rowid, orphan_rowids):
+        """Заменяет отмеченные посты без организации после post_rowid (перечитанные заново) на orphan_rowids"""
+        target_cursor.execute("DELETE FROM migration_orphans WHERE source_file = ? AND post_rowid > ?",
+                              (source_file, post_rowid))
+        target_cursor.executemany("INSERT OR IGNORE INTO migration_orphans (source_file, post_rowid) VALUES (?, ?)",
+                                  [(source_file, rowid) for rowid in orphan_rowids])
+
+    def get_report_value(self):
+        """Строка для отчета: сколько дампов пропущено, дочитано и прочитано полностью"""
+        return (f"{'включена' if self.config.incremental else 'выключена'}; "
+                f"без изменений {self.modes['unchanged']}, дочитано {self.modes['tail']}, "
+                f"продолжено с контрольной точки {self.modes['resume']}, полностью {self.modes['full']}")
+
+    def _count(self, plan):
+        """Учитывает план в счетчиках отчета"""
+        self.modes[plan.mode] += 1
+        return plan
+
+    def _load_state(self, source_file):
+        """Загружает сохраненное состояние дампа из целевой базы"""
+        return self._load_row("migration_state", source_file)
+
+    def _load_checkpoint(self, source_file):
+        """Загружает контрольную точку незавершенной миграции дампа"""
+        return self._load_row("migration_checkpoint", source_file)
+
+    def _load_row(self, table, source_file):
+        """Загружает строку таблицы состояния по имени дампа"""
+        target_conn = sqlite3.connect(self.config.target_db_path)
+        try:
+            target_conn.row_factory = sqlite3.Row
+            return target_conn.execute(f"SELECT * FROM {table} WHERE source_file = ?", (source_file,)).fetchone()
+        finally:
+            target_conn.close()
+
+    def _find_resolved_orphan(self, vk_conn, source_file, state):
+        """Возвращает наименьший rowid отмеченного поста без организации, для которого организация
+        уже есть в целевой базе или будет добавлена из новых групп дампа; None - таких нет"""
+        target_conn = sqlite3.connect(self.config.target_db_path)
+        try:
+            orphan_rowids = [rowid for (rowid,) in target_conn.execute(
+                "SELECT post_rowid FROM migration_orphans WHERE source_file = ? ORDER BY post_rowid",
+                (source_file,))]
+
+            for start in range(0, len(orphan_rowids), self.ORPHAN_BATCH_SIZE):
+                batch = orphan_rowids[start:start + self.ORPHAN_BATCH_SIZE]
+                placeholders = ", ".join("?" * len(batch))
+                rows = vk_conn.execute(f"""
+                    SELECT vp.id, COALESCE(NULLIF(vg.url, ''), vp.vk_group_url)
+                    FROM vk_posts vp
+                    LEFT JOIN vk_groups vg ON vp.group_id = vg.id
+                    WHERE vp.id IN ({placeholders})
+                    ORDER BY vp.id
+                """, batch).fetchall()
+                for rowid, group_url in rows:
+                    if group_url is None:
+                        continue
+                    if target_conn.execute("SELECT 1 FROM orgs WHERE url = ?", (group_url,)).fetchone():
+                        return rowid
+                    if vk_conn.execute("SELECT 1 FROM vk_groups WHERE url = ? AND id > ?",
+                                       (group_url, state['max_group_rowid'] or 0)).fetchone():
+                        return rowid
+            return None
+        finally:
+            target_conn.close()
+
+    @staticmethod
+    def _is_prefix_intact(vk_conn, state, max_group_rowid, max_post_rowid):
+        """Проверяет, что прочитанная ранее часть дампа на месте: дамп не стал короче отметок,
+        а последний пост до отметки не новее сохраненной post_date"""
+        if state['max_group_rowid'] is None or state['max_post_rowid'] is None:
+            return False
+        if state['max_group_rowid'] > max_group_rowid or state['max_post_rowid'] > max_post_rowid:
+            return False
+
+        last_post = vk_conn.execute("SELECT post_date FROM vk_posts WHERE id <= ? ORDER BY id DESC LIMIT 1",
+                                    (state['max_post_rowid'],)).fetchone()
+        if last_post is None:
+            return not state['max_post_rowid']
+        return last_post[0] is None or state['max_post_date'] is None or last_post[0] <= state['max_post_date']
+
+
+class Checkpointer:
+    """Промежуточные фиксации записи одного дампа с контрольной точкой в migration_checkpoint.
+
+    Транзакция фиксируется каждые commit_every_rows прочитанных строк или commit_every_seconds
+    секунд, поэтому журнал не растет на весь дамп, а после сбоя миграция файла продолжается
+    с последней контрольной точки (см. MigrationState.plan)"""
+
+    def __init__(self, config, source_file, plan):
+        self.config = config
+        self.source_file = source_file
+        self.plan = plan
+        self.rows = 0
+        self.last_commit_time = time.perf_counter()
+        self.commits = 0
+
+    def is_due(self, rows):
+        """Учитывает прочитанные строки и сообщает, пора ли фиксировать транзакцию"""
+        self.rows += rows
+        if self.config.commit_every_rows and self.rows >= self.config.commit_every_rows:
+            return True
+        return bool(self.config.commit_every_seconds and
+                    time.perf_counter() - self.last_commit_time >= self.config.commit_every_seconds)
+
+    def commit(self, target_cursor, post_rowid=None, orphan_rowids=()):
+        """Сохраняет контрольную точку и фиксирует транзакцию.
+
+        Группы к этому моменту записаны полностью; post_rowid - последний полностью записанный
+        rowid поста (None - посты еще не начинались), orphan_rowids - прочитанные посты без организации"""
+        MigrationState.save_orphans(target_cursor, self.source_file, self.plan.post_rowid, orphan_rowids)
+        target_cursor.execute("""
+            INSERT OR REPLACE INTO migration_checkpoint (source_file, group_rowid, post_rowid, updated_at)
+            VALUES (?, ?, ?, ?)
+        """, (self.source_file, self.plan.max_group_rowid,
+              self.plan.post_rowid if post_rowid is None else post_rowid,
+              datetime.now().isoformat(timespec='seconds')))
+        target_cursor.connection.commit()
+
+        self.rows = 0
+        self.last_commit_time = time.perf_counter()
+        self.commits += 1
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+
+
+class MigrationStats:
+    """Статистика целевой базы в таблице migration_stats, которая ведется во время миграции.
+
+    Мигратор знает, какие организации и посты он добавил и какие города, адреса и признак события
+    у них нашлись, поэтому счетчики увеличиваются пакетами в той же транзакции, что и запись
+    данных: после отката или сбоя они остаются согласованными с базой. Отчету достаточно прочитать
+    несколько строк вместо просмотра всей базы. Строка - (metric, city_id, value): для общих
+    счетчиков city_id равен 0, для счетчиков по городам - id из справочника cities"""
+
+    ORGS = "orgs"
+    ORGS_WITH_CITIES = "orgs_with_cities"
+    POSTS = "posts"
+    POSTS_WITH_CITIES = "posts_with_cities"
+    POSTS_WITH_ADDRESSES = "posts_with_addresses"
+    POSTS_EVENTS = "posts_events"
+    ORG_CITY = "org_city"  # Организаций с городом city_id
+    POST_CITY = "post_city"  # Постов с городом city_id
+
+    TOTALS = (ORGS, ORGS_WITH_CITIES, POSTS, POSTS_WITH_CITIES, POSTS_WITH_ADDRESSES, POSTS_EVENTS)
+
+    @classmethod
+    def add_orgs(cls, target_cursor, orgs):
+        """Учитывает добавленные организации; orgs - список (url, города)"""
+        if not orgs:
+            return
+
+        cls._add_totals(target_cursor, {
+            cls.ORGS: len(orgs),
+            cls.ORGS_WITH_CITIES: sum(1 for _, cities in orgs if cities),
+        })
+        cls._add_cities(target_cursor, cls.ORG_CITY, Counter(city for _, cities in orgs for city in set(cities)))
+
+    @classmethod
+    def add_posts(cls, target_cursor, posts):
+        """Учитывает добавленные посты; posts - список (города, адреса, признак события)"""
+        if not posts:
+            return
+
+        cls._add_totals(target_cursor, {
+            cls.POSTS: len(posts),
+            cls.POSTS_WITH_CITIES: sum(1 for cities, _, _ in posts if cities),
+            cls.POSTS_WITH_ADDRESSES: sum(1 for _, addresses, _ in posts if addresses),
+            cls.POSTS_EVENTS: sum(1 for _, _, is_event in posts if is_event),
+        })
+        cls._add_cities(target_cursor, cls.POST_CITY, Counter(city for cities, _, _ in posts for city in set(cities)))
+
+    @classmethod
+    def load_totals(cls, cursor):
+        """Возвращает общие счетчики {метрика: значение}"""
+        cursor.execute("SELECT metric, value FROM migration_stats WHERE city_id = 0")
+        totals = dict.fromkeys(cls.TOTALS, 0)
+        totals.update(cursor.fetchall())
+        return totals
+
+    @staticmethod
+    def load_top_cities(cursor, metric, limit):
+        """Возвращает [(город, значение)] с наибольшими счетчиками метрики"""
+        cursor.execute("""
+            SELECT c.name, s.value
+            FROM migration_stats s
+            JOIN cities c ON c.id = s.city_id
+            WHERE s.metric = ? AND s.city_id != 0 AND s.value > 0
+            ORDER BY s.value DESC, c.name
+            LIMIT ?
+        """, (metric, limit))
+        return cursor.fetchall()
+
+    @classmethod
+    def recompute(cls, cursor):
+        """Пересчитывает всю статистику по данным целевой базы (для новой таблицы и для проверки)"""
+        cursor.execute("DELETE FROM migration_stats")
+        cursor.execute("""
+            INSERT INTO migration_stats (metric, city_id, value)
+            SELECT ?, 0, (SELECT COUNT(*) FROM orgs)
+            UNION ALL SELECT ?, 0, (SELECT COUNT(*) FROM orgs WHERE cities IS NOT NULL AND cities != '[]')
+            UNION ALL SELECT ?, 0, (SELECT COUNT(*) FROM posts)
+            UNION ALL SELECT ?, 0, (SELECT COUNT(*) FROM posts WHERE cities IS NOT NULL AND cities != '[]')
+            UNION ALL SELECT ?, 0, (SELECT COUNT(*) FROM posts WHERE address IS NOT NULL AND address != '[]')
+            UNION ALL SELECT ?, 0, (SELECT COUNT(*) FROM posts WHERE maybe_event)
+        """, cls.TOTALS)
+        cursor.execute("""
+            INSERT INTO migration_stats (metric, city_id, value)
+            SELECT ?, city_id, COUNT(*) FROM org_cities GROUP BY city_id
+        """, (cls.ORG_CITY,))
+        cursor.execute("""
+            INSERT INTO migration_stats (metric, city_id, value)
+            SELECT ?, city_id, COUNT(*) FROM post_cities GROUP BY city_id
+        """, (cls.POST_CITY,))
+
+    @staticmethod
+    def _add_totals(target_cursor, deltas):
+        """Увеличивает общие счетчики"""
+        target_cursor.executemany("""
+            INSERT INTO migration_stats (metric, city_id, value) VALUES (?, 0, ?)
+            ON CONFLICT (metric, city_id) DO UPDATE SET value = value + excluded.value
+        """, [(metric, delta) for metric, delta in deltas.items() if delta])
+
+    @staticmethod
+    def _add_cities(target_cursor, metric, city_counts):
+        """Увеличивает счетчики по городам (города уже добавлены в справочник cities)"""
+        target_cursor.executemany("""
+            INSERT INTO migration_stats (metric, city_id, value)
+            SELECT ?, id, ? FROM cities WHERE name = ?
+            ON CONFLICT (metric, city_id) DO UPDATE SET value = value + excluded.value
+        """, [(metric, count, city) for city, count in city_counts.items()])
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+from functools import lru_cache
+
+from migrators.cities import get_city_index, fold_city_name
+
+
+class MorphCityNormalizer:
+    """Поиск городов в падежных формах ("в Москве", "из Казани") через леммы pymorphy2.
+
+    pymorphy2 загружается только при первом обращении, поэтому без морфологии время запуска
+    не меняется. Леммы слов кэшируются в ограниченном LRU кэше: одни и те же словоформы
+    повторяются в постах постоянно"""
+
+    # Проверяются только слова с заглавной буквы: так меньше ложных совпадений и разборов
+    _WORD = re.compile(r'\b[А-ЯЁ][А-Яа-яёЁ\-]{2,}\b')
+
+    def __init__(self, logger, cache_size=100000):
+        self.logger = logger
+        self.cache_size = cache_size
+        self.city_index = get_city_index()
+        self.morph = None
+        self.available = True
+        self._get_lemmas = lru_cache(maxsize=cache_size)(self._parse_lemmas)
+
+    def extract_cities(self, text):
+        """Возвращает множество городов, найденных по леммам слов и пар слов текста"""
+        if not self.is_available():
+            return set()
+
+        found_cities = set()
+        previous_lemmas = ()
+        previous_end = None
+
+        for word_match in self._WORD.finditer(text):
+            lemmas = self._get_lemmas(word_match.group())
+
+            for lemma in lemmas:
+                city = self.city_index.get(lemma)
+                if city:
+                    found_cities.add(city)
+
+            # Города из двух соседних слов: "в Нижнем Новгороде" -> "нижний новгород"
+            if previous_end is not None and text[previous_end:word_match.start()].isspace():
+                for previous_lemma in previous_lemmas:
+                    for lemma in lemmas:
+                        city = self.city_index.get(f"{previous_lemma} {lemma}")
+                        if city:
+                            found_cities.add(city)
+
+            previous_lemmas = lemmas
+            previous_end = word_match.end()
+
+        return found_cities
+
+    def is_available(self):
+        """Загружает pymorphy2, если он еще не загружен, и сообщает, работает ли морфология"""
+        return self.available and self._load()
+
+    def get_cache_info(self):
+        """Возвращает статистику кэша лемм (hits, misses, maxsize, currsize)"""
+        return self._get_lemmas.cache_info()
+
+    def _load(self):
+        """Загружает pymorphy2 при первом обращении; при ошибке отключает морфологию"""
+        if self.morph is not None:
+            return True
+
+        try:
+            import pymorphy2
+            self.morph = pymorphy2.MorphAnalyzer()
+        except Exception as e:
+            self.available = False
+            self.logger.log(f"Морфологический анализ городов отключен: не удалось загрузить pymorphy2 ({e})")
+            return False
+
+        self.logger.log("pymorphy2 загружен для морфологического анализа городов", print_message=False)
+        return True
+
+    def _parse_lemmas(self, word):
+        """Возвращает свернутые нормальные формы всех разборов слова"""
+        lemmas = []
+        for parse in self.morph.parse(word):
+            lemma = fold_city_name(parse.normal_form)
+            if lemma not in lemmas:
+                lemmas.append(lemma)
+        return tuple(lemmas)
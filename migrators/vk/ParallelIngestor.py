@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import multiprocessing
+import os
+import queue
+from collections import deque
+
+from migrators.vk.AnalysisCache import AnalysisCache, get_analysis_version
+from migrators.vk.ChunkReader import ChunkReader
+from migrators.vk.DatabaseManager import DatabaseManager
+from migrators.vk.EnrichmentPool import analyze_org, analyze_posts
+from migrators.vk.EventDetector import EventDetector
+from migrators.vk.MigrationState import Checkpointer
+from migrators.vk.PipelineMetrics import PipelineMetrics
+from migrators.vk.TextAnalyzer import TextAnalyzer
+from migrators.vk.VKMigratorLogger import VKMigratorLogger
+
+
+def read_dump(config, vk_db_path, messages, group_rowid=0, post_rowid=0):
+    """Читает и анализирует один VK дамп в отдельном процессе.
+
+    Результат уходит в очередь messages упорядоченным потоком пар (тип, данные), который
+    записывает DataMigrator.write_analyzed_dump. Целевая база открывается только на чтение:
+    по ней отсекаются уже существующие организации и посты, чтобы не анализировать их повторно.
+    Решение о вставке принимает писатель, поэтому на результат это не влияет.
+    Читаются только группы и посты с rowid больше group_rowid и post_rowid. Статистика кэша
+    лемм и время этапов чтения и анализа уходят писателю сообщениями 'lemma_cache' и 'metrics'
+    перед сигналом завершения"""
+    analysis_cache = None
+    try:
+        logger = VKMigratorLogger(echo=False)
+        text_analyzer = TextAnalyzer(logger, config.morphology, config.lemma_cache_size)
+        event_detector = EventDetector()
+        reader = ChunkReader(config)
+        metrics = PipelineMetrics(config.pipeline_metrics)
+        analysis_cache = AnalysisCache.open(config, logger, get_analysis_version(text_analyzer, event_detector))
+
+        # Дамп и целевая база открыты только на чтение: из профиля берутся лишь настройки кэша и mmap
+        vk_conn = DatabaseManager.open_vk_db(config, vk_db_path, timeout=config.parallel_read_timeout)
+        vk_cursor = vk_conn.cursor()
+
+        vk_cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = [row[0] for row in vk_cursor.fetchall()]
+        messages.put(('tables', tables))
+        if 'vk_groups' not in tables or 'vk_posts' not in tables:
+            vk_conn.close()
+            messages.put(('done', None))
+            return
+
+        target_uri = DatabaseManager.file_uri(config.target_db_path, mode="ro")
+        vk_cursor.execute("ATTACH DATABASE ? AS target", (target_uri,))
+        DatabaseManager.apply_profile(vk_conn, DatabaseManager.get_profile(config.connection_profile), "target",
+                                      read_only=True)
+
+        _read_groups(vk_cursor, reader, text_analyzer, metrics, group_rowid, messages)
+        _read_posts(vk_cursor, reader, text_analyzer, event_detector, analysis_cache, metrics, config, post_rowid,
+                    messages)
+
+        vk_conn.close()
+        if analysis_cache is not None:
+            messages.put(('analysis_cache', analysis_cache.get_statistics()))
+        messages.put(('lemma_cache', text_analyzer.get_lemma_cache_raw()))
+        messages.put(('metrics', metrics.to_raw()))
+        messages.put(('done', None))
+
+    except Exception as e:
+        messages.put(('error', str(e)))
+
+    finally:
+        if analysis_cache is not None:
+            analysis_cache.close()
+
+
+def _read_groups(vk_cursor, reader, text_analyzer, metrics, group_rowid, messages):
+    """Читает группы дампа; существующие в целевой базе передаются без анализа"""
+    vk_cursor.execute("SELECT COUNT(*) FROM vk_groups WHERE id > ?", (group_rowid,))
+    messages.put(('groups_count', vk_cursor.fetchone()[0]))
+
+    chunks = reader.iter_chunks(vk_cursor, """
+        SELECT g.url, g.descr, g.last_checked_date, g.last_post_date, g.last_event_date,
+               EXISTS (SELECT 1 FROM target.orgs o WHERE o.url = g.url)
+        FROM vk_groups g
+        WHERE g.id > ?
+        ORDER BY g.id
+    """, (group_rowid,))
+    for chunk in metrics.iterate("read_groups", chunks):
+        groups = []
+        for url, descr, last_checked_date, last_post_date, last_event_date, exists in chunk:
+            if exists:
+                groups.append((url, None, None))
+                continue
+
+            with metrics.stage("org_analysis", 1):
+                cities = analyze_org(text_analyzer, url, descr)
+            cities_json = json.dumps(cities, ensure_ascii=False) if cities else "[]"
+            groups.append((url, (url, descr, last_checked_date, last_post_date, last_event_date, cities_json), cities))
+        messages.put(('orgs', groups))
+
+    messages.put(('orgs_done', None))
+
+
+def _read_posts(vk_cursor, reader, text_analyzer, event_detector, analysis_cache, metrics, config, post_rowid,
+                messages):
+    """Читает и анализирует посты дампа, которых еще нет в целевой базе"""
+    vk_cursor.execute("SELECT COUNT(*) FROM vk_posts WHERE id > ?", (post_rowid,))
+    posts_count = vk_cursor.fetchone()[0]
+    vk_cursor.execute("""
+        SELECT COUNT(*)
+        FROM vk_posts vp
+        LEFT JOIN vk_groups vg ON vp.group_id = vg.id
+        WHERE vp.post_id IS NOT NULL
+          AND COALESCE(NULLIF(vg.url, ''), vp.vk_group_url) IS NOT NULL
+          AND vp.id > ?
+    """, (post_rowid,))
+    messages.put(('posts_count', (posts_count, vk_cursor.fetchone()[0])))
+
+    vk_cursor.execute("""
+        SELECT vp.group_id, vp.post_content, vp.post_date, vp.post_likes,
+               vp.post_comments, vp.post_reposts, vp.post_images,
+               vp.vk_group_url, vp.post_id, vg.url
+        FROM vk_posts vp
+        LEFT JOIN vk_groups vg ON vp.group_id = vg.id
+        JOIN target.orgs o ON o.url = COALESCE(NULLIF(vg.url, ''), vp.vk_group_url)
+        WHERE vp.post_id IS NOT NULL
+          AND vp.id > ?
+          AND EXISTS (
+              SELECT 1 FROM target.posts p
+              WHERE p.org_id = o.id AND p.post_id = vp.post_id
+          )
+        ORDER BY vp.id
+        LIMIT ?
+    """, (post_rowid, config.log_limit_examples))
+    messages.put(('existing_posts', vk_cursor.fetchall()))
+
+    chunks = reader.iter_keyset_chunks(vk_cursor, """
+        SELECT vp.id, vp.group_id, vp.post_content, vp.post_date, vp.post_likes,
+               vp.post_comments, vp.post_reposts, vp.post_images,
+               vp.vk_group_url, vp.post_id, vg.url
+        FROM vk_posts vp
+        LEFT JOIN vk_groups vg ON vp.group_id = vg.id
+        WHERE vp.post_id IS NOT NULL
+          AND COALESCE(NULLIF(vg.url, ''), vp.vk_group_url) IS NOT NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM target.posts p
+              JOIN target.orgs o ON o.id = p.org_id
+              WHERE o.url = COALESCE(NULLIF(vg.url, ''), vp.vk_group_url) AND p.post_id = vp.post_id
+          )
+          AND vp.id > ?
+        ORDER BY vp.id
+        LIMIT ?
+    """, last_id=post_rowid)
+    # Время чтения включает и отсечение существующих постов
+    for chunk in metrics.iterate("read_posts", chunks):
+        chunk_posts = [row[1:] for row in chunk]
+        contents = [post[1] for post in chunk_posts]
+        with metrics.stage("post_analysis", len(contents)):
+            if analysis_cache is not None:
+                analysis = analysis_cache.analyze_now(
+                    contents, lambda missing: analyze_posts(text_analyzer, event_detector, missing, metrics))
+            else:
+                analysis = analyze_posts(text_analyzer, event_detector, contents, metrics)
+        posts = [
+            (row[0], post, post[9] or post[7], cities, addresses, is_event)
+            for row, post, (cities, addresses, is_event) in zip(chunk, chunk_posts, analysis)
+        ]
+        messages.put(('posts', posts))
+
+
+class ParallelIngestor:
+    """Параллельная миграция нескольких VK дампов.
+
+    Дампы читаются и анализируются одновременно в parallel_dumps процессах, а записываются
+    одним писателем строго по очереди файлов (крупные первыми). Поэтому организации всегда
+    записываются раньше постов, а счетчики по файлам совпадают с последовательным запуском"""
+
+    def __init__(self, config, logger, db_manager, data_migrator, migration_state):
+        self.config = config
+        self.logger = logger
+        self.db_manager = db_manager
+        self.data_migrator = data_migrator
+        self.migration_state = migration_state
+
+    def run(self, vk_files, plans):
+        """Мигрирует файлы по их планам и возвращает (организаций добавлено, постов добавлено, файлов обработано)"""
+        context = multiprocessing.get_context()
+        files = zip(vk_files, plans)
+        readers = deque()
+
+        def start_next_reader():
+            vk_db_path, plan = next(files, (None, None))
+            if vk_db_path is None:
+                return
+            if plan.mode == 'unchanged':
+                # Неизменившийся дамп не читается, процесс для него не нужен
+                readers.append((vk_db_path, plan, None, None))
+                start_next_reader()
+                return
+            messages = context.Queue(maxsize=self.config.parallel_queue_chunks)
+            process = context.Process(target=read_dump, daemon=True,
+                                      args=(self.config, vk_db_path, messages, plan.group_rowid, plan.post_rowid))
+            process.start()
+            readers.append((vk_db_path, plan, messages, process))
+
+        for _ in range(self.config.parallel_dumps):
+            start_next_reader()
+
+        self.logger.log(f"Параллельная обработка дампов: {self.config.parallel_dumps} процессов чтения")
+
+        total_orgs_migrated = 0
+        total_posts_migrated = 0
+        files_processed = 0
+
+        target_conn = self.db_manager.connect_target(timeout=self.config.parallel_read_timeout)
+        # Без этого при переполнении кэша писатель захватывает EXCLUSIVE до конца транзакции,
+        # и процессы чтения, сверяющиеся с целевой базой, ждут его, пока он ждет их данных
+        target_conn.execute("PRAGMA cache_spill = OFF")
+        try:
+            target_cursor = target_conn.cursor()
+            org_ids = dict(target_cursor.execute("SELECT url, id FROM orgs").fetchall())
+
+            while readers:
+                vk_db_path, plan, messages, process = readers.popleft()
+                orgs_migrated, posts_migrated = self._write_dump(target_conn, vk_db_path, plan, messages, process,
+                                                                 org_ids)
+                if process is not None:
+                    process.join()
+                    start_next_reader()
+
+                total_orgs_migrated += orgs_migrated
+                total_posts_migrated += posts_migrated
+                files_processed += 1
+        finally:
+            target_conn.close()
+            for _, _, _, process in readers:
+                if process is not None:
+                    process.terminate()
+
+        return total_orgs_migrated, total_posts_migrated, files_processed
+
+    def _write_dump(self, target_conn, vk_db_path, plan, messages, process, org_ids):
+        """Записывает в целевую базу один дамп из очереди его процесса чтения"""
+        source_file = os.path.basename(vk_db_path)
+        self.logger.log(f"\n--- Обработка файла: {source_file} ---")
+
+        try:
+            file_size = os.path.getsize(vk_db_path)
+            self.logger.log(f"Размер файла: {file_size / 1024 / 1024:.2f} MB")
+
+            self.migration_state.log_plan(plan, source_file)
+            if plan.mode == 'unchanged':
+                return 0, 0
+
+            stream = self._receive(messages, process)
+            kind, tables = next(stream)
+            if not self.db_manager.check_vk_tables(tables, source_file):
+                for _ in stream:
+                    pass
+                return 0, 0
+
+            target_cursor = target_conn.cursor()
+            # Транзакция фиксируется после организаций и затем периодически с контрольной точкой;
+            # при ошибке откатывается только часть после последней из них
+            checkpointer = Checkpointer(self.config, source_file, plan)
+            self.data_migrator.checkpointer = checkpointer
+            try:
+                orgs_migrated, posts_migrated = self.data_migrator.write_analyzed_dump(
+                    target_cursor, stream, org_ids, source_file, plan.group_rowid, plan.post_rowid)
+            finally:
+                self.data_migrator.checkpointer = None
+                self.migration_state.checkpoint_commits += checkpointer.commits
+            # Отметки дампа фиксируются в одной транзакции с его данными
+            with self.data_migrator.metrics.stage("commit"):
+                self.migration_state.save(target_cursor, source_file, plan, self.data_migrator.orphan_rowids)
+                target_conn.commit()
+
+            self.logger.log(
+                f"Завершена обработка {source_file}: организаций +{orgs_migrated}, постов +{posts_migrated}")
+            return orgs_migrated, posts_migrated
+
+        except Exception as e:
+            # Процесс чтения может ждать места в очереди, которую больше никто не прочитает
+            if process is not None:
+                process.terminate()
+            target_conn.rollback()
+            # id организаций из откатанной транзакции больше не действительны
+            org_ids.clear()
+            org_ids.update(target_conn.execute("SELECT url, id FROM orgs").fetchall())
+            self.logger.log(f"Ошибка при обработке {vk_db_path}: {str(e)}")
+            return 0, 0
+
+    def _receive(self, messages, process):
+        """Отдает сообщения процесса чтения до сигнала завершения"""
+        while True:
+            try:
+                # Время, которое писатель ждет данных процессов чтения
+                with self.data_migrator.metrics.stage("read_wait"):
+                    kind, payload = messages.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError("процесс чтения дампа завершился аварийно")
+                continue
+
+            if kind == 'done':
+                return
+            if kind == 'error':
+                raise RuntimeError(payload)
+            yield kind, payload
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import bisect
+import time
+
+
+class _Stage:
+    """Замер одного выполнения этапа (контекстный менеджер)"""
+
+    __slots__ = ('metrics', 'name', 'rows', 'wall', 'cpu')
+
+    def __init__(self, metrics, name, rows):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows  # Можно уточнить внутри блока, если число строк известно только в конце
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.add(self.name, time.perf_counter() - self.wall, time.process_time() - self.cpu, self.rows)
+        return False
+
+
+class _NoStage:
+    """Пустой замер для выключенных метрик"""
+
+    __slots__ = ('rows',)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class PipelineMetrics:
+    """Время и пропускная способность этапов конвейера миграции.
+
+    Для каждого этапа копятся число вызовов и строк, время по часам (wall) и процессорное
+    время процесса (cpu). Замеряются пачки, а не отдельные строки, поэтому накладные расходы
+    малы; задержка анализа каждого поста копится в гистограмме с фиксированными корзинами.
+    Метрики процессов чтения и пула анализа передаются в основной процесс через to_raw/merge.
+    CPU основного процесса не включает время рабочих процессов: его видно в их собственных этапах.
+    Вложенный этап называется через точку после родительского (post_analysis.text_analysis):
+    его время уже входит в родительский, поэтому в slowest_stages он не учитывается"""
+
+    # Верхние границы корзин гистограмм, мс (последняя корзина - все, что больше)
+    LATENCY_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000)
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = {}  # этап -> [вызовов, строк, wall, cpu]
+        self.histograms = {}  # имя -> [счетчики корзин, количество, сумма мс, максимум мс]
+        self.started = time.perf_counter()
+
+    def stage(self, name, rows=0):
+        """Контекстный менеджер замера этапа: with metrics.stage("post_insert", len(rows)): ..."""
+        if not self.enabled:
+            return _NoStage()
+        return _Stage(self, name, rows)
+
+    def add(self, name, wall, cpu, rows=0, calls=1):
+        """Добавляет замер этапа"""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = [0, 0, 0.0, 0.0]
+        stage[0] += calls
+        stage[1] += rows
+        stage[2] += wall
+        stage[3] += cpu
+
+    def iterate(self, name, chunks):
+        """Отдает пачки из chunks, замеряя время получения каждой как этап name (строки - размер пачки)"""
+        if not self.enabled:
+            yield from chunks
+            return
+
+        iterator = iter(chunks)
+        while True:
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            chunk = next(iterator, None)
+            if chunk is None:
+                self.add(name, time.perf_counter() - wall, time.process_time() - cpu, 0, 0)
+                return
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu, len(chunk))
+            yield chunk
+
+    def observe(self, name, seconds):
+        """Добавляет в гистограмму name длительности seconds (список, в секундах)"""
+        if not self.enabled or not seconds:
+            return
+
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = [[0] * (len(self.LATENCY_BUCKETS_MS) + 1), 0, 0.0, 0.0]
+        counts = histogram[0]
+        for value in seconds:
+            ms = value * 1000
+            counts[bisect.bisect_left(self.LATENCY_BUCKETS_MS, ms)] += 1
+            histogram[2] += ms
+            if ms > histogram[3]:
+                histogram[3] = ms
+        histogram[1] += len(seconds)
+
+    def to_raw(self):
+        """Накопленные значения для передачи из другого процесса"""
+        return {'stages': self.stages, 'histograms': self.histograms}
+
+    def merge(self, raw):
+        """Добавляет значения, накопленные в другом процессе (см. to_raw)"""
+        if not self.enabled or not raw:
+            return
+
+        for name, (calls, rows, wall, cpu) in raw['stages'].items():
+            self.add(name, wall, cpu, rows, calls)
+        for name, (counts, count, total, maximum) in raw['histograms'].items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = [[0] * len(counts), 0, 0.0, 0.0]
+            histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+            histogram[1] += count
+            histogram[2] += total
+            histogram[3] = max(histogram[3], maximum)
+
+    def get_report(self):
+        """Метрики для JSON раздела отчета: этапы по убыванию времени и гистограммы с перцентилями"""
+        stages = {}
+        for name, (calls, rows, wall, cpu) in sorted(self.stages.items(), key=lambda item: -item[1][2]):
+            stages[name] = {
+                'calls': calls,
+                'rows': rows,
+                'wall_s': round(wall, 4),
+                'cpu_s': round(cpu, 4),
+                'rows_per_sec': round(rows / wall, 1) if rows and wall > 0 else None,
+            }
+
+        histograms = {}
+        for name, (counts, count, total, maximum) in self.histograms.items():
+            histograms[name] = {
+                'count': count,
+                'mean_ms': round(total / count, 4) if count else None,
+                'p50_ms': self._percentile(counts, count, 0.5, maximum),
+                'p90_ms': self._percentile(counts, count, 0.9, maximum),
+                'p99_ms': self._percentile(counts, count, 0.99, maximum),
+                'max_ms': round(maximum, 4),
+                'buckets_le_ms': list(self.LATENCY_BUCKETS_MS) + ['inf'],
+                'counts': counts,
+            }
+
+        return {
+            'enabled': self.enabled,
+            'wall_s': round(time.perf_counter() - self.started, 4),
+            'stages': stages,
+            'histograms': histograms,
+        }
+
+    def slowest_stages(self, limit):
+        """Самые долгие этапы верхнего уровня (без вложенных): список (этап, wall) по убыванию времени"""
+        stages = [(name, stage[2]) for name, stage in self.stages.items() if '.' not in name]
+        return sorted(stages, key=lambda item: -item[1])[:limit]
+
+    def _percentile(self, counts, count, fraction, maximum):
+        """Оценка перцентиля по гистограмме: верхняя граница корзины, в которую он попадает"""
+        if not count:
+            return None
+        target = fraction * count
+        seen = 0
+        for bound, bucket_count in zip(self.LATENCY_BUCKETS_MS, counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(bound, round(maximum, 4))
+        return round(maximum, 4)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class RuleEvaluator:
+    """Ленивое вычисление булевого правила над дорогими признаками.
+
+    Признаки вычисляются по одному в заданном порядке (дешевые и чаще всего решающие первыми),
+    пропускаются признаки, которые уже не могут изменить результат, и вычисление прекращается,
+    как только результат правила определен. Порядок и пропуски заранее собираются в дерево
+    решений по самой функции правила, поэтому решения всегда совпадают с полным вычислением"""
+
+    def __init__(self, features: List[Tuple[str, Callable]], rule: Callable[..., bool]):
+        """
+        Args:
+            features: Пары (имя, функция признака) в порядке вычисления; имена - аргументы rule
+            rule: Правило от всех признаков, возвращающее bool
+        """
+        self.names = [name for name, _ in features]
+        self.functions = [function for _, function in features]
+        self.rule = rule
+
+        self._outcomes = {}
+        self.tree = self._build_tree((None,) * len(features))
+
+        self.evaluations = [0] * len(features)
+        self.seconds = [0.0] * len(features)
+        self.decisions = 0
+
+    def evaluate(self, *args) -> bool:
+        """Вычисляет правило, передавая args в функции признаков"""
+        node = self.tree
+        evaluations = self.evaluations
+        seconds = self.seconds
+        functions = self.functions
+
+        while not isinstance(node, bool):
+            index, if_false, if_true = node
+            start_time = time.perf_counter()
+            value = functions[index](*args)
+            seconds[index] += time.perf_counter() - start_time
+            evaluations[index] += 1
+            node = if_true if value else if_false
+
+        self.decisions += 1
+        return node
+
+    def evaluate_batch(self, items: Sequence[Tuple]) -> array:
+        """Вычисляет правило для пачки объектов по столбцам признаков.
+
+        items - аргументы функций признаков для каждого объекта. Каждый признак вычисляется
+        за один проход по тем объектам, которым он еще нужен. Признаки в дереве идут по
+        возрастанию номера (пропущенный признак не может снова стать значимым), поэтому
+        одного прохода по признакам достаточно. Возвращает array('B') с решениями (0/1)"""
+        nodes = [self.tree] * len(items)
+
+        for index, function in enumerate(self.functions):
+            pending = [item for item, node in enumerate(nodes) if not isinstance(node, bool) and node[0] == index]
+            if not pending:
+                continue
+
+            start_time = time.perf_counter()
+            for item in pending:
+                node = nodes[item]
+                nodes[item] = node[2] if function(*items[item]) else node[1]
+            self.seconds[index] += time.perf_counter() - start_time
+            self.evaluations[index] += len(pending)
+
+        self.decisions += len(items)
+        return array('B', nodes)
+
+    def get_statistics(self) -> Dict[str, Dict]:
+        """Возвращает по каждому признаку число вычислений и затраченное время"""
+        return {
+            name: {'evaluations': evaluations, 'seconds': seconds}
+            for name, evaluations, seconds in zip(self.names, self.evaluations, self.seconds)
+        }
+
+    def _build_tree(self, state):
+        """Строит дерево решений: лист - результат, узел - (признак, ветка False, ветка True)"""
+        outcome = self._get_outcome(state)
+        if outcome is not None:
+            return outcome
+
+        for index, value in enumerate(state):
+            if value is None and self._is_relevant(state, index):
+                return (
+                    index,
+                    self._build_tree(self._assign(state, index, False)),
+                    self._build_tree(self._assign(state, index, True)),
+                )
+
+        # Сюда не попасть: если результат не определен, какой-то признак на него влияет
+        raise ValueError("правило не определяется признаками")
+
+    def _get_outcome(self, state) -> Optional[bool]:
+        """Результат правила, если он одинаков при любых значениях невычисленных признаков"""
+        if state not in self._outcomes:
+            if None not in state:
+                outcome = bool(self.rule(**dict(zip(self.names, state))))
+            else:
+                index = state.index(None)
+                if_false = self._get_outcome(self._assign(state, index, False))
+                if_true = self._get_outcome(self._assign(state, index, True))
+                outcome = if_false if if_false == if_true else None
+            self._outcomes[state] = outcome
+        return self._outcomes[state]
+
+    def _is_relevant(self, state, index) -> bool:
+        """Может ли значение признака index изменить результат при каком-то значении остальных"""
+        return self._differs(self._assign(state, index, False), self._assign(state, index, True))
+
+    def _differs(self, state_false, state_true) -> bool:
+        """Различаются ли результаты двух состояний хотя бы при одном доопределении"""
+        outcome_false = self._get_outcome(state_false)
+        outcome_true = self._get_outcome(state_true)
+        if outcome_false is not None and outcome_true is not None:
+            return outcome_false != outcome_true
+
+        index = state_false.index(None)
+        return (self._differs(self._assign(state_false, index, False), self._assign(state_true, index, False)) or
+                self._differs(self._assign(state_false, index, True), self._assign(state_true, index, True)))
+
+    @staticmethod
+    def _assign(state, index, value):
+        """Возвращает копию состояния с заданным значением признака"""
+        return state[:index] + (value,) + state[index + 1:]
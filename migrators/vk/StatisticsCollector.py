@@ -4,6 +4,8 @@
 import sqlite3
 import json
 
+from migrators.vk.MigrationStats import MigrationStats
+
 
 class StatisticsCollector:
     """Сборщик статистики по миграции"""
@@ -18,31 +20,19 @@ class StatisticsCollector:
             conn = sqlite3.connect(self.config.target_db_path)
             cursor = conn.cursor()
 
-            # Проверяем количество организаций
-            cursor.execute("SELECT COUNT(*) FROM orgs")
-            orgs_count = cursor.fetchone()[0]
-
-            # Проверяем количество постов
-            cursor.execute("SELECT COUNT(*) FROM posts")
-            posts_count = cursor.fetchone()[0]
-
-            # Статистика по городам в организациях
-            cursor.execute("SELECT COUNT(*) FROM orgs WHERE cities IS NOT NULL AND cities != '[]'")
-            orgs_with_cities = cursor.fetchone()[0]
-
-            # Статистика по городам и адресам в постах
-            cursor.execute("SELECT COUNT(*) FROM posts WHERE cities IS NOT NULL AND cities != '[]'")
-            posts_with_cities = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM posts WHERE address IS NOT NULL AND address != '[]'")
-            posts_with_addresses = cursor.fetchone()[0]
+            # Счетчики ведутся во время миграции: читаем несколько строк migration_stats
+            if self.config.stats_full_recompute:
+                self._verify_statistics(cursor)
+                conn.commit()
+            totals = MigrationStats.load_totals(cursor)
 
             self.logger.log(f"\n=== ИТОГОВАЯ СТАТИСТИКА ===")
-            self.logger.log(f"Всего организаций в базе: {orgs_count}")
-            self.logger.log(f"  - с найденными городами: {orgs_with_cities}")
-            self.logger.log(f"Всего постов в базе: {posts_count}")
-            self.logger.log(f"  - с найденными городами: {posts_with_cities}")
-            self.logger.log(f"  - с найденными адресами: {posts_with_addresses}")
+            self.logger.log(f"Всего организаций в базе: {totals[MigrationStats.ORGS]}")
+            self.logger.log(f"  - с найденными городами: {totals[MigrationStats.ORGS_WITH_CITIES]}")
+            self.logger.log(f"Всего постов в базе: {totals[MigrationStats.POSTS]}")
+            self.logger.log(f"  - с найденными городами: {totals[MigrationStats.POSTS_WITH_CITIES]}")
+            self.logger.log(f"  - с найденными адресами: {totals[MigrationStats.POSTS_WITH_ADDRESSES]}")
+            self.logger.log(f"  - с признаками мероприятия: {totals[MigrationStats.POSTS_EVENTS]}")
 
             # Показываем примеры
             self._show_organization_examples(cursor)
@@ -53,7 +43,7 @@ class StatisticsCollector:
             self._show_top_cities_in_posts(cursor)
 
             conn.close()
-            return orgs_count, posts_count
+            return totals[MigrationStats.ORGS], totals[MigrationStats.POSTS]
 
         except Exception as e:
             self.logger.log(f"Ошибка при проверке результатов: {str(e)}")
@@ -75,8 +65,8 @@ class StatisticsCollector:
                             cities_info = f" [Города: {', '.join(cities)}]"
                     except:
                         pass
-                self.logger.log(f"  ID: {org[0]}, URL: {org[1]}{cities_info}", False)
-                self.logger.log(f"    Описание: {descr_preview}", False)
+                self.logger.log(f"  ID: {org[0]}, URL: {org[1]}{cities_info}", print_message=False)
+                self.logger.log(f"    Описание: {descr_preview}", print_message=False)
 
     def _show_post_examples(self, cursor):
         """Показывает примеры постов"""
@@ -110,52 +100,95 @@ class StatisticsCollector:
                     except:
                         pass
 
-                self.logger.log(f"  ID: {post[0]}, Post ID: {post[1]}, Организация: {post[5]}", False)
-                self.logger.log(f"    Контент: {content}", False)
+                self.logger.log(f"  ID: {post[0]}, Post ID: {post[1]}, Организация: {post[5]}", print_message=False)
+                self.logger.log(f"    Контент: {content}", print_message=False)
                 if cities_info:
-                    self.logger.log(f"    {cities_info}", False)
+                    self.logger.log(f"    {cities_info}", print_message=False)
                 if addresses_info:
-                    self.logger.log(f"    {addresses_info}", False)
+                    self.logger.log(f"    {addresses_info}", print_message=False)
 
     def _show_top_cities_in_orgs(self, cursor):
         """Показывает топ городов в организациях"""
-        cursor.execute("SELECT cities FROM orgs WHERE cities IS NOT NULL AND cities != '[]'")
-        org_cities_data = cursor.fetchall()
-
-        city_count = {}
-        for row in org_cities_data:
-            try:
-                cities = json.loads(row[0])
-                for city in cities:
-                    city_count[city] = city_count.get(city, 0) + 1
-            except:
-                continue
-
-        if city_count:
-            self.logger.log(f"\nТоп-{self.config.log_limit_top_cities} городов в организациях:")
-            sorted_cities = sorted(city_count.items(), key=lambda x: x[1], reverse=True)[
-                            :self.config.log_limit_top_cities]
-            for city, count in sorted_cities:
-                self.logger.log(f"  {city}: {count} упоминаний", False)
+        self._show_top_cities(MigrationStats.load_top_cities(cursor, MigrationStats.ORG_CITY,
+                                                             self.config.log_limit_top_cities), "организациях")
 
     def _show_top_cities_in_posts(self, cursor):
         """Показывает топ городов в постах"""
-        cursor.execute("SELECT cities FROM posts WHERE cities IS NOT NULL AND cities != '[]'")
-        post_cities_data = cursor.fetchall()
-
-        post_city_count = {}
-        for row in post_cities_data:
-            try:
-                cities = json.loads(row[0])
-                for city in cities:
-                    post_city_count[city] = post_city_count.get(city, 0) + 1
-            except:
-                continue
-
-        if post_city_count:
-            self.logger.log(f"\nТоп-{self.config.log_limit_top_cities} городов в постах:")
-            sorted_post_cities = sorted(post_city_count.items(), key=lambda x: x[1], reverse=True)[
-                                 :self.config.log_limit_top_cities]
-            for city, count in sorted_post_cities:
-                self.logger.log(f"  {city}: {count} упоминаний", False)
+        self._show_top_cities(MigrationStats.load_top_cities(cursor, MigrationStats.POST_CITY,
+                                                             self.config.log_limit_top_cities), "постах")
+
+    def _show_top_cities(self, top_cities, title):
+        """Показывает топ городов"""
+        if top_cities:
+            self.logger.log(f"\nТоп-{self.config.log_limit_top_cities} городов в {title}:")
+            for city, count in top_cities:
+                self.logger.log(f"  {city}: {count} упоминаний", print_message=False)
+
+    def _verify_statistics(self, cursor):
+        """Пересчитывает статистику по всей базе, сверяет с migration_stats и сохраняет пересчитанную"""
+        totals = MigrationStats.load_totals(cursor)
+        top_cities = {metric: MigrationStats.load_top_cities(cursor, metric, self.config.log_limit_top_cities)
+                      for metric in (MigrationStats.ORG_CITY, MigrationStats.POST_CITY)}
+
+        # Все счетчики одним запросом. Условия совпадают с условиями частичных индексов
+        # (см. DatabaseManager.SECONDARY_INDEXES), поэтому считаются по индексам, а не по строкам таблиц
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM orgs),
+                   (SELECT COUNT(*) FROM orgs WHERE cities IS NOT NULL AND cities != '[]'),
+                   (SELECT COUNT(*) FROM posts),
+                   (SELECT COUNT(*) FROM posts WHERE cities IS NOT NULL AND cities != '[]'),
+                   (SELECT COUNT(*) FROM posts WHERE address IS NOT NULL AND address != '[]'),
+                   (SELECT COUNT(*) FROM posts WHERE maybe_event)
+        """)
+        scanned = dict(zip(MigrationStats.TOTALS, cursor.fetchone()))
+        scanned_top_cities = {
+            MigrationStats.ORG_CITY: self._query_top_cities(cursor, "orgs", "org_cities",
+                                                            scanned[MigrationStats.ORGS_WITH_CITIES]),
+            MigrationStats.POST_CITY: self._query_top_cities(cursor, "posts", "post_cities",
+                                                             scanned[MigrationStats.POSTS_WITH_CITIES]),
+        }
+
+        mismatches = [f"{metric}: {totals[metric]} вместо {scanned[metric]}"
+                      for metric in MigrationStats.TOTALS if totals[metric] != scanned[metric]]
+        mismatches += [f"топ {metric}" for metric in scanned_top_cities
+                       if top_cities[metric] != scanned_top_cities[metric]]
+        if mismatches:
+            self.logger.log(f"Статистика migration_stats расходится с пересчетом: {'; '.join(mismatches)}")
+        else:
+            self.logger.log("Статистика migration_stats совпадает с пересчетом по всей базе")
+
+        MigrationStats.recompute(cursor)
+
+    def _query_top_cities(self, cursor, table, links_table, with_cities_count):
+        """Считает топ городов одним запросом с GROUP BY.
+
+        Обычно считается по таблице связей (по индексу (city_id, ...)); если связей нет,
+        а города в JSON есть - разбором JSON в SQL через json_each"""
+        if self._has_links(cursor, links_table) or not with_cities_count:
+            cursor.execute(f"""
+                SELECT c.name, l.mentions
+                FROM (SELECT city_id, COUNT(*) AS mentions FROM {links_table} GROUP BY city_id) l
+                JOIN cities c ON c.id = l.city_id
+                ORDER BY l.mentions DESC, c.name
+                LIMIT ?
+            """, (self.config.log_limit_top_cities,))
+        else:
+            cursor.execute(f"""
+                SELECT j.value, COUNT(*) AS mentions
+                FROM {table} t, json_each(t.cities) j
+                WHERE t.cities IS NOT NULL AND t.cities != '[]' AND json_valid(t.cities)
+                GROUP BY j.value
+                ORDER BY mentions DESC, j.value
+                LIMIT ?
+            """, (self.config.log_limit_top_cities,))
+        return cursor.fetchall()
+
+    @staticmethod
+    def _has_links(cursor, links_table):
+        """Проверяет, что таблица связей с городами существует и не пуста"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (links_table,))
+        if cursor.fetchone() is None:
+            return False
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {links_table})")
+        return bool(cursor.fetchone()[0])
 
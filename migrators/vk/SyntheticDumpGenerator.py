@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Генератор синтетических VK дампов для бенчмарков
+
+Создает SQLite файл со схемой парсера VK (vk_groups, vk_posts) заданного размера:
+группы с описанием в формате парсера, посты разной длины с городами, адресами,
+приглашениями на мероприятия и рекламой, повторы уже записанных постов (как при
+повторном обходе группы) и посты без группы. Результат детерминирован для seed.
+
+Запуск: python -m migrators.vk.SyntheticDumpGenerator путь.db [--groups N] [--posts N]
+        [--duplicates доля] [--length символов] [--seed N]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+# Добавляем путь к модулям
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from migrators.cities import get_all_cities
+
+
+class SyntheticDumpGenerator:
+    """Генератор VK дампа с настраиваемым размером, долей повторов и длиной постов"""
+
+    # Сколько строк вставлять за один executemany
+    BATCH_SIZE = 5000
+
+    GROUP_KINDS = ("Кафе", "Театр", "Библиотека", "Клуб", "Музей", "Новости", "Администрация", "Магазин",
+                   "Фитнес-центр", "Дом культуры")
+    STREETS = ("ул. Ленина", "ул. Гагарина", "Большая Московская ул.", "пр-т Мира", "ул. Садовая",
+               "ул. Пушкина", "Октябрьский пр-т", "ул. Горького")
+    EVENTS = ("мастер-класс", "концерт", "лекцию", "спектакль", "выставку", "турнир", "экскурсию",
+              "кинопоказ", "встречу с автором", "квиз")
+    AUDIENCES = ("всех желающих", "детей и родителей", "жителей города", "студентов", "любителей музыки")
+    PRODUCTS = ("обувь", "мебель", "окна", "ремонт квартир", "доставку цветов", "пиццу")
+    FILLER = (
+        "Спасибо всем, кто был с нами на этой неделе.",
+        "Пишите вопросы в комментариях.",
+        "Следите за новостями сообщества.",
+        "Новые фотографии уже в альбоме.",
+        "Делитесь впечатлениями и отмечайте друзей.",
+        "Погода обещает быть отличной, берите с собой хорошее настроение.",
+        "Благодарим партнеров за поддержку проекта.",
+        "Напоминаем о правилах сообщества.",
+        "Спасибо, что читаете нас.",
+        "Оставляйте отзывы и предложения в сообщениях сообщества.",
+    )
+
+    def __init__(self, groups=100, posts=5000, duplicate_ratio=0.1, post_length=330, orphan_ratio=0.01,
+                 event_ratio=0.2, seed=0):
+        self.groups = groups
+        self.posts = posts
+        self.duplicate_ratio = duplicate_ratio  # Доля строк, повторяющих уже записанный пост группы
+        self.post_length = post_length  # Средняя длина текста поста, символов
+        self.orphan_ratio = orphan_ratio  # Доля постов, для которых нет группы
+        self.event_ratio = event_ratio  # Доля приглашений на мероприятия
+        self.seed = seed
+        self.cities = sorted(get_all_cities())
+
+    def generate(self, path):
+        """Создает дамп в path (существующий файл перезаписывается) и возвращает счетчики строк"""
+        if os.path.exists(path):
+            os.remove(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        rng = random.Random(self.seed)
+        conn = sqlite3.connect(path)
+        try:
+            self._create_tables(conn)
+
+            groups = [self._make_group(rng, number) for number in range(1, self.groups + 1)]
+            conn.executemany("""
+                INSERT INTO vk_groups (id, url, descr, last_checked_date, last_post_date, last_event_date)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, groups)
+
+            counters = {'groups': len(groups), 'posts': 0, 'duplicates': 0, 'orphans': 0}
+            written = []  # Уже записанные посты - источник повторов
+            batch = []
+            for _ in range(self.posts):
+                if written and rng.random() < self.duplicate_ratio:
+                    row = rng.choice(written)
+                    counters['duplicates'] += 1
+                else:
+                    row = self._make_post(rng, groups, counters)
+                    written.append(row)
+
+                batch.append(row)
+                counters['posts'] += 1
+                if len(batch) >= self.BATCH_SIZE:
+                    self._insert_posts(conn, batch)
+                    batch = []
+
+            if batch:
+                self._insert_posts(conn, batch)
+            conn.commit()
+            return counters
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _create_tables(conn):
+        """Создает таблицы в формате парсера VK"""
+        conn.execute("""
+            CREATE TABLE vk_groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT UNIQUE NOT NULL,
+                descr TEXT,
+                last_checked_date TEXT,
+                last_post_date TEXT,
+                last_event_date TEXT
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE vk_posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id INTEGER,
+                post_content TEXT,
+                post_date TEXT,
+                post_likes INTEGER,
+                post_comments INTEGER,
+                post_reposts INTEGER,
+                post_images TEXT,
+                vk_group_url TEXT,
+                post_id TEXT,
+                FOREIGN KEY(group_id) REFERENCES vk_groups(id)
+            )
+        """)
+
+    @staticmethod
+    def _insert_posts(conn, batch):
+        """Вставляет пачку постов"""
+        conn.executemany("""
+            INSERT INTO vk_posts (group_id, post_content, post_date, post_likes, post_comments, post_reposts,
+                                  post_images, vk_group_url, post_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, batch)
+
+    def _make_group(self, rng, number):
+        """Группа: url, описание в JSON формате парсера и даты"""
+        city = rng.choice(self.cities)
+        kind = rng.choice(self.GROUP_KINDS)
+        url = f"/synthetic_{self.seed}_{number}"
+        descr = {
+            "name": {"href": "", "value": f"{kind} \"{rng.choice(self.FILLER)[:20].strip()}\" (г. {city})"},
+            "status": {"href": "", "value": rng.choice(self.FILLER)},
+            "domain": {"href": "", "value": url.lstrip("/")},
+            "address": {"href": f"{url}?w=address-{number}", "value": f"{self._street(rng)}, {city}"},
+        }
+        checked = self._date(rng)
+        return (number, url, json.dumps(descr, ensure_ascii=False, indent=2), checked, self._date(rng), None)
+
+    def _make_post(self, rng, groups, counters):
+        """Новый пост случайной группы (или без группы) с текстом длиной около post_length"""
+        number, url = rng.choice(groups)[:2]
+        if rng.random() < self.orphan_ratio:
+            # Группы нет ни в vk_groups, ни в целевой базе
+            counters['orphans'] += 1
+            number, url = self.groups + 1 + rng.randrange(1000), f"/missing_{self.seed}_{rng.randrange(1000)}"
+
+        content = self._make_content(rng)
+        images = json.dumps([f"https://example.com/img/{rng.randrange(10 ** 9)}.jpg"
+                             for _ in range(rng.choice((0, 0, 1, 1, 2)))])
+        post_id = f"{number}_{counters['posts'] + 1}"
+        return (number, content, self._date(rng), rng.randrange(200), rng.randrange(20), rng.randrange(10),
+                images, url, post_id)
+
+    def _make_content(self, rng):
+        """Текст поста: приглашение, реклама или новость, дополненные нейтральными фразами"""
+        city = rng.choice(self.cities)
+        kind = rng.random()
+        if kind < self.event_ratio:
+            sentences = [
+                f"Приглашаем {rng.choice(self.AUDIENCES)} на {rng.choice(self.EVENTS)}!",
+                f"Когда: {rng.randrange(1, 29)}.{rng.randrange(1, 13):02d} в {rng.randrange(10, 22)}:00.",
+                f"Место: {self._street(rng)}, г. {city}.",
+                f"Стоимость: {rng.choice(('бесплатно', f'{rng.randrange(2, 20) * 100} руб.'))}",
+                f"Регистрация по телефону +7 ({rng.randrange(900, 1000)}) {rng.randrange(100, 1000)}-"
+                f"{rng.randrange(10, 100)}-{rng.randrange(10, 100)}.",
+            ]
+        elif kind < self.event_ratio + 0.2:
+            sentences = [
+                f"Скидки до {rng.randrange(10, 70)}% на {rng.choice(self.PRODUCTS)}!",
+                f"Доставка по городу {city} и области.",
+                f"Звоните: 8-{rng.randrange(900, 1000)}-{rng.randrange(100, 1000)}-{rng.randrange(1000, 10000)}",
+            ]
+        else:
+            sentences = [f"Новости {city}: {rng.choice(self.FILLER).lower()}"]
+
+        length = int(self.post_length * rng.uniform(0.3, 1.7))
+        text = " ".join(sentences)
+        while len(text) < length:
+            text += " " + rng.choice(self.FILLER)
+        return text
+
+    def _street(self, rng):
+        """Адрес: улица и номер дома"""
+        return f"{rng.choice(self.STREETS)}, д. {rng.randrange(1, 150)}"
+
+    @staticmethod
+    def _date(rng):
+        """Дата в формате парсера (ISO 8601 с микросекундами)"""
+        return (datetime(2025, 6, 1) - timedelta(seconds=rng.randrange(365 * 24 * 3600),
+                                                 microseconds=rng.randrange(10 ** 6))).isoformat()
+
+
+def main():
+    """Создает дамп по параметрам командной строки"""
+    parser = argparse.ArgumentParser(description="Генератор синтетических VK дампов")
+    parser.add_argument("path", help="путь к создаваемому .db файлу")
+    parser.add_argument("--groups", type=int, default=100, help="количество групп")
+    parser.add_argument("--posts", type=int, default=5000, help="количество строк vk_posts")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="доля повторов уже записанных постов")
+    parser.add_argument("--length", type=int, default=330, help="средняя длина поста, символов")
+    parser.add_argument("--seed", type=int, default=0, help="начальное значение генератора случайных чисел")
+    args = parser.parse_args()
+
+    generator = SyntheticDumpGenerator(args.groups, args.posts, args.duplicates, args.length, seed=args.seed)
+    counters = generator.generate(args.path)
+    print(f"Создан {args.path}: групп {counters['groups']}, постов {counters['posts']} "
+          f"(повторов {counters['duplicates']}, без группы {counters['orphans']})")
+
+
+if __name__ == "__main__":
+    main()
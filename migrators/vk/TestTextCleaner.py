@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Тестирование TextCleaner: сравнение с прежней цепочкой из пяти re.sub
+
+Запуск: python -m migrators.vk.TestTextCleaner [папка с дампами]
+"""
+
+import glob
+import os
+import re
+import sqlite3
+import sys
+
+# Добавляем путь к модулям
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from migrators.vk.TextCleaner import TextCleaner
+
+
+def legacy_clean_text(text):
+    """Прежняя очистка текста последовательными re.sub (эталон для сравнения)"""
+    clean_text = re.sub(r'<[^>]+>', ' ', text)
+    clean_text = re.sub(r'http[s]?://\S+', ' ', clean_text)
+    clean_text = re.sub(r'www\.\S+', ' ', clean_text)
+    clean_text = re.sub(r'\S+@\S+\.\S+', ' ', clean_text)
+    clean_text = re.sub(r'[\+]?[0-9\(\)\-\s]{10,}', ' ', clean_text)
+    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+    return clean_text
+
+
+def load_texts(dumps_dir):
+    """Загружает тексты постов и описаний групп из всех дампов папки"""
+    texts = []
+    for vk_db_path in sorted(glob.glob(os.path.join(dumps_dir, "*.db"))):
+        conn = sqlite3.connect(vk_db_path)
+        try:
+            rows = conn.execute("SELECT post_content FROM vk_posts").fetchall()
+            rows += conn.execute("SELECT COALESCE(url, '') || ' ' || COALESCE(descr, '') FROM vk_groups").fetchall()
+        except sqlite3.Error:
+            rows = []
+        finally:
+            conn.close()
+        texts.extend(text for (text,) in rows if text)
+    return texts
+
+
+def test_text_cleaner(dumps_dir):
+    """Проверяет, что TextCleaner дает тот же текст, что и прежняя очистка"""
+    cleaner = TextCleaner()
+
+    test_texts = [
+        "<p>Приглашаем в <b>Москву</b>!</p>",
+        "Подробности: https://vk.com/event123 и www.site.ru/page",
+        "Пишите на ivan.petrov@mail.ru или <a href=\"mailto:info@org.ru\">info@org.ru</a>",
+        "Телефон: +7 (999) 123-45-67, 8-800-555-35-35",
+        "Сайт<br>https://example.com<br>далее текст",
+        "<b>ivan@mail.ru</b>",
+        "\"https://vk.com/@club-rules\"",
+        "info@www.site.ru",
+        "Тел: +7 (999) 123-45-67, сайт www.x.ru",
+        "Строки\n\n\tс  разными   пробелами ",
+        "Дата 2024-01-01, время 19:00",
+        "Адрес: 123456, г. Москва, ул. Ленина, д. 5",
+        # Телефоны, разорванные тегом или ссылкой
+        "Тел. 8 (4922)<br>32-65-45 ул. Ленина, 5",
+        "8 800<b>555</b> 35 35",
+        "звоните 8922 https://x.ru 123-45-67 сейчас",
+        # Ссылки, склеенные с другими ссылками и email
+        "www.http://x.ru8008<b>800",
+        "<br>.info@-www.http://x.ru",
+        "5</b>www.http://x.ru",
+        "",
+    ]
+
+    print("=== ТЕСТИРОВАНИЕ TEXT CLEANER ===\n")
+
+    failures = 0
+    for text in test_texts:
+        expected = legacy_clean_text(text)
+        actual = cleaner.clean(text)
+        status = "OK" if expected == actual else "ОШИБКА"
+        if expected != actual:
+            failures += 1
+        print(f"{status}: {text!r} -> {actual!r}")
+        if expected != actual:
+            print(f"    ожидалось: {expected!r}")
+
+    texts = load_texts(dumps_dir)
+    differences = [text for text in texts if legacy_clean_text(text) != cleaner.clean(text)]
+    print(f"\nТекстов из дампов: {len(texts)}, расхождений: {len(differences)}")
+    for text in differences[:5]:
+        print(f"  {text[:100]!r}")
+
+    failures += len(differences)
+    print(f"\nИтого расхождений: {failures}")
+    return failures == 0
+
+
+if __name__ == "__main__":
+    dumps_dir = sys.argv[1] if len(sys.argv) > 1 else "./dumps/vk/"
+    sys.exit(0 if test_text_cleaner(dumps_dir) else 1)
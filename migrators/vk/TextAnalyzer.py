@@ -1,64 +1,56 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
 import re
 import json
+import uuid
+from collections import namedtuple
 
-from migrators.cities import get_all_cities, get_city_aliases, normalize_city_name
+from migrators.cities import get_all_cities, get_city_aliases, get_city_index
+from migrators.vk.CityMatcher import CityMatcher
+from migrators.vk.MorphCityNormalizer import MorphCityNormalizer
+from migrators.vk.TextCleaner import TextCleaner
+
+# Статистика кэша лемм (поля как у functools.lru_cache().cache_info())
+LemmaCacheInfo = namedtuple('LemmaCacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
 
 
 class TextAnalyzer:
     """Анализатор текста для извлечения городов и адресов"""
 
-    def __init__(self, logger):
+    # Версия логики анализа: увеличивать при изменении поиска городов и адресов
+    # (словарь городов и паттерны адресов учитываются в get_version сами)
+    ANALYSIS_VERSION = 1
+
+    def __init__(self, logger, morphology=False, lemma_cache_size=100000):
         self.logger = logger
         self.cities_list = get_all_cities()
         self.city_aliases = get_city_aliases()
 
-        # Создаем паттерны для поиска городов
+        # Создаем дерево для поиска городов
         self._prepare_city_patterns()
 
+        # Морфологический поиск городов в падежных формах (pymorphy2 загружается при первом тексте)
+        self.morph_normalizer = MorphCityNormalizer(logger, lemma_cache_size) if morphology else None
+
         # Паттерны для поиска адресов
         self._prepare_address_patterns()
 
+        # Очистка текста от HTML, ссылок, email и телефонов
+        self.text_cleaner = TextCleaner()
+
+        # Статистика кэша лемм процессов анализа: ключ процесса -> последняя (накопительная) статистика
+        self.process_key = uuid.uuid4().hex
+        self.process_lemma_caches = {}
+
         self.logger.log(f"TextAnalyzer инициализирован с {len(self.cities_list)} городами")
 
     def _prepare_city_patterns(self):
-        """Подготавливает регулярные выражения для поиска городов"""
+        """Подготавливает префиксное дерево для поиска городов"""
         # Объединяем основные города и альтернативные названия
         all_city_names = set(self.cities_list + list(self.city_aliases.keys()))
-
-        # Сортируем по длине (длинные названия первыми, чтобы избежать частичных совпадений)
-        sorted_cities = sorted(all_city_names, key=len, reverse=True)
-
-        # Экранируем специальные символы в названиях городов
-        escaped_cities = [re.escape(city) for city in sorted_cities]
-
-        # Создаем паттерн для поиска городов
-        cities_pattern = '|'.join(escaped_cities)
-
-        # Паттерны для различных контекстов упоминания городов
-        # Паттерны для различных контекстов упоминания городов
-        self.city_patterns = [
-            # Прямое упоминание города
-            rf'\b(?:г\.?\s*)?({cities_pattern})\b',
-            # Город с предлогами
-            rf'\b(?:в|из|до|от|по|на|под|над|при|около|возле|рядом\s+с)\s+(?:г\.?\s*)?({cities_pattern})\b',
-            # Город в контексте адреса
-            rf'\b(?:город|гор\.)\s+({cities_pattern})\b',
-            # Город с областью/краем/республикой
-            rf'\b({cities_pattern})\s*(?:обл\.|область|край|республика|респ\.)',
-            # В формате "Москва, улица..."
-            rf'\b({cities_pattern})\s*,',
-            # Город в скобках или кавычках
-            rf'["\(]({cities_pattern})[")\]]'
-        ]
-
-        # Компилируем паттерны для лучшей производительности
-        self.compiled_city_patterns = [
-            re.compile(pattern, re.IGNORECASE | re.UNICODE)
-            for pattern in self.city_patterns
-        ]
+        self.city_matcher = CityMatcher(all_city_names)
 
     def _prepare_address_patterns(self):
         """Подготавливает регулярные выражения для поиска адресов"""
@@ -98,66 +90,34 @@ class TextAnalyzer:
         try:
             # Очищаем текст от HTML тегов и лишних символов
             clean_text = self._clean_text(text)
-
-            if not clean_text or len(clean_text) < 3:
-                return [], []
-
-            # Извлекаем города
-            cities = self._extract_cities(clean_text)
-
-            # Извлекаем адреса
-            addresses = self._extract_addresses(clean_text)
-
-            return cities, addresses
+            return self._analyze_clean_text(clean_text)
 
         except Exception as e:
-            self.logger.log(f"Ошибка при анализе текста: {str(e)}", False)
+            self.logger.log(f"Ошибка при анализе текста: {str(e)}", print_message=False)
             return [], []
 
-    def _clean_text(self, text):
-        """Очищает текст от HTML тегов и лишних символов"""
-        # Удаляем HTML теги
-        clean_text = re.sub(r'<[^>]+>', ' ', text)
-
-        # Удаляем URL
-        clean_text = re.sub(r'http[s]?://\S+', ' ', clean_text)
-        clean_text = re.sub(r'www\.\S+', ' ', clean_text)
+    def _analyze_clean_text(self, clean_text):
+        """Извлекает города и адреса из уже очищенного текста"""
+        if not clean_text or len(clean_text) < 3:
+            return [], []
 
-        # Удаляем email
-        clean_text = re.sub(r'\S+@\S+\.\S+', ' ', clean_text)
+        # Извлекаем города
+        cities = self._extract_cities(clean_text)
 
-        # Удаляем телефоны
-        clean_text = re.sub(r'[\+]?[0-9\(\)\-\s]{10,}', ' ', clean_text)
+        # Извлекаем адреса
+        addresses = self._extract_addresses(clean_text)
 
-        # Нормализуем пробелы
-        clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+        return cities, addresses
 
-        return clean_text
+    def _clean_text(self, text):
+        """Очищает текст от HTML тегов и лишних символов"""
+        return self.text_cleaner.clean(text)
 
     def _extract_cities(self, text):
         """Извлекает города из текста"""
-        found_cities = set()
-
-        # Применяем все паттерны для поиска городов
-        for pattern in self.compiled_city_patterns:
-            matches = pattern.finditer(text)
-            for match in matches:
-                # Получаем найденный город из любой группы захвата
-                for group in match.groups():
-                    if group:
-                        city = group.strip()
-                        # Нормализуем название города
-                        normalized_city = normalize_city_name(city)
-                        if normalized_city:
-                            found_cities.add(normalized_city)
-
-        # Дополнительный поиск по точным совпадениям (для коротких названий)
-        words = re.findall(r'\b[А-Яа-яёЁ\-]+\b', text)
-        for word in words:
-            normalized_city = normalize_city_name(word)
-            if normalized_city and len(word) >= 3:  # Минимум 3 символа для города
-                found_cities.add(normalized_city)
-
+        found_cities = self.city_matcher.extract_cities(text)
+        if self.morph_normalizer is not None:
+            found_cities |= self.morph_normalizer.extract_cities(text)
         return list(found_cities)
 
     def _extract_addresses(self, text):
@@ -203,8 +163,9 @@ class TextAnalyzer:
                 }
             }
 
+        # Текст очищается один раз и для анализа, и для статистики
         clean_text = self._clean_text(text)
-        cities, addresses = self.extract_locations_and_addresses(text)
+        cities, addresses = self._analyze_clean_text(clean_text)
 
         return {
             'cities': cities,
@@ -214,7 +175,7 @@ class TextAnalyzer:
                 'cleaned_text_length': len(clean_text),
                 'cities_found': len(cities),
                 'addresses_found': len(addresses),
-                'patterns_used': len(self.compiled_city_patterns) + len(self.compiled_address_patterns)
+                'patterns_used': 1 + len(self.compiled_address_patterns)
             }
         }
 
@@ -223,7 +184,51 @@ class TextAnalyzer:
         return {
             'total_cities_in_database': len(self.cities_list),
             'total_aliases': len(self.city_aliases),
-            'city_patterns_count': len(self.compiled_city_patterns),
-            'address_patterns_count': len(self.compiled_address_patterns)
+            'city_patterns_count': 1,
+            'city_matcher_names': self.city_matcher.names_count,
+            'address_patterns_count': len(self.compiled_address_patterns),
+            'morphology': self.morph_normalizer is not None and self.morph_normalizer.available
         }
 
+    def get_version(self):
+        """Версия результатов анализа для кэша: логика, словарь городов, паттерны адресов и морфология"""
+        digest = hashlib.blake2b(digest_size=8)
+        for name, city in sorted(get_city_index().items()):
+            digest.update(f"{name}\0{city}\0".encode('utf-8'))
+        for pattern in self.address_patterns:
+            digest.update(f"{pattern}\0".encode('utf-8'))
+
+        morphology = self.morph_normalizer is not None and self.morph_normalizer.is_available()
+        return f"t{self.ANALYSIS_VERSION}{'m' if morphology else ''}.{digest.hexdigest()}"
+
+    def get_lemma_cache_info(self):
+        """Возвращает суммарную статистику кэша лемм этого процесса и процессов анализа
+        (см. add_lemma_cache_info) или None, если морфология не использовалась"""
+        caches = list(self.process_lemma_caches.values())
+        own_cache = self._get_own_lemma_cache_info()
+        if own_cache is not None:
+            caches.append(own_cache)
+        if not caches:
+            return None
+        return LemmaCacheInfo(*(sum(values) for values in zip(*caches)))
+
+    def get_lemma_cache_raw(self):
+        """Статистика кэша лемм этого процесса для передачи в основной: (ключ процесса, счетчики) или None"""
+        cache_info = self._get_own_lemma_cache_info()
+        return None if cache_info is None else (self.process_key, tuple(cache_info))
+
+    def add_lemma_cache_info(self, raw):
+        """Учитывает статистику кэша лемм другого процесса (см. get_lemma_cache_raw).
+
+        Счетчики кэша накопительные, поэтому от каждого процесса хранится последняя статистика"""
+        if raw is None:
+            return
+        process_key, cache_info = raw
+        self.process_lemma_caches[process_key] = LemmaCacheInfo(*cache_info)
+
+    def _get_own_lemma_cache_info(self):
+        """Статистика кэша лемм этого процесса или None, если морфология не используется"""
+        if self.morph_normalizer is None or self.morph_normalizer.morph is None:
+            return None
+        return LemmaCacheInfo(*self.morph_normalizer.get_cache_info())
+
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
+import json
 import os
 
+from migrators.vk.AnalysisCache import AnalysisCache, get_analysis_version
 from migrators.vk.DataMigrator import DataMigrator
 from migrators.vk.DatabaseManager import DatabaseManager
+from migrators.vk.EnrichmentPool import EnrichmentPool
 from migrators.vk.EventDetector import EventDetector
+from migrators.vk.MigrationState import Checkpointer, MigrationState
+from migrators.vk.ParallelIngestor import ParallelIngestor
+from migrators.vk.PipelineMetrics import PipelineMetrics
+from migrators.vk.ResourceUsage import get_peak_rss_mb
 
 from migrators.vk.StatisticsCollector import StatisticsCollector
 from migrators.vk.TextAnalyzer import TextAnalyzer
@@ -17,16 +23,21 @@ from migrators.vk.VKMigratorLogger import VKMigratorLogger
 class VKDataMigrator:
     """Главный класс для миграции данных VK"""
 
-    def __init__(self, target_db_path="./db/db.db", vk_dumps_dir="./dumps/vk/"):
-        self.config = VKMigratorConfig(target_db_path, vk_dumps_dir)
-        self.logger = VKMigratorLogger()
-        self.text_analyzer = TextAnalyzer(self.logger)
-        self.db_manager = DatabaseManager(self.config, self.logger)
-        self.data_migrator = DataMigrator(self.config, self.logger, self.text_analyzer)
+    def __init__(self, target_db_path="./db/db.db", vk_dumps_dir="./dumps/vk/", **config_options):
+        self.config = VKMigratorConfig(target_db_path, vk_dumps_dir, **config_options)
+        self.logger = VKMigratorLogger(memory_limit=self.config.log_memory_limit,
+                                       console_rate=self.config.log_console_rate,
+                                       console_burst=self.config.log_console_burst)
+        self.metrics = PipelineMetrics(self.config.pipeline_metrics)
+        self.text_analyzer = TextAnalyzer(self.logger, self.config.morphology, self.config.lemma_cache_size)
+        self.event_detector = EventDetector(self.logger)
+        self.db_manager = DatabaseManager(self.config, self.logger, self.metrics)
+        self.data_migrator = DataMigrator(self.config, self.logger, self.text_analyzer, self.metrics)
         self.statistics = StatisticsCollector(self.config, self.logger)
+        self.migration_state = MigrationState(self.config, self.logger)
 
-    def migrate_single_db(self, vk_db_path):
-        """Мигрирует данные из одного VK .db файла"""
+    def migrate_single_db(self, vk_db_path, plan):
+        """Мигрирует данные из одного VK .db файла по его плану (см. MigrationState.plan)"""
         source_file = os.path.basename(vk_db_path)
         self.logger.log(f"\n--- Обработка файла: {source_file} ---")
 
@@ -35,8 +46,13 @@ class VKDataMigrator:
             file_size = os.path.getsize(vk_db_path)
             self.logger.log(f"Размер файла: {file_size / 1024 / 1024:.2f} MB")
 
+            # Неизменившийся с прошлой миграции дамп не читаем, у дополненного читаем только новые строки
+            self.migration_state.log_plan(plan, source_file)
+            if plan.mode == 'unchanged':
+                return 0, 0
+
             # Подключаемся к VK базе
-            vk_conn = sqlite3.connect(vk_db_path)
+            vk_conn = self.db_manager.connect_vk_db(vk_db_path)
             vk_cursor = vk_conn.cursor()
 
             # Проверяем структуру VK базы
@@ -45,19 +61,63 @@ class VKDataMigrator:
                 return 0, 0
 
             # Подключаемся к целевой базе
-            target_conn = sqlite3.connect(self.config.target_db_path)
+            target_conn = self.db_manager.connect_target()
             target_cursor = target_conn.cursor()
 
+            # Для SQL-движка подключаем VK базу к целевой до начала записи
+            attached = self.config.posts_engine == "attach"
+            if attached:
+                self.db_manager.attach_vk_db(target_conn, vk_db_path)
+
+            failures = self.data_migrator.failures
+
             # Мигрируем группы в организации
-            orgs_migrated = self.data_migrator.migrate_groups_to_orgs(vk_cursor, target_cursor, source_file)
+            orgs_migrated = self.data_migrator.migrate_groups_to_orgs(vk_cursor, target_cursor, source_file,
+                                                                      plan.group_rowid)
+
+            # Организации фиксируются сразу, дальше транзакция фиксируется периодически
+            # с контрольной точкой, чтобы после сбоя продолжить с нее, а не с начала файла
+            checkpointer = None
+            if self.data_migrator.failures == failures and plan.max_group_rowid is not None:
+                checkpointer = Checkpointer(self.config, source_file, plan)
+                checkpointer.commit(target_cursor)
+                self.data_migrator.checkpointer = checkpointer
+            else:
+                target_conn.commit()
 
             # Мигрируем посты
-            event_detector = EventDetector(self.logger)
+            posts_failures = self.data_migrator.failures
             target_cursor = target_conn.cursor()
-            posts_migrated = self.data_migrator.migrate_posts(vk_cursor, target_cursor, source_file, event_detector)
-
-            # Сохраняем изменения
-            target_conn.commit()
+            try:
+                if attached:
+                    posts_migrated = self.data_migrator.migrate_posts_attached(target_cursor, source_file,
+                                                                               self.event_detector,
+                                                                               start_rowid=plan.post_rowid)
+                else:
+                    posts_migrated = self.data_migrator.migrate_posts(vk_cursor, target_cursor, source_file,
+                                                                      self.event_detector, plan.post_rowid)
+            finally:
+                self.data_migrator.checkpointer = None
+                if checkpointer is not None:
+                    self.migration_state.checkpoint_commits += checkpointer.commits
+
+            if self.data_migrator.failures == failures:
+                # Отметки сохраняются вместе с данными и только если файл обработан без ошибок
+                with self.metrics.stage("commit"):
+                    self.migration_state.save(target_cursor, source_file, plan, self.data_migrator.orphan_rowids)
+                    target_conn.commit()
+            elif checkpointer is not None:
+                # Незафиксированная часть отменяется: следующий запуск продолжит с контрольной точки
+                target_conn.rollback()
+                self.logger.log(f"Изменения {source_file} после последней контрольной точки отменены")
+            elif self.data_migrator.failures != posts_failures:
+                # Без контрольных точек посты файла отменяются целиком: организации уже зафиксированы
+                target_conn.rollback()
+                self.logger.log(f"Посты {source_file} не сохранены из-за ошибки")
+            else:
+                target_conn.commit()
+            if attached:
+                self.db_manager.detach_vk_db(target_conn)
 
             # Закрываем соединения
             vk_conn.close()
@@ -73,31 +133,92 @@ class VKDataMigrator:
 
     def run_migration(self):
         """Запускает полную миграцию"""
+        # Подробный лог пишется в файл по ходу миграции и в конце попадает в отчет
+        self.logger.start_detail_log(self.config.report_path)
         self.logger.log("=== НАЧАЛО МИГРАЦИИ VK ДАННЫХ ===")
 
         # Создаем целевую базу данных
-        self.db_manager.create_target_database()
+        with self.metrics.stage("create_target"):
+            try:
+                self.db_manager.create_target_database()
+            except RuntimeError as e:
+                # Например, дубли постов в старой базе: их список сохраняется в отчете
+                self.logger.log(f"Ошибка при подготовке целевой базы: {str(e)}")
+                self.logger.save_report(self.config.report_path, 0, 0, 0, 0, 0)
+                raise
 
         # Получаем список VK файлов
         vk_files = self.db_manager.get_vk_db_files()
 
         if not vk_files:
             self.logger.log("Не найдено файлов VK базы данных для миграции")
+            # Отчет без дампов не сохраняется: временный файл подробного лога больше не нужен
+            self.logger.close_detail_log()
             return
 
         total_orgs_migrated = 0
         total_posts_migrated = 0
         files_processed = 0
 
-        # Обрабатываем каждый файл
-        for vk_file in vk_files:
-            orgs_migrated, posts_migrated = self.migrate_single_db(vk_file)
-            total_orgs_migrated += orgs_migrated
-            total_posts_migrated += posts_migrated
-            files_processed += 1
+        # Кэш результатов анализа; в параллельном режиме его открывают и процессы чтения
+        self.data_migrator.analysis_cache = AnalysisCache.open(
+            self.config, self.logger, get_analysis_version(self.text_analyzer, self.event_detector))
+
+        # Планы нужны до загрузки: от ее объема зависит, удалять ли на это время вторичные индексы
+        with self.metrics.stage("plan"):
+            plans = [self.migration_state.plan(vk_file) for vk_file in vk_files]
+        self.db_manager.begin_bulk_load(plans)
+
+        try:
+            if self.config.parallel_dumps > 1 and len(vk_files) > 1:
+                # Несколько дампов читаются и анализируются одновременно, запись - по очереди файлов
+                self.logger.add_report_info("Параллельно обрабатываемых дампов", self.config.parallel_dumps)
+                ingestor = ParallelIngestor(self.config, self.logger, self.db_manager, self.data_migrator,
+                                            self.migration_state)
+                total_orgs_migrated, total_posts_migrated, files_processed = ingestor.run(vk_files, plans)
+            else:
+                # Запускаем пул процессов для анализа текстов, если он включен
+                if self.config.workers > 1:
+                    self.data_migrator.enrichment_pool = EnrichmentPool(self.logger, self.config.workers,
+                                                                        self.config.morphology,
+                                                                        self.config.lemma_cache_size,
+                                                                        self.metrics, self.text_analyzer)
+                self.logger.add_report_info("Процессов анализа текстов", self.config.workers)
+
+                try:
+                    # Обрабатываем каждый файл
+                    for vk_file, plan in zip(vk_files, plans):
+                        orgs_migrated, posts_migrated = self.migrate_single_db(vk_file, plan)
+                        total_orgs_migrated += orgs_migrated
+                        total_posts_migrated += posts_migrated
+                        files_processed += 1
+                finally:
+                    if self.data_migrator.enrichment_pool is not None:
+                        self.data_migrator.enrichment_pool.close()
+                        self.data_migrator.enrichment_pool = None
+        finally:
+            if self.data_migrator.analysis_cache is not None:
+                self.data_migrator.analysis_cache.close()
+            self.db_manager.finish_bulk_load()
+
+        # Для надежного профиля переносим WAL в основной файл
+        self.db_manager.finish_target_database()
 
         # Проверяем результаты
-        final_orgs_count, final_posts_count = self.statistics.check_migration_results()
+        with self.metrics.stage("statistics"):
+            final_orgs_count, final_posts_count = self.statistics.check_migration_results()
+
+        self.logger.add_report_info("Профиль соединений SQLite", self.db_manager.get_profile_description())
+        self.logger.add_report_info("Фазы загрузки", self.db_manager.get_phase_timings_description())
+        self.logger.add_report_info("Инкрементальная миграция", self.migration_state.get_report_value())
+        self.logger.add_report_info("Промежуточных фиксаций", f"{self.migration_state.checkpoint_commits} "
+                                                             f"(каждые {self.config.commit_every_rows} строк "
+                                                             f"или {self.config.commit_every_seconds} сек)")
+        self._add_memory_report_info()
+        self._add_morphology_report_info()
+        self._add_event_report_info()
+        self._add_analysis_cache_report_info()
+        self._add_metrics_report(total_orgs_migrated, total_posts_migrated, files_processed)
 
         # Сохраняем отчет
         self.logger.save_report(
@@ -114,6 +235,99 @@ class VKDataMigrator:
         self.logger.log(f"Добавлено организаций: {total_orgs_migrated}")
         self.logger.log(f"Добавлено постов: {total_posts_migrated}")
 
+    def _add_memory_report_info(self):
+        """Добавляет в отчет параметры чтения дампов и пиковое потребление памяти"""
+        self.logger.add_report_info("Размер пачки чтения", f"{self.config.read_chunk_size} строк, "
+                                                           f"не более {self.config.read_chunk_max_mb} МБ")
+        peak_rss_mb = get_peak_rss_mb()
+        if peak_rss_mb is not None:
+            self.logger.add_report_info("Пиковое потребление памяти (RSS)", f"{peak_rss_mb:.1f} МБ")
+            self.logger.log(f"Пиковое потребление памяти (RSS): {peak_rss_mb:.1f} МБ")
+
+    def _add_metrics_report(self, total_orgs_migrated, total_posts_migrated, files_processed):
+        """Добавляет в отчет JSON раздел с метриками этапов и сохраняет их в metrics_path"""
+        if not self.metrics.enabled:
+            self.logger.add_report_info("Метрики этапов", "выключены")
+            return
+
+        metrics = {
+            'run': {
+                'files_processed': files_processed,
+                'orgs_migrated': total_orgs_migrated,
+                'posts_migrated': total_posts_migrated,
+                'posts_engine': self.config.posts_engine,
+                'connection_profile': self.config.connection_profile,
+                'workers': self.config.workers,
+                'parallel_dumps': self.config.parallel_dumps,
+                'peak_rss_mb': get_peak_rss_mb(),
+            },
+            **self.metrics.get_report(),
+        }
+        metrics_json = json.dumps(metrics, ensure_ascii=False, indent=2)
+        self.logger.add_report_section("МЕТРИКИ ЭТАПОВ (JSON)", metrics_json)
+
+        try:
+            with open(self.config.metrics_path, 'w', encoding='utf-8') as f:
+                f.write(metrics_json + "\n")
+            self.logger.add_report_info("Метрики этапов", self.config.metrics_path)
+        except OSError as e:
+            self.logger.log(f"Ошибка при сохранении метрик этапов: {str(e)}")
+
+        # Вложенные этапы не показываются: их время уже входит в родительские
+        self.logger.log("Самые долгие этапы: " + ", ".join(
+            f"{name} {wall:.2f} сек" for name, wall in self.metrics.slowest_stages(5)))
+
+    def _add_morphology_report_info(self):
+        """Добавляет в отчет состояние морфологического анализа и попадания в кэш лемм"""
+        if not self.config.morphology:
+            self.logger.add_report_info("Морфологический анализ городов", "выключен")
+            return
+
+        # Вместе со статистикой процессов пула анализа и процессов чтения дампов
+        cache_info = self.text_analyzer.get_lemma_cache_info()
+        if cache_info is None:
+            # Морфология не понадобилась ни одному процессу или pymorphy2 не загрузился
+            available = self.text_analyzer.get_statistics()['morphology']
+            self.logger.add_report_info("Морфологический анализ городов", "включен" if available else "недоступен")
+            return
+
+        requests = cache_info.hits + cache_info.misses
+        hit_rate = cache_info.hits / requests * 100 if requests else 0
+        self.logger.add_report_info("Морфологический анализ городов", "включен")
+        self.logger.add_report_info("Кэш лемм", f"попаданий {cache_info.hits} из {requests} ({hit_rate:.1f}%), "
+                                                f"словоформ {cache_info.currsize} из {cache_info.maxsize}")
+
+    def _add_event_report_info(self):
+        """Добавляет в отчет, сколько раз и за какое время вычислялся каждый признак приглашений"""
+        if not self.event_detector.rule_evaluator.decisions:
+            # Посты анализировались в других процессах
+            return
+
+        for feature, statistics in self.event_detector.get_feature_statistics().items():
+            self.logger.add_report_info(f"Признак {feature}",
+                                        f"{statistics['evaluations']} вычислений, {statistics['seconds']:.3f} сек")
+
+    def _add_analysis_cache_report_info(self):
+        """Добавляет в отчет попадания в кэш результатов анализа постов"""
+        analysis_cache = self.data_migrator.analysis_cache
+        if analysis_cache is None:
+            self.logger.add_report_info("Кэш результатов анализа", "выключен")
+            return
+
+        statistics = analysis_cache.get_statistics()
+        hits = statistics['memory_hits'] + statistics['disk_hits']
+        lookups = hits + statistics['misses']
+        hit_rate = hits / lookups * 100 if lookups else 0
+        self.logger.add_report_info("Кэш результатов анализа", analysis_cache.path)
+        self.logger.add_report_info("Попадания в кэш анализа",
+                                    f"{hits} из {lookups} ({hit_rate:.1f}%), "
+                                    f"промахов {statistics['misses']}; в памяти {statistics['memory_hits']}, "
+                                    f"в файле {statistics['disk_hits']}")
+        self.logger.add_report_info("Записи кэша анализа",
+                                    f"сохранено {statistics['stored']}, вытеснено {statistics['evicted']}, "
+                                    f"удалено устаревших версий {analysis_cache.removed_stale}")
+        self.logger.log(f"Кэш результатов анализа: попаданий {hits} из {lookups} ({hit_rate:.1f}%)")
+
 
 def main():
     """Основная функция"""
@@ -7,7 +7,7 @@ import os
 class VKMigratorConfig:
     """Конфигурация для VK мигратора"""
 
-    def __init__(self, target_db_path="./db/db.db", vk_dumps_dir="./dumps/vk/"):
+    def __init__(self, target_db_path="./db/db.db", vk_dumps_dir="./dumps/vk/", **options):
         self.target_db_path = target_db_path
         self.vk_dumps_dir = vk_dumps_dir
 
@@ -18,3 +18,79 @@ class VKMigratorConfig:
         # Настройки логирования
         self.log_limit_examples = 5  # Сколько примеров показывать в логах
         self.log_limit_top_cities = 10  # Сколько топ городов показывать
+        self.log_limit_duplicates = 100  # Сколько дублей постов перечислять при остановке миграции
+        self.log_memory_limit = 1000  # Сколько последних сообщений лога держать в памяти (полный лог - в отчете)
+        self.log_console_rate = 20  # Сколько сообщений в секунду выводить в консоль
+        self.log_console_burst = 100  # Сколько сообщений подряд можно вывести до ограничения
+        # Итоговая статистика берется из таблицы migration_stats, которая ведется во время миграции;
+        # True - пересчитать ее по всей базе и сверить (для проверки)
+        self.stats_full_recompute = False
+        # Метрики этапов конвейера (время, CPU, строк/сек, гистограмма задержки анализа поста):
+        # JSON раздел в отчете и отдельный файл metrics_path
+        self.pipeline_metrics = True
+        self.metrics_path = os.path.join(os.path.dirname(target_db_path), f"migration_metrics.vk.{db_name}.json")
+
+        # Настройки миграции организаций
+        self.orgs_bulk_mode = True  # Пакетная вставка организаций через executemany
+        self.orgs_batch_size = 1000  # Размер пакета для вставки организаций
+
+        # Настройки миграции постов
+        # "attach" - VK база подключается к целевой через ATTACH DATABASE, новые посты отбираются в SQL
+        # "python" - построчная проверка каждого поста запросами из Python
+        self.posts_engine = "attach"
+        # В старой базе без уникального индекса (org_id, post_id) могут быть дубли постов:
+        # True - удалить их, оставив первый экземпляр; False - остановить миграцию со списком дублей
+        self.dedupe_posts = False
+
+        # Профиль соединений SQLite (см. DatabaseManager.CONNECTION_PROFILES):
+        # "bulk" - быстрая пакетная загрузка (WAL, synchronous=NORMAL, большой кэш, mmap, временные данные в памяти)
+        # "safe" - fsync на каждый commit и контрольная точка WAL в конце миграции
+        self.connection_profile = "bulk"
+        # Дампы открываются только на чтение; mmap_size для них (0 - читать без mmap)
+        self.vk_dump_mmap_size = 1073741824  # 1 ГБ
+
+        # Отложенное построение вторичных индексов: на время загрузки они удаляются и строятся
+        # заново в конце (затем ANALYZE). Откладываются только при полной загрузке дампа или
+        # продолжении с контрольной точки и при дозагрузке не меньше defer_indexes_min_ratio
+        # от числа постов в базе: для небольшой дозагрузки дешевле их сохранить
+        self.defer_indexes = True
+        self.defer_indexes_min_ratio = 0.25
+
+        # Инкрементальная миграция: неизменившиеся дампы пропускаются, у дополненных читаются
+        # только новые строки (отметки хранятся в таблице migration_state целевой базы)
+        self.incremental = True
+
+        # Промежуточные фиксации при записи постов с контрольной точкой для продолжения после сбоя:
+        # каждые N прочитанных строк или T секунд (0 - без ограничения)
+        self.commit_every_rows = 10000
+        self.commit_every_seconds = 30
+
+        # Настройки потокового чтения дампов: пик памяти зависит от размера пачки, а не дампа
+        self.read_chunk_size = 1000  # Сколько строк читать из дампа за раз
+        self.read_chunk_max_mb = 16  # Предельный объем текста в одной пачке, МБ
+
+        # Морфологический поиск городов в падежных формах ("в Москве") через pymorphy2
+        self.morphology = False
+        self.lemma_cache_size = 100000  # Сколько словоформ хранить в LRU кэше лемм
+
+        # Кэш результатов анализа постов по хэшу текста: повторяющиеся тексты (репосты, повторная
+        # миграция) не анализируются заново. Хранится в SQLite файле и переживает перезапуски
+        self.analysis_cache = True
+        self.analysis_cache_path = os.path.join(os.path.dirname(target_db_path), f"analysis_cache.vk.{db_name}.db")
+        self.analysis_cache_memory_size = 50000  # Сколько результатов держать в памяти (LRU)
+        self.analysis_cache_max_rows = 1000000  # Предельное число записей в файле кэша
+
+        # Количество процессов для анализа текстов постов (1 - анализ в основном процессе)
+        self.workers = 1
+
+        # Параллельная обработка дампов: сколько файлов читать и анализировать одновременно
+        # (1 - последовательно). Запись всегда идет в одном процессе по очереди файлов
+        self.parallel_dumps = 1
+        self.parallel_queue_chunks = 4  # Сколько прочитанных пачек может ждать записи на каждый файл
+        self.parallel_read_timeout = 60  # Сколько секунд ждать блокировки целевой базы, сек
+
+        # Переопределяем настройки, переданные явно (например, из командной строки)
+        for name, value in options.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Неизвестная настройка мигратора: {name}")
+            setattr(self, name, value)
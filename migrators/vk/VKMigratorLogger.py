@@ -1,29 +1,98 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import shutil
+import time
+from collections import deque
 from datetime import datetime
 
 
 class VKMigratorLogger:
-    """Логгер для VK мигратора"""
+    """Логгер для VK мигратора.
 
-    def __init__(self):
-        self.log_messages = []
+    Сообщения хранятся необработанными (время, текст, аргументы) и форматируются только при записи.
+    После start_detail_log подробный лог пачками пишется во временный файл рядом с отчетом, а
+    save_report дописывает его в отчет, поэтому память не растет с длиной запуска: в ней остаются
+    только последние memory_limit сообщений. Вывод в консоль ограничен: не больше console_burst
+    сообщений подряд и console_rate в секунду, остальные попадают только в отчет. Сообщения
+    об ошибках (начинаются с ERROR_PREFIX) выводятся в консоль всегда"""
 
-    def log(self, message, print_message=True):
-        """Добавляет сообщение в лог"""
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        log_entry = f"[{timestamp}] {message}"
-        self.log_messages.append(log_entry)
+    ERROR_PREFIX = "Ошибка"
 
-        if print_message:
-            print(message)
+    def __init__(self, echo=True, memory_limit=1000, flush_every=1000, console_rate=20, console_burst=100):
+        self.echo = echo  # Выводить ли сообщения в консоль
+        self.report_info = {}
+        self.report_sections = {}  # Дополнительные разделы отчета: заголовок -> текст
+        self.recent = deque(maxlen=memory_limit)  # Последние сообщения: (номер, время, текст, аргументы)
+        self.flush_every = flush_every
+        self.console_rate = console_rate
+        self.console_burst = console_burst
+
+        self.messages_count = 0
+        self.saved_count = 0  # Номер последнего сообщения, попавшего в сохраненный отчет
+        self.detail_path = None
+        self.detail_file = None
+        self.pending = []  # Сообщения, еще не записанные во временный файл
+
+        self.console_tokens = console_burst
+        self.console_time = time.monotonic()
+        self.console_suppressed = 0
+
+        self._timestamp_second = None
+        self._timestamp = ""
+
+    @property
+    def log_messages(self):
+        """Последние сообщения лога в виде строк с временем"""
+        return [self._format(record) for record in self.recent]
+
+    def add_report_info(self, name, value):
+        """Добавляет показатель запуска в итоговый отчет"""
+        self.report_info[name] = value
+
+    def add_report_section(self, title, text):
+        """Добавляет в итоговый отчет раздел перед подробным логом (например, JSON с метриками)"""
+        self.report_sections[title] = text
+
+    def log(self, message, *args, print_message=True):
+        """Добавляет сообщение в лог; args подставляются в message через % только при записи"""
+        self.messages_count += 1
+        record = (self.messages_count, time.time(), message, args)
+        self.recent.append(record)
+
+        if self.detail_file is not None:
+            self.pending.append(record)
+            if len(self.pending) >= self.flush_every:
+                self._flush()
+
+        if print_message and self.echo and (message.startswith(self.ERROR_PREFIX) or self._take_console_token()):
+            print(message % args if args else message)
+
+    def start_detail_log(self, report_path):
+        """Начинает потоковую запись подробного лога во временный файл рядом с отчетом"""
+        self.close_detail_log()
+        os.makedirs(os.path.dirname(report_path) or ".", exist_ok=True)
+        self.detail_path = report_path + ".log.part"
+        self.detail_file = open(self.detail_path, 'w', encoding='utf-8', buffering=1024 * 1024)
+
+        # Сообщения, записанные до начала потоковой записи (если они еще в памяти)
+        self.pending = [record for record in self.recent if record[0] > self.saved_count]
+
+    def close_detail_log(self):
+        """Закрывает и удаляет временный файл подробного лога"""
+        if self.detail_file is None:
+            return
+        self.detail_file.close()
+        os.remove(self.detail_path)
+        self.detail_file = None
+        self.detail_path = None
+        self.pending = []
 
     def save_report(self, report_path, total_orgs_migrated, total_posts_migrated,
                     files_processed, final_orgs_count, final_posts_count):
         """Сохраняет подробный отчет о миграции"""
         try:
-            import os
             os.makedirs(os.path.dirname(report_path), exist_ok=True)
 
             with open(report_path, 'w', encoding='utf-8') as f:
@@ -38,11 +107,66 @@ class VKMigratorLogger:
                 f.write(f"Итого организаций в базе: {final_orgs_count}\n")
                 f.write(f"Итого постов в базе: {final_posts_count}\n\n")
 
+                if self.report_info:
+                    f.write("=== ПОКАЗАТЕЛИ ЗАПУСКА ===\n")
+                    for name, value in self.report_info.items():
+                        f.write(f"{name}: {value}\n")
+                    f.write("\n")
+
+                for title, text in self.report_sections.items():
+                    f.write(f"=== {title} ===\n")
+                    f.write(text.rstrip("\n") + "\n\n")
+
                 f.write("=== ПОДРОБНЫЙ ЛОГ ===\n")
-                for message in self.log_messages:
-                    f.write(message + "\n")
+                if self.detail_file is not None:
+                    self._flush()
+                    self.detail_file.flush()
+                    with open(self.detail_path, 'r', encoding='utf-8') as detail:
+                        shutil.copyfileobj(detail, f)
+                else:
+                    # Без потоковой записи в отчет попадают только сообщения, оставшиеся в памяти
+                    for record in self.recent:
+                        if record[0] > self.saved_count:
+                            f.write(self._format(record) + "\n")
+
+            self.saved_count = self.messages_count
+            self.close_detail_log()
 
+            # Итоги после сохранения отчета выводятся в консоль без ограничения
+            self.console_tokens = self.console_burst
+            if self.console_suppressed:
+                self.log(f"В консоль не выведено сообщений: {self.console_suppressed} (полностью - в отчете)")
+                self.console_suppressed = 0
             self.log(f"Отчет сохранен: {report_path}")
 
         except Exception as e:
             self.log(f"Ошибка при сохранении отчета: {str(e)}")
+
+    def _flush(self):
+        """Форматирует накопленные сообщения и пишет их во временный файл одним вызовом"""
+        if self.pending:
+            self.detail_file.write("".join(self._format(record) + "\n" for record in self.pending))
+            self.pending = []
+
+    def _format(self, record):
+        """Строка лога с временем; время форматируется не чаще раза в секунду"""
+        _, timestamp, message, args = record
+        second = int(timestamp)
+        if second != self._timestamp_second:
+            self._timestamp_second = second
+            self._timestamp = datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+        return f"[{self._timestamp}] {message % args if args else message}"
+
+    def _take_console_token(self):
+        """Ограничивает вывод в консоль: console_burst сообщений подряд, затем console_rate в секунду"""
+        now = time.monotonic()
+        self.console_tokens = min(self.console_burst,
+                                  self.console_tokens + (now - self.console_time) * self.console_rate)
+        self.console_time = now
+
+        if self.console_tokens < 1:
+            self.console_suppressed += 1
+            return False
+
+        self.console_tokens -= 1
+        return True
@@ -6,6 +6,7 @@
 Структура проекта: wtg_admin/run_web_interface/
 """
 
+import argparse
 import sys
 import os
 
@@ -19,8 +20,37 @@ os.makedirs(os.path.join(current_dir, 'dumps', 'vk'), exist_ok=True)
 os.makedirs(os.path.join(current_dir, 'logs'), exist_ok=True)
 os.makedirs(os.path.join(current_dir, 'reports'), exist_ok=True)
 
+def parse_args():
+    """Разбирает параметры командной строки"""
+    parser = argparse.ArgumentParser(description="Миграция VK данных")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="количество процессов для анализа текстов постов (по умолчанию 1)")
+    parser.add_argument("--parallel-dumps", type=int, default=1,
+                        help="сколько дампов читать и анализировать одновременно (по умолчанию 1)")
+    parser.add_argument("--morphology", action="store_true",
+                        help="искать города в падежных формах через pymorphy2")
+    parser.add_argument("--full", action="store_true",
+                        help="прочитать все дампы полностью, не пропуская уже мигрированные")
+    parser.add_argument("--profile", choices=("bulk", "safe"), default="bulk",
+                        help="профиль соединений SQLite: bulk - быстрая загрузка, safe - надежная запись "
+                             "(по умолчанию bulk)")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="не удалять вторичные индексы на время загрузки (для небольшой дозагрузки)")
+    parser.add_argument("--recompute-stats", action="store_true",
+                        help="пересчитать итоговую статистику по всей базе и сверить с migration_stats")
+    parser.add_argument("--no-metrics", action="store_true",
+                        help="не замерять время этапов миграции (JSON раздел метрик в отчете)")
+    parser.add_argument("--dedupe-posts", action="store_true",
+                        help="удалить дубли постов (org_id, post_id) в старой целевой базе, оставив первый экземпляр")
+    parser.add_argument("--no-analysis-cache", action="store_true",
+                        help="не использовать кэш результатов анализа постов")
+    return parser.parse_args()
+
+
 def main():
     """Основная функция для запуска мигратора"""
+    args = parse_args()
+
     print("=== VK DATA MIGRATOR ===")
 
     # Пути к файлам
@@ -51,7 +81,12 @@ def main():
     try:
         from migrators.vk.VKDataMigrator import VKDataMigrator
 
-        migrator = VKDataMigrator(target_db, vk_dumps)
+        migrator = VKDataMigrator(target_db, vk_dumps, workers=args.workers,
+                                  parallel_dumps=args.parallel_dumps, morphology=args.morphology,
+                                  analysis_cache=not args.no_analysis_cache, incremental=not args.full,
+                                  connection_profile=args.profile, defer_indexes=not args.keep_indexes,
+                                  stats_full_recompute=args.recompute_stats,
+                                  pipeline_metrics=not args.no_metrics, dedupe_posts=args.dedupe_posts)
         migrator.run_migration()
 
         print("\n🎉 Миграция завершена успешно!")